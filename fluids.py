@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Water finding its own level, as array stencil updates over the chunks where it is on the move'
+
+'''
+Each cell holds some water (the chunks' water layer), in FULL-ths of a cell, standing on a floor
+that lies depth cells below ground level, where depth is that of its ground (1 for lakes and
+pits dug by mining, 0 for dry land).  Each step, water flows across every edge between two cells
+from the one whose surface (floor plus water) is higher, by a fifth of the difference, rounded
+down.  So any difference of less than 5 stays put, the amounts are whole numbers, no water is made
+or lost, and however it starts out the water settles in a finite number of steps.  A cell can lose
+at most a quarter of its water over each of its edges, so none ever has less than none.  Cells
+holding something that can't be walked through, and chunks not in memory, are walls.
+
+Only chunks with water on the move are stepped: a turn in which nothing flowed puts a chunk to
+sleep, until flow across an edge from a neighbor, or a change to its cells, wakes it again.  So a
+lake costs nothing until something disturbs it, and then only the chunks the disturbance reaches
+get turns, at most CHUNKS_PER_TICK of them each tick, of SUBSTEPS steps each.  A turn takes in
+the edges a chunk shares with its neighbors, and applies the flow across them to both sides, so
+it doesn't matter which of them are awake.
+
+Cells whose ground is the wet or dry terrain switch between the two as they fill and drain.
+'''
+
+import collections
+
+import numpy as np
+
+import worldgrid
+
+FULL = 1 << 14      # units of water that fill one cell
+_WALL = 1 << 24     # added to the surface of walls, above any water
+_EDGES = ( (-1, 0, (slice(1, -1), 0),  (slice(None), worldgrid.CHUNK_MASK))  # left: neighbor's rightmost column
+         , (1, 0,  (slice(1, -1), -1), (slice(None), 0))                     # right
+         , (0, -1, (0, slice(1, -1)),  (worldgrid.CHUNK_MASK, slice(None)))  # top: neighbor's bottom row
+         , (0, 1,  (-1, slice(1, -1)), (0, slice(None))) )                   # bottom
+
+class WaterFlow:
+  'Moves the water of a world towards level, a few chunks per tick'
+
+  CHUNKS_PER_TICK = 8
+  SUBSTEPS = 4  # steps of flow each time a chunk's turn comes
+
+  def __init__(self, world, wet, dry):
+    '''world must have: chunks (map from chunk coordinates to worldgrid.Chunk), registry,
+       dirtyChunks, and CellsChanged(rect).
+       wet and dry are the Terrain of cells that are at least half full of water and those that
+       aren't, for cells below ground level.'''
+    self.world = world
+    self.wet = wet
+    self.dry = dry
+    self.queue = collections.deque()  # coordinates of awake chunks, in the order they are to be stepped
+    self.awake = set()  # the same, for looking up
+    self.seen = set()   # coordinates of chunks that have been woken at least once
+    self.known = 0      # how many chunks the world had when last checked for new ones
+    self.tables = None  # lookup tables, indexed by registry ID: see Tables()
+    self.steps = 0      # chunk steps so far
+
+  def Tables(self):
+    'Return lookup tables, indexed by registry ID, of the floor of each ground, and which things are walls'
+    things = self.world.registry.things
+    if self.tables is None or len(self.tables[0]) != len(things):
+      self.tables = ( np.array([ -FULL * getattr(t, 'depth', 0) for t in things ], dtype=np.int32)
+                    , np.array([ not t is None and not t.IsTraversable() for t in things ]) )
+    return self.tables
+
+  def Flood(self, chunk):
+    'Fill the cells of a newly generated chunk that are below ground level to the brim'
+    floors, walls = self.Tables()
+    below = floors[chunk.ground] < 0
+    chunk.water[below] = -floors[chunk.ground[below]]
+
+  def Wake(self, cpos):
+    'Step the chunk at cpos when its turn comes, in case its water has somewhere to go'
+    if not cpos in self.awake:
+      self.awake.add(cpos)
+      self.queue.append(cpos)
+    self.seen.add(cpos)
+
+  def WakeAt(self, p):
+    self.Wake(worldgrid.ChunkOf(p))
+
+  def Update(self):
+    'Step the next few awake chunks'
+    if self.known != len(self.world.chunks):
+      # Chunks that have just been generated or loaded may not be level with their neighbors
+      self.known = len(self.world.chunks)
+      for cpos in sorted(self.world.chunks.keys() - self.seen):
+        self.Wake(cpos)
+    for i in range(min(self.CHUNKS_PER_TICK, len(self.queue))):
+      cpos = self.queue.popleft()
+      self.awake.discard(cpos)
+      chunk = self.world.chunks.get(cpos)
+      if not chunk is None and self.Step(chunk):
+        self.Wake(cpos)
+
+  def Padded(self, chunk):
+    '''Return (floor, water, neighbors): arrays of the floors (raised out of reach where there are
+       walls) and movable water of the cells of chunk, with a border of one cell from each neighbor
+       (leaving out the corners, across which nothing flows), and the neighboring chunks, in the
+       order of _EDGES (None where not in memory).'''
+    size = worldgrid.CHUNK_SIZE
+    floor = np.full((size + 2, size + 2), _WALL, dtype=np.int32)
+    water = np.zeros((size + 2, size + 2), dtype=np.int32)
+    neighbors = [ self.world.chunks.get((chunk.pos[0] + dx, chunk.pos[1] + dy)) for dx, dy, inner, outer in _EDGES ]
+    self.Fill(floor, water, (slice(1, -1), slice(1, -1)), chunk, (slice(None), slice(None)))
+    for neighbor, (dx, dy, inner, outer) in zip(neighbors, _EDGES):
+      if not neighbor is None:
+        self.Fill(floor, water, inner, neighbor, outer)
+    return (floor, water, neighbors)
+
+  def Fill(self, floor, water, inner, chunk, outer):
+    'Copy the floors and water of the cells outer of chunk into inner of the padded arrays'
+    floors, walls = self.Tables()
+    isWall = walls[chunk.thingIds[outer]] & (chunk.thingCounts[outer] > 0)
+    floor[inner] = floors[chunk.ground[outer]] + isWall * _WALL
+    water[inner] = np.where(isWall, 0, chunk.water[outer])  # walls' water stays where it is
+
+  @staticmethod
+  def Flow(floor, water):
+    'Return how much the water of each cell changes in one step, or None if none flows'
+    surface = floor + water
+    spare = water // 4  # most that can flow out over each edge
+    # Flow rightwards across vertical edges, and downwards across horizontal ones (negative for the other way)
+    across = surface[1:-1, :-1] - surface[1:-1, 1:]
+    right = np.where(across > 0, np.minimum(across // 5, spare[1:-1, :-1]), -np.minimum(-across // 5, spare[1:-1, 1:]))
+    across = surface[:-1, 1:-1] - surface[1:, 1:-1]
+    down = np.where(across > 0, np.minimum(across // 5, spare[:-1, 1:-1]), -np.minimum(-across // 5, spare[1:, 1:-1]))
+    if not (right.any() or down.any()):
+      return None
+    change = np.zeros(water.shape, dtype=np.int32)
+    change[1:-1, :-1] -= right
+    change[1:-1, 1:] += right
+    change[:-1, 1:-1] -= down
+    change[1:, 1:-1] += down
+    return change
+
+  def Step(self, chunk):
+    '''Let the water of chunk, and across its edges, flow for SUBSTEPS steps.  Returns whether any did.
+       The cells across the edges take part as if they had no other neighbors.'''
+    floor, water, neighbors = self.Padded(chunk)
+    before = water.copy()
+    for i in range(self.SUBSTEPS):
+      change = self.Flow(floor, water)
+      if change is None:
+        break
+      water += change
+    change = water - before
+    if not change.any():
+      return False
+    self.Apply(chunk, (slice(None), slice(None)), change[1:-1, 1:-1])
+    for neighbor, (dx, dy, inner, outer) in zip(neighbors, _EDGES):
+      if not neighbor is None and change[inner].any():
+        self.Apply(neighbor, outer, change[inner])
+        self.Wake(neighbor.pos)
+    self.steps += 1
+    return True
+
+  def Apply(self, chunk, s, change):
+    'Add change to the water of the cells s (a (rows, cols) pair) of chunk, and switch their ground between wet and dry to match'
+    water = chunk.water[s] + change
+    chunk.water[s] = water
+    self.world.dirtyChunks.add(chunk.pos)
+    wet, dry = self.world.registry.Id(self.wet), self.world.registry.Id(self.dry)
+    ground = chunk.ground[s].copy()
+    switched = np.where((ground == dry) & (water >= FULL // 2), wet, np.where((ground == wet) & (water < FULL // 2), dry, ground))
+    if np.array_equal(switched, ground):
+      return
+    chunk.ground[s] = switched
+    cells = np.zeros(chunk.ground.shape, dtype=bool)
+    cells[s] = switched != ground
+    rows, cols = np.nonzero(cells)
+    top, left = int(rows.min()), int(cols.min())
+    self.world.CellsChanged((chunk.origin[0] + left, chunk.origin[1] + top, int(cols.max()) - left + 1, int(rows.max()) - top + 1))
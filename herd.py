@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Simulating great numbers of animals at once, as parallel arrays rather than as objects'
+
+'''
+A Herd keeps the state of every animal in numpy arrays, one element per animal, and advances
+them all together each tick, by the same rules as the Herbivore and Carnivore classes:
+  * Animals use up energy as time passes, die when it falls below the minimum viable, and
+    split in two when it reaches their reproduction threshold.
+  * Each time its walking timeout runs out, an animal first eats: herbivores graze on the food
+    in their cell, carnivores eat a herbivore or carcass sharing their cell.
+  * Then it looks for the nearest things of interest within sight (herbivores for predators and
+    the player, carnivores for prey and the player), keeps to the moves that take it furthest
+    from (or closest to) them on average, and picks among those: usually carrying straight on,
+    otherwise at random.
+Only the animals whose timeouts have run out are looked at closely, and finding what each of
+them can see only compares it with what is in nearby buckets of cells.
+
+Animals far from the player needn't be simulated every tick.  Each tick, a levels function says
+for each animal whether to SIMULATE it as above, ESTIMATE it, or have it WAIT its turn; either
+way, animals are advanced by all the time since they were last brought up to date.  Estimated
+animals don't move, but for each step they would have taken they look in a random cell of their
+chunk and eat whatever they find there.
+
+Animals come and go as state dicts like those of Animal.GetState(), so a world saved with
+either kind of animal can be loaded with the other.
+'''
+
+import numpy as np
+
+import worldgrid
+
+HERBIVORE = 0
+CARNIVORE = 1
+
+# How to bring animals up to date this tick
+WAIT = 0
+SIMULATE = 1
+ESTIMATE = 2
+
+# Bits of the codes kept for each cell
+PASSABLE = 1
+FOOD = 2
+
+# Where an animal can go: staying put, then one step in each of the cardinal directions
+MOVES = np.array([ (0,0), (0,-1), (1,0), (0,1), (-1,0) ], dtype=np.int64)
+
+BUCKET_SHIFT = 5  # buckets for finding what animals can see must be at least as big as they can see
+_BUCKET_BIAS = 1 << 30
+
+def CellKeys(xs, ys):
+  'Return an int64 for each cell (xs[i], ys[i]) that is unique to it and ordered by (x, y)'
+  return ((xs + _BUCKET_BIAS) << 31) + (ys + _BUCKET_BIAS)
+
+def Ranks(keys):
+  'Return, for each element of keys, how many earlier elements have the same key'
+  order = np.argsort(keys, kind='stable')
+  sortedKeys = keys[order]
+  starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+  counts = np.diff(np.r_[starts, len(keys)])
+  ranks = np.empty(len(keys), dtype=np.int64)
+  ranks[order] = np.arange(len(keys)) - np.repeat(starts, counts)
+  return ranks
+
+def PairUp(keysA, keysB):
+  '''Pair elements of keysA with elements of keysB with the same key, each at most once, in order.
+     Returns (indices into keysA, indices into keysB).'''
+  if len(keysA) == 0 or len(keysB) == 0:
+    return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+  groups = np.unique(np.concatenate([keysA, keysB]), return_inverse=True)[1]
+  n = max(len(keysA), len(keysB))
+  a = groups[:len(keysA)] * n + Ranks(keysA)
+  b = groups[len(keysA):] * n + Ranks(keysB)
+  common, ia, ib = np.intersect1d(a, b, assume_unique=True, return_indices=True)
+  return (ia, ib)
+
+class Herd:
+  'All the animals of a world, as parallel arrays'
+
+  # (attribute name, dtype) of each array
+  FIELDS = ( ('x',            np.int64)
+           , ('y',            np.int64)
+           , ('species',      np.int8)
+           , ('energy',       np.int64)
+           , ('age',          np.int64)
+           , ('timeout',      np.int64)   # walking timeout
+           , ('dx',           np.int64)   # walking direction
+           , ('dy',           np.int64)
+           , ('speed',        np.float64)
+           , ('reproduction', np.int64)   # energy at which to reproduce
+           , ('updated',      np.int64)   # time up to which it has been simulated
+           )
+
+  def __init__(self, world, species, seed=0):
+    '''species is the (Herbivore, Carnivore) classes, whose constants the herd lives by, kept as .kinds.
+       The herd looks at the cells of world, and the position of its player.'''
+    self.world = world
+    self.kinds = species
+    herbivore, carnivore = species
+    self.minimumViable = herbivore.ENERGY_MINIMUM_VIABLE
+    self.expenditure = herbivore.ENERGY_EXPENDITURE_BASELINE
+    self.inefficiency = carnivore.DIGESTION_INEFFICIENCY
+    self.foodEnergy = herbivore.FOOD_ENERGY
+    self.sight = herbivore.SIGHT_RADIUS
+    self.margins = np.array([ cls.EnergySafetyMargin() for cls in species ], dtype=np.int64)
+    self.rng = np.random.default_rng(seed)
+    self.time = 0         # milliseconds of game time simulated so far
+    for name, dtype in self.FIELDS:
+      setattr(self, name, np.empty(0, dtype=dtype))
+    self.pending = []     # states of animals added since the last Flush()
+    self.tables = None    # (passable ground, passable thing, food) lookup tables indexed by registry ID
+    # What matters to animals about each cell of the chunks they have been in, packed into one array
+    self.codes = np.zeros((0, worldgrid.CHUNK_SIZE, worldgrid.CHUNK_SIZE), dtype=np.uint8)
+    self.slots = {}       # map from chunk coordinates to index into self.codes
+    self.slotKeys = np.empty(0, dtype=np.int64)   # CellKeys() of the chunks in self.slots, sorted
+    self.slotIndex = np.empty(0, dtype=np.int64)  # index into self.codes of each of slotKeys
+    self.staleCodes = set()  # coordinates of chunks whose codes are all out of date
+    self.staleRects = []     # rects of cells whose codes are out of date
+    self.bucketKeys = np.empty(0, dtype=np.int64)  # as of the last Sort()
+    self.pool = None      # a herdpool.RegionPool to keep the animals between ticks and step them a region at a time, if any
+
+  def __len__(self):
+    return len(self.x) + len(self.pending) + (0 if self.pool is None else self.pool.Count())
+
+  def AddStates(self, states):
+    'Add animals with the given Animal.GetState() dicts.  They join the herd at the next Flush().'
+    names = [ cls.__name__ for cls in self.kinds ]
+    for state in states:
+      if not state['class'] in names:
+        raise ValueError('not a kind of animal a herd can have: {}'.format(state['class']))
+    self.pending.extend(states)
+
+  def Flush(self):
+    'Bring animals added since the last Flush() into the arrays, or the pool holding the rest'
+    if not self.pending:
+      return
+    states, self.pending = self.pending, []
+    names = [ cls.__name__ for cls in self.kinds ]
+    columns = { 'x'            : [ s['pos'][0] for s in states ]
+              , 'y'            : [ s['pos'][1] for s in states ]
+              , 'species'      : [ names.index(s['class']) for s in states ]
+              , 'energy'       : [ s['energy'] for s in states ]
+              , 'age'          : [ s['age'] for s in states ]
+              , 'timeout'      : [ s['walkingTimeout'] for s in states ]
+              , 'dx'           : [ s['walkingDirection'][0] for s in states ]
+              , 'dy'           : [ s['walkingDirection'][1] for s in states ]
+              , 'speed'        : [ s['speed'] for s in states ]
+              , 'reproduction' : [ s['energy_reproduction'] for s in states ]
+              , 'updated'      : np.full(len(states), self.time)
+              }
+    if not self.pool is None and self.pool.holding:
+      self.pool.Add(self, columns)
+    else:
+      self.Append(columns)
+
+  def Append(self, columns, keep=slice(None)):
+    'Add animals with the given arrays of each field, keeping just those of the existing ones picked by keep (as Keep())'
+    for name, dtype in self.FIELDS:
+      setattr(self, name, np.concatenate([getattr(self, name)[keep], np.asarray(columns[name], dtype=dtype)]))
+
+  def Keep(self, mask):
+    'Keep just the animals picked by mask (booleans, or indices in the order to keep them)'
+    for name, dtype in self.FIELDS:
+      setattr(self, name, getattr(self, name)[mask])
+
+  def States(self, indices):
+    'Return a list of Animal.GetState() dicts for the animals at the given indices'
+    columns = [ getattr(self, name)[indices].tolist() for name, dtype in self.FIELDS ]
+    return [ { 'class': self.kinds[species].__name__, 'pos': [x, y], 'energy': energy, 'age': age
+             , 'walkingTimeout': timeout, 'walkingDirection': [dx, dy], 'speed': speed
+             , 'energy_reproduction': reproduction }
+             for x, y, species, energy, age, timeout, dx, dy, speed, reproduction, updated in zip(*columns) ]
+
+  def Settle(self, indices):
+    'Spend the energy used by the animals at indices since they were last brought up to date, as Animal.Settle() does'
+    elapsed = self.time - self.updated[indices]
+    self.updated[indices] = self.time
+    self.timeout[indices] = np.maximum(self.timeout[indices] - elapsed, 0)
+    live = self.energy[indices] >= self.minimumViable
+    self.energy[indices[live]] -= elapsed[live] * self.expenditure
+    self.age[indices[live]] += elapsed[live]
+
+  def StatesByChunk(self, cposList=None):
+    'Return a map from chunk coordinates (of those in cposList, or all) to a list of the states of the animals there'
+    self.Flush()
+    if not self.pool is None:
+      self.pool.Release(self)
+    cx = self.x >> worldgrid.CHUNK_SHIFT
+    cy = self.y >> worldgrid.CHUNK_SHIFT
+    keys = CellKeys(cx, cy)
+    indices = np.arange(len(keys))
+    if not cposList is None:
+      cposList = list(cposList)
+      wanted = CellKeys(np.array([ c[0] for c in cposList ], dtype=np.int64), np.array([ c[1] for c in cposList ], dtype=np.int64))
+      indices = indices[np.isin(keys, wanted)]
+    # Animals left waiting owe the energy of the time since, which GetState() has no room for
+    self.Settle(indices)
+    byChunk = {}
+    for i, state in zip(indices.tolist(), self.States(indices)):
+      byChunk.setdefault((int(cx[i]), int(cy[i])), []).append(state)
+    return byChunk
+
+  def InRect(self, r):
+    'Return (xs, ys, species, alive) arrays of the animals within rect r (left, top, width, height)'
+    self.Flush()
+    if not self.pool is None and self.pool.holding:
+      return self.pool.InRect(self, r)
+    inside = (self.x >= r[0]) & (self.x < r[0] + r[2]) & (self.y >= r[1]) & (self.y < r[1] + r[3])
+    return (self.x[inside], self.y[inside], self.species[inside], self.energy[inside] >= self.minimumViable)
+
+  def Census(self):
+    'Return (live herbivores, live carnivores, dead)'
+    self.Flush()
+    if not self.pool is None and self.pool.holding:
+      return self.pool.Census(self)
+    alive = self.energy >= self.minimumViable
+    return ( int(np.count_nonzero(alive & (self.species == HERBIVORE)))
+           , int(np.count_nonzero(alive & (self.species == CARNIVORE)))
+           , int(np.count_nonzero(~alive)) )
+
+  def Tables(self):
+    'Return lookup tables, indexed by registry ID, of which ground and things can be walked over, and what herbivores eat'
+    things = self.world.registry.things
+    if self.tables is None or len(self.tables[0]) != len(things):
+      food = self.kinds[HERBIVORE].FOOD
+      self.tables = ( np.array([ not t is None and t.IsTraversable() for t in things ])
+                    , np.array([ t is None or t.IsTraversable() for t in things ])
+                    , np.array([ isinstance(t, food) for t in things ]) )
+      self.staleCodes.update(self.slots)
+    return self.tables
+
+  def OnChange(self, evt):
+    'Notice cells of the world changing, to bring their codes up to date before they are next looked at'
+    if evt.dict.get('cellsChanged'):
+      self.staleRects.extend(evt.dict['rects'])
+
+  def Codes(self, chunk, s=(slice(None), slice(None))):
+    '''Return the codes of the cells of chunk (or the (rows, cols) slices s of it):
+       PASSABLE if an animal could walk there, plus FOOD if a herbivore could eat there'''
+    groundOk, thingOk, food = self.Tables()
+    thingIds = chunk.thingIds[s]
+    empty = chunk.thingCounts[s] == 0
+    passable = groundOk[chunk.ground[s]] & (empty | thingOk[thingIds])
+    return passable * np.uint8(PASSABLE) | (~empty & food[thingIds]) * np.uint8(FOOD)
+
+  def UpdateCodes(self):
+    for cpos in self.staleCodes:
+      self.codes[self.slots[cpos]] = self.Codes(self.world.Chunk(cpos))
+    for r in self.staleRects:
+      for cpos in worldgrid.ChunksOverlapping(r):
+        if cpos in self.slots and not cpos in self.staleCodes:
+          chunk = self.world.Chunk(cpos)
+          s = chunk.Slices(chunk.LocalRect(r))
+          self.codes[self.slots[cpos]][s] = self.Codes(chunk, s)
+    self.staleCodes.clear()
+    self.staleRects.clear()
+
+  def CellCodes(self, xs, ys):
+    '''Return the codes (as Codes()) of the cells (xs[i], ys[i]), 0 outside the world.
+       Chunks are generated as needed.'''
+    self.Tables()
+    codes = np.zeros(len(xs), dtype=np.uint8)
+    where = np.arange(len(xs))
+    if not self.world.sz is None:
+      where = np.flatnonzero((xs >= 0) & (ys >= 0) & (xs < self.world.sz[0]) & (ys < self.world.sz[1]))
+    if len(where) == 0:
+      return codes
+    xs = xs[where]
+    ys = ys[where]
+    i = self.EnsureSlots(xs, ys)
+    self.UpdateCodes()
+    codes[where] = self.codes[self.slotIndex[i], ys & worldgrid.CHUNK_MASK, xs & worldgrid.CHUNK_MASK]
+    return codes
+
+  def EnsureSlots(self, xs, ys):
+    'Make sure there are codes for the chunks of the cells (xs[i], ys[i]), and return where those chunks are in slotKeys'
+    keys = CellKeys(xs >> worldgrid.CHUNK_SHIFT, ys >> worldgrid.CHUNK_SHIFT)
+    i = np.searchsorted(self.slotKeys, keys)
+    missing = np.ones(len(keys), dtype=bool)
+    if len(self.slotKeys):
+      missing = self.slotKeys[np.minimum(i, len(self.slotKeys) - 1)] != keys
+    if missing.any():
+      for cx, cy in np.unique(np.stack([xs[missing], ys[missing]], axis=1) >> worldgrid.CHUNK_SHIFT, axis=0).tolist():
+        self.AddSlot((cx, cy))
+      # Slots are numbered in the order they were added, so unique()'s indices are slot numbers
+      self.slotKeys, self.slotIndex = np.unique(CellKeys(*np.array(list(self.slots), dtype=np.int64).reshape(-1, 2).T), return_index=True)
+      i = np.searchsorted(self.slotKeys, keys)
+    return i
+
+  def AddSlot(self, cpos):
+    'Make room for the codes of the chunk at cpos, generating it if necessary'
+    if len(self.slots) == len(self.codes):
+      codes = np.zeros((max(16, 2 * len(self.codes)), worldgrid.CHUNK_SIZE, worldgrid.CHUNK_SIZE), dtype=np.uint8)
+      codes[:len(self.codes)] = self.codes
+      self.codes = codes
+    self.slots[cpos] = len(self.slots)
+    self.codes[self.slots[cpos]] = self.Codes(self.world.Chunk(cpos))
+
+  def NearestTargets(self, seekers, targets, extra=None):
+    '''Find, for each of the animals at indices seekers, the nearest (and therefore equidistant) of
+       those at indices targets, plus the extra point (such as the player) if given, within sight.
+       targets must be in increasing order, and the herd in the order Sort() leaves it.
+       Returns (seeker numbers (positions within seekers), target xs, target ys), one entry per pair.'''
+    tx = self.x[targets]
+    ty = self.y[targets]
+    bucketKeys = CellKeys(tx >> BUCKET_SHIFT, ty >> BUCKET_SHIFT)
+    if not extra is None:
+      key = CellKeys(extra[0] >> BUCKET_SHIFT, extra[1] >> BUCKET_SHIFT)
+      i = np.searchsorted(bucketKeys, key)
+      tx = np.insert(tx, i, extra[0])
+      ty = np.insert(ty, i, extra[1])
+      bucketKeys = np.insert(bucketKeys, i, key)
+    sx = self.x[seekers]
+    sy = self.y[seekers]
+    empty = np.empty(0, dtype=np.int64)
+    if len(tx) == 0 or len(sx) == 0:
+      return (empty, empty, empty)
+    pairSeekers = []
+    pairTargets = []
+    for ox in (-1, 0, 1):
+      for oy in (-1, 0, 1):
+        keys = CellKeys((sx >> BUCKET_SHIFT) + ox, (sy >> BUCKET_SHIFT) + oy)
+        lo = np.searchsorted(bucketKeys, keys, 'left')
+        hi = np.searchsorted(bucketKeys, keys, 'right')
+        counts = hi - lo
+        total = int(counts.sum())
+        if total:
+          starts = np.cumsum(counts) - counts
+          pairSeekers.append(np.repeat(np.arange(len(sx)), counts))
+          pairTargets.append(np.repeat(lo - starts, counts) + np.arange(total))
+    if not pairSeekers:
+      return (empty, empty, empty)
+    ps = np.concatenate(pairSeekers)
+    pt = np.concatenate(pairTargets)
+    d = np.abs(sx[ps] - tx[pt]) + np.abs(sy[ps] - ty[pt])
+    seen = d <= self.sight
+    ps, pt, d = ps[seen], pt[seen], d[seen]
+    nearest = np.full(len(sx), np.iinfo(np.int64).max)
+    np.minimum.at(nearest, ps, d)
+    keep = d == nearest[ps]
+    return (ps[keep], tx[pt[keep]], ty[pt[keep]])
+
+  def Sort(self):
+    '''Keep animals in order of the bucket they are in, so that finding what is near them needs little sorting.
+       Leaves the CellKeys() of their buckets in .bucketKeys, until they next move.'''
+    keys = CellKeys(self.x >> BUCKET_SHIFT, self.y >> BUCKET_SHIFT)
+    order = np.argsort(keys, kind='stable')
+    if np.any(order != np.arange(len(order))):
+      self.Keep(order)
+      keys = keys[order]
+    self.bucketKeys = keys
+
+  def InBuckets(self, xs, ys):
+    'Return the indices, in increasing order, of the animals in the buckets of the cells (xs[i], ys[i]), as of the last Sort()'
+    keys = np.unique(CellKeys(xs >> BUCKET_SHIFT, ys >> BUCKET_SHIFT))
+    lo = np.searchsorted(self.bucketKeys, keys, 'left')
+    counts = np.searchsorted(self.bucketKeys, keys, 'right') - lo
+    starts = np.cumsum(counts) - counts
+    return np.repeat(lo - starts, counts) + np.arange(counts.sum())
+
+  def Graze(self, xs, ys):
+    'Eat up whatever is in the cells (xs[i], ys[i])'
+    # Unlike the player, animals don't light up the world as they go
+    self.world.ClearThingsAt(xs, ys)
+
+  def EdibleAt(self, xs, ys, alive, eaten):
+    'Return the indices of the herbivores and carcasses, not already eaten, in the cells (xs[i], ys[i])'
+    if len(xs) == 0:
+      return np.empty(0, dtype=np.int64)
+    cells = np.unique(CellKeys(xs, ys))
+    edible = self.InBuckets(xs, ys)
+    edible = edible[((self.species[edible] == HERBIVORE) | ~alive[edible]) & ~eaten[edible]]
+    edibleKeys = CellKeys(self.x[edible], self.y[edible])
+    i = np.minimum(np.searchsorted(cells, edibleKeys), len(cells) - 1)
+    return edible[cells[i] == edibleKeys]
+
+  def Update(self, dt, levels=None):
+    '''Advance time by dt milliseconds, bringing the animals whose turn it is up to date.
+       levels(cx, cy) returns, for arrays of chunk coordinates, whether the animals in those chunks
+       are to SIMULATE, ESTIMATE or WAIT; by default all are simulated.
+       Returns an array of (x, y) cells whose animals have changed in how they look or where they are.'''
+    self.time += dt
+    self.Flush()
+    if not self.pool is None:
+      return self.pool.Update(self, levels)
+    self.Sort()
+    if levels is None:
+      level = np.full(len(self.x), SIMULATE)
+    else:
+      # Buckets are smaller than chunks, so it's enough to ask once for each bucket
+      starts = np.flatnonzero(np.r_[True, self.bucketKeys[1:] != self.bucketKeys[:-1]]) if len(self.x) else np.empty(0, dtype=np.int64)
+      level = levels(self.x[starts] >> worldgrid.CHUNK_SHIFT, self.y[starts] >> worldgrid.CHUNK_SHIFT)
+      level = np.repeat(level, np.diff(np.r_[starts, len(self.x)]))
+    return self.Step(level)
+
+  def Step(self, level):
+    '''Bring the animals up to date, as Update() does, given the SIMULATE, ESTIMATE or WAIT level of each.
+       The herd must be in the order Sort() leaves it.'''
+    changed = []
+    due = level != WAIT
+    elapsed = self.time - self.updated
+    self.updated[due] = self.time
+    alive = self.energy >= self.minimumViable
+    live = alive & due
+    simulated = live & (level == SIMULATE)
+    self.timeout[simulated] = np.maximum(self.timeout[simulated] - elapsed[simulated], 0)
+    eaten = np.zeros(len(self.x), dtype=bool)
+    # Estimates first, as they need animals to be where they were at the last Sort()
+    estimated = np.flatnonzero(live & (level == ESTIMATE))
+    if len(estimated):
+      changed.append(self.Estimate(estimated, elapsed[estimated], alive, eaten))
+    ready = np.flatnonzero(simulated & ~eaten & (self.timeout <= 0))
+    if len(ready):
+      changed.append(self.Walk(ready, alive, eaten))
+    live &= ~eaten
+    self.energy[live] -= elapsed[live] * self.expenditure
+    self.age[live] += elapsed[live]
+    died = live & (self.energy < self.minimumViable)
+    changed.append(np.stack([self.x[died], self.y[died]], axis=1))
+    parents = np.flatnonzero(live & ~died & (self.energy >= self.reproduction))
+    if len(parents):
+      half = self.reproduction[parents] // 2
+      self.energy[parents] -= half
+      energy = half + self.margins[self.species[parents]]
+      changed.append(np.stack([self.x[parents], self.y[parents]], axis=1))
+      # Dropping those eaten at the same time
+      self.Append({ 'x': self.x[parents], 'y': self.y[parents], 'species': self.species[parents]
+                  , 'energy': energy, 'age': np.zeros(len(parents)), 'timeout': np.zeros(len(parents))
+                  , 'dx': self.rng.integers(-1, 2, len(parents)), 'dy': self.rng.integers(-1, 2, len(parents))
+                  , 'speed': self.speed[parents], 'reproduction': energy * 2
+                  , 'updated': np.full(len(parents), self.time) }, ~eaten)
+    elif eaten.any():
+      self.Keep(~eaten)
+    return np.concatenate(changed)
+
+  def Estimate(self, indices, elapsed, alive, eaten):
+    '''Have the animals at indices (all alive) eat what they might have in the elapsed times, without
+       moving: for each step they would have taken, each looks in a random cell of its chunk.
+       Marks those eaten in eaten.  Returns an array of (x, y) cells that have changed.'''
+    steps = elapsed * self.speed[indices]
+    steps = steps.astype(np.int64) + (self.rng.random(len(indices)) < steps % 1)
+    who = np.repeat(indices, steps)
+    xs = (self.x[who] & ~worldgrid.CHUNK_MASK) + self.rng.integers(0, worldgrid.CHUNK_SIZE, len(who))
+    ys = (self.y[who] & ~worldgrid.CHUNK_MASK) + self.rng.integers(0, worldgrid.CHUNK_SIZE, len(who))
+    # Herbivores graze on what they find, one to a cell
+    grazing = self.species[who] == HERBIVORE
+    grazing[grazing] = (self.CellCodes(xs[grazing], ys[grazing]) & FOOD) != 0
+    cells, first = np.unique(CellKeys(xs[grazing], ys[grazing]), return_index=True)
+    if len(first):
+      np.add.at(self.energy, who[grazing][first], self.foodEnergy)
+      self.Graze(xs[grazing][first], ys[grazing][first])
+    # Carnivores eat a herbivore or carcass they find, each at most once
+    hunting = np.flatnonzero(self.species[who] == CARNIVORE)
+    edible = self.EdibleAt(xs[hunting], ys[hunting], alive, eaten)
+    ia, ib = PairUp(CellKeys(xs[hunting], ys[hunting]), CellKeys(self.x[edible], self.y[edible]))
+    eaters, victims = who[hunting[ia]], edible[ib]
+    np.add.at(self.energy, eaters, self.energy[victims] // self.inefficiency)
+    self.energy[victims] = 0
+    eaten[victims] = True
+    return np.stack([self.x[victims], self.y[victims]], axis=1)
+
+  def Walk(self, ready, alive, eaten):
+    '''Have the animals at indices ready (all alive) eat, then pick where to go and move there.
+       Marks those eaten in eaten.  Returns an array of (x, y) cells that have changed.'''
+    changed = []
+    herbivores = ready[self.species[ready] == HERBIVORE]
+    carnivores = ready[self.species[ready] == CARNIVORE]
+    # Herbivores graze, one to a cell
+    if len(herbivores):
+      grazing = herbivores[(self.CellCodes(self.x[herbivores], self.y[herbivores]) & FOOD) != 0]
+      cells, first = np.unique(CellKeys(self.x[grazing], self.y[grazing]), return_index=True)
+      self.energy[grazing[first]] += self.foodEnergy
+      self.Graze(self.x[grazing[first]], self.y[grazing[first]])
+    # Carnivores each eat one herbivore or carcass in their cell
+    if len(carnivores):
+      carnivoreKeys = CellKeys(self.x[carnivores], self.y[carnivores])
+      edible = self.EdibleAt(self.x[carnivores], self.y[carnivores], alive, eaten)
+      ia, ib = PairUp(carnivoreKeys, CellKeys(self.x[edible], self.y[edible]))
+      eaters, victims = carnivores[ia], edible[ib]
+      self.energy[eaters] += self.energy[victims] // self.inefficiency
+      self.energy[victims] = 0
+      eaten[victims] = True
+      changed.append(np.stack([self.x[victims], self.y[victims]], axis=1))
+      ready = ready[~eaten[ready]]
+    # Where could each go?
+    cx = self.x[ready][:,np.newaxis] + MOVES[:,0]
+    cy = self.y[ready][:,np.newaxis] + MOVES[:,1]
+    allowed = ((self.CellCodes(cx.ravel(), cy.ravel()) & PASSABLE) != 0).reshape(cx.shape)
+    allowed[:,0] = True
+    # Flee from the nearest carnivores, or chase the nearest herbivores
+    player = self.world.player.pos
+    notEaten = ~eaten
+    for kind, others, sign in ( (HERBIVORE, CARNIVORE, -1.0), (CARNIVORE, HERBIVORE, 1.0) ):
+      seekers = np.flatnonzero(self.species[ready] == kind)
+      targets = np.flatnonzero((self.species == others) & notEaten)
+      ps, tx, ty = self.NearestTargets(ready[seekers], targets, player)
+      if len(ps) == 0:
+        continue
+      n = np.bincount(ps, minlength=len(seekers))
+      hasTargets = n > 0
+      metric = np.empty((len(seekers), len(MOVES)))
+      for m in range(len(MOVES)):
+        d = np.abs(cx[seekers[ps], m] - tx) + np.abs(cy[seekers[ps], m] - ty)
+        metric[:,m] = sign * np.bincount(ps, weights=d, minlength=len(seekers))
+      metric = np.where(allowed[seekers], metric, np.inf)
+      best = metric.min(axis=1, keepdims=True)
+      rows = seekers[hasTargets]
+      allowed[rows] &= (metric == best)[hasTargets]
+    # Usually carry straight on, otherwise go anywhere allowed
+    forward = np.full(len(ready), -1)
+    for m, (mx, my) in enumerate(MOVES.tolist()):
+      forward[(self.dx[ready] == mx) & (self.dy[ready] == my)] = m
+    straight = (forward >= 0) & allowed[np.arange(len(ready)), np.maximum(forward, 0)] & (self.rng.integers(0, 5, len(ready)) > 0)
+    choice = np.where(allowed, self.rng.random(allowed.shape), -1.0).argmax(axis=1)
+    choice = np.where(straight, forward, choice)
+    moving = ready[choice != 0]
+    changed.append(np.stack([self.x[moving], self.y[moving]], axis=1))
+    self.dx[ready] = MOVES[choice, 0]
+    self.dy[ready] = MOVES[choice, 1]
+    self.x[ready] += self.dx[ready]
+    self.y[ready] += self.dy[ready]
+    changed.append(np.stack([self.x[moving], self.y[moving]], axis=1))
+    self.timeout[ready] += (1.0 / self.speed[ready]).astype(np.int64)
+    return np.concatenate(changed) if changed else np.empty((0,2), dtype=np.int64)
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Stepping a Herd a region at a time, spread over worker processes'
+
+'''
+The map is divided into regions: strips of REGION_CHUNKS columns of chunks.  Once it has taken
+over a herd, a RegionPool keeps its animals between ticks, partitioned by region, in blocks of
+shared memory, along with the codes of the cells animals look at.  Each region has two blocks of
+animals, which take turns: the current one, and one for its next tick to be written into.
+
+Each tick, every region that has animals due is stepped by a worker process.  A worker reads the
+region's current animals plus a halo of those in the column of buckets either side from its
+neighbors' current blocks (all that its animals can see), steps just its own animals, with the
+halo ones there to be seen, and writes those that are still in the region, including those
+born this tick, into the region's other block.  Only the animals that have crossed into a
+neighboring region come back, along with the cells grazed and whose animals changed, and the
+chunks that animals are now near that have no codes yet.  They join their new region's block
+once every region has been stepped, in region order, and the region's blocks swap.
+
+Whatever an animal does happens in its own cell, or is decided by what it can see as of the
+start of the tick, so regions can be stepped in any order, or all at once.  Each region draws
+random numbers from a generator seeded by the world's seed, the time and the region, so the
+outcome is the same however many workers there are (including one, when regions are stepped
+one after another in this process, in arrays of its own).  It is not the same as stepping the
+whole herd at once, which shares one random number generator between all the animals.
+
+While the pool has them, the herd's own arrays are empty: Herd.InRect() and Herd.Census() look
+at the regions, and anything else that needs the whole herd, such as saving it, takes the
+animals back with Release(), for the pool to take over again at the next tick.
+'''
+
+import os
+import concurrent.futures
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import worldgrid
+import herd
+
+REGION_CHUNKS = 4  # columns of chunks in each region
+_ANIMAL_BYTES = sum( np.dtype(dtype).itemsize for name, dtype in herd.Herd.FIELDS )
+
+def RegionOf(xs):
+  'Return the region of each cell column xs[i]'
+  return (xs >> worldgrid.CHUNK_SHIFT) // REGION_CHUNKS
+
+def Columns(block, capacity):
+  '''Return a map from field name to an array of that field of capacity animals, one after another
+     in block (a byte array of capacity * _ANIMAL_BYTES, capacity a multiple of 8)'''
+  columns = {}
+  offset = 0
+  for name, dtype in herd.Herd.FIELDS:
+    columns[name] = np.ndarray(capacity, dtype=dtype, buffer=block, offset=offset)
+    offset += capacity * np.dtype(dtype).itemsize
+  return columns
+
+def Pick(columns, keep):
+  'Return a map from field name to array of the animals picked by keep from columns (a map from field name to array, or a Herd)'
+  if isinstance(columns, dict):
+    return { name: np.asarray(columns[name], dtype=dtype)[keep] for name, dtype in herd.Herd.FIELDS }
+  return { name: getattr(columns, name)[keep] for name, dtype in herd.Herd.FIELDS }
+
+def Join(parts):
+  'Return a map from field name to array of the animals of all of parts (maps from field name to array)'
+  return { name: np.concatenate([ part[name] for part in parts ] + [np.empty(0, dtype=dtype)]) for name, dtype in herd.Herd.FIELDS }
+
+class SharedArrays:
+  'Numpy arrays in blocks of shared memory, which worker processes can attach to by name'
+
+  def __init__(self):
+    self.blocks = {}    # map from block name to SharedMemory
+    self.retired = []   # names of blocks freed that some worker may still have hold of
+    self.forgotten = 0  # how many names have been dropped from the front of retired
+    self.seen = {}      # map from worker process ID to how many of the names ever retired it has let go of
+
+  def New(self, shape, dtype):
+    'Return (a new array in a block of shared memory, a reference to it for Attach())'
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    self.blocks[block.name] = block
+    return (np.ndarray(shape, dtype=dtype, buffer=block.buf), (block.name, dtype, shape))
+
+  def Free(self, ref):
+    'Free the block of an array New() returned, once nothing here refers to it'
+    block = self.blocks.pop(ref[0])
+    block.close()
+    block.unlink()
+    self.retired.append(ref[0])
+
+  def Retired(self):
+    'Return (how many names were retired before them, the names in retired) for Forget()'
+    return (self.forgotten, tuple(self.retired))
+
+  def Seen(self, pid, n):
+    '''Note that worker process pid has let go of the first n blocks ever retired, and stop sending the
+       names of those every worker has let go of.  A worker that hasn't been heard from yet hasn't
+       attached to anything, so has nothing to let go of.'''
+    self.seen[pid] = max(n, self.seen.get(pid, 0))
+    done = min(self.seen.values()) - self.forgotten
+    if done > 0:
+      del self.retired[:done]
+      self.forgotten += done
+
+  def Close(self):
+    for block in self.blocks.values():
+      block.close()
+      block.unlink()
+    self.blocks.clear()
+
+_attached = {}  # in a worker, map from shared memory block name to SharedMemory
+_forgotten = 0  # in a worker, how many of the names ever retired it has let go of
+
+def Attach(ref):
+  'Return the array a SharedArrays.New() returned ref to, or ref itself if it is already an array'
+  if isinstance(ref, np.ndarray):
+    return ref
+  name, dtype, shape = ref
+  block = _attached.get(name)
+  if block is None:
+    block = shared_memory.SharedMemory(name=name)
+    _attached[name] = block
+  return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def Forget(retired):
+  '''Let go of the blocks of shared memory that have been freed, given (how many were retired before,
+     names retired since) as SharedArrays.Retired() returns.  Returns how many of the names ever
+     retired have now been let go of.'''
+  global _forgotten
+  first, names = retired
+  for name in names[max(0, _forgotten - first):]:
+    block = _attached.pop(name, None)
+    if not block is None:
+      block.close()
+  _forgotten = first + len(names)
+  return _forgotten
+
+class Partition:
+  'The animals of one region, in two blocks that take turns'
+
+  def __init__(self):
+    self.blocks = [None, None]  # (Columns(), reference for Attach() to the block they are in, capacity) of each, once made
+    self.current = 0    # which of blocks holds the animals
+    self.count = 0      # how many animals it holds, at the start of each column
+    self.rows = None    # (first, last) rows of chunks the animals are in, if any
+
+  def Animals(self):
+    'Return a map from field name to array of the animals, as views of the current block'
+    return { name: column[:self.count] for name, column in self.blocks[self.current][0].items() }
+
+  def AddRows(self, ys):
+    if len(ys):
+      cy = ys >> worldgrid.CHUNK_SHIFT
+      rows = (int(cy.min()), int(cy.max()))
+      self.rows = rows if self.rows is None else (min(self.rows[0], rows[0]), max(self.rows[1], rows[1]))
+
+class RegionPool:
+  'Keeps a herd by region between ticks, and steps it a region at a time, with a pool of worker processes if there is more than one'
+
+  def __init__(self, workers=1, seed=0):
+    self.workers = workers
+    self.seed = seed
+    self.shared = SharedArrays() if workers > 1 else None
+    self.executor = None
+    self.holding = False  # whether the herd's animals are here rather than in its arrays
+    self.regions = {}     # map from region to Partition
+    self.sharing = {}     # map from name to (array in shared memory, reference to it) of the herd's that are kept there
+    self.herd = None      # the herd last taken over
+
+  def Close(self):
+    'Stop any worker processes, and give the animals, and what the herd keeps in shared memory, back to the herd'
+    if not self.executor is None:
+      self.executor.shutdown()
+      self.executor = None
+    if not self.herd is None:
+      self.Release(self.herd)
+      for name in self.sharing:
+        setattr(self.herd, name, getattr(self.herd, name).copy())
+    for r in list(self.regions):
+      self.Drop(r)
+    self.sharing.clear()
+    if not self.shared is None:
+      self.shared.Close()
+
+  def New(self, shape, dtype):
+    'Return (a new array, a reference to it for Attach()), in shared memory if there are worker processes'
+    if self.shared is None:
+      array = np.empty(shape, dtype=dtype)
+      return (array, array)
+    return self.shared.New(shape, dtype)
+
+  def Free(self, ref):
+    if not self.shared is None:
+      self.shared.Free(ref)
+
+  def Share(self, name, array):
+    '''Return (array, a reference to it for Attach()), having moved array into shared memory first if there
+       are worker processes and it is not there already, for the caller to use in place of the original'''
+    if self.shared is None:
+      return (array, array)
+    old = self.sharing.get(name)
+    if not old is None and old[0] is array:
+      return old
+    new = self.shared.New(array.shape, array.dtype)
+    new[0][...] = array
+    self.sharing[name] = new
+    if not old is None:
+      ref = old[1]
+      old = None
+      self.Free(ref)
+    return new
+
+  def Reserve(self, part, which, size):
+    'Make sure block which of Partition part has room for size animals, keeping those it has'
+    old = part.blocks[which]
+    if not old is None and old[2] >= size:
+      return
+    capacity = max(16, (2 * size + 7) & ~7)
+    block, ref = self.New(capacity * _ANIMAL_BYTES, np.uint8)
+    part.blocks[which] = (Columns(block, capacity), ref, capacity)
+    if not old is None:
+      if which == part.current:
+        for name, column in part.blocks[which][0].items():
+          column[:part.count] = old[0][name][:part.count]
+      ref = old[1]
+      old = None
+      self.Free(ref)
+
+  def Drop(self, region):
+    refs = [ block[1] for block in self.regions.pop(region).blocks if not block is None ]
+    for ref in refs:
+      self.Free(ref)
+
+  def Count(self):
+    'Return how many animals the pool is holding'
+    return sum( part.count for part in self.regions.values() )
+
+  def Store(self, animals):
+    'Add animals (a map from field name to array) to the regions they are in'
+    regions = RegionOf(animals['x'])
+    order = np.argsort(regions, kind='stable')
+    animals = Pick(animals, order)
+    regions = regions[order]
+    starts = np.flatnonzero(np.r_[True, regions[1:] != regions[:-1]]) if len(regions) else np.empty(0, dtype=np.int64)
+    for lo, hi in zip(starts.tolist(), np.r_[starts[1:], len(regions)].tolist()):
+      r = int(regions[lo])
+      part = self.regions.get(r)
+      if part is None:
+        part = self.regions[r] = Partition()
+      self.Reserve(part, part.current, part.count + hi - lo)
+      for name, column in part.blocks[part.current][0].items():
+        column[part.count:part.count + hi - lo] = animals[name][lo:hi]
+      part.count += hi - lo
+      part.AddRows(animals['y'][lo:hi])
+
+  def Adopt(self, h):
+    'Take over the animals of herd h, leaving its arrays empty'
+    self.herd = h
+    h.EnsureSlots(*Reach(h.x, h.y))
+    self.Store(Pick(h, slice(None)))
+    h.Keep(np.empty(0, dtype=np.int64))
+    for r in [ r for r, part in self.regions.items() if part.count == 0 ]:
+      self.Drop(r)
+    self.holding = True
+
+  def Add(self, h, columns):
+    'Add animals to those of herd h the pool is holding, given a map from field name to a list or array of each field'
+    animals = Pick(columns, slice(None))
+    h.EnsureSlots(*Reach(animals['x'], animals['y']))
+    self.Store(animals)
+
+  def Release(self, h):
+    'Give the animals back to the arrays of herd h, keeping the blocks of the regions to use again'
+    if not self.holding:
+      return
+    parts = [ self.regions[r] for r in sorted(self.regions) ]
+    for name, column in Join([ part.Animals() for part in parts ]).items():
+      setattr(h, name, column)
+    for part in parts:
+      part.count = 0
+      part.rows = None
+    self.holding = False
+
+  def InRect(self, h, r):
+    'Return (xs, ys, species, alive) arrays of the animals within rect r, as Herd.InRect() does'
+    found = []
+    if r[2] > 0:
+      for region in range(int(RegionOf(r[0])), int(RegionOf(r[0] + r[2] - 1)) + 1):
+        if region in self.regions:
+          animals = self.regions[region].Animals()
+          x = animals['x']
+          y = animals['y']
+          inside = (x >= r[0]) & (x < r[0] + r[2]) & (y >= r[1]) & (y < r[1] + r[3])
+          found.append(Pick(animals, inside))
+    found = Join(found)
+    return (found['x'], found['y'], found['species'], found['energy'] >= h.minimumViable)
+
+  def Census(self, h):
+    'Return (live herbivores, live carnivores, dead), as Herd.Census() does'
+    census = np.zeros(3, dtype=np.int64)
+    for part in self.regions.values():
+      animals = part.Animals()
+      alive = animals['energy'] >= h.minimumViable
+      census += ( np.count_nonzero(alive & (animals['species'] == herd.HERBIVORE))
+                , np.count_nonzero(alive & (animals['species'] == herd.CARNIVORE))
+                , np.count_nonzero(~alive) )
+    return tuple(census.tolist())
+
+  def Update(self, h, levels=None):
+    '''Bring the animals of herd h whose turn it is up to date, as h.Update() does, taking them over
+       first if the pool isn't holding them.  Returns an array of (x, y) cells whose animals have changed.'''
+    if not self.holding:
+      self.Adopt(h)
+    h.UpdateCodes()
+    h.codes, codes = self.Share('codes', h.codes)
+    h.slotKeys, slotKeys = self.Share('slotKeys', h.slotKeys)
+    h.slotIndex, slotIndex = self.Share('slotIndex', h.slotIndex)
+    common = { 'kinds': h.kinds, 'time': h.time, 'seed': self.seed, 'sz': h.world.sz
+             , 'player': tuple(h.world.player.pos), 'codes': codes, 'slotKeys': slotKeys, 'slotIndex': slotIndex
+             , 'retired': (0, ()) if self.shared is None else self.shared.Retired() }
+    tasks = []
+    for r in sorted(self.regions):
+      part = self.regions[r]
+      # Ask once for each chunk the region's animals might be in
+      cx, cy = np.meshgrid(np.arange(r * REGION_CHUNKS, (r + 1) * REGION_CHUNKS), np.arange(part.rows[0], part.rows[1] + 1))
+      grid = np.full(cx.shape, herd.SIMULATE) if levels is None else levels(cx, cy)
+      if not np.any(grid != herd.WAIT):
+        continue
+      self.Reserve(part, 1 - part.current, 2 * part.count)  # room for every animal to have young
+      neighbors = [ self.regions.get(r - 1), self.regions.get(r + 1) ]
+      tasks.append( dict(common, region=r, levels=grid, firstRow=part.rows[0]
+                        , own=part.blocks[part.current][1:] + (part.count,)
+                        , neighbors=[ n.blocks[n.current][1:] + (n.count,) for n in neighbors if not n is None ]
+                        , out=part.blocks[1 - part.current][1:]) )
+    if self.workers > 1 and len(tasks) > 1:
+      if self.executor is None:
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+      results = list(self.executor.map(StepRegion, tasks))
+    else:
+      results = [ StepRegion(task) for task in tasks ]
+    if not tasks:
+      return np.empty((0,2), dtype=np.int64)
+    # Swap the blocks of the regions stepped, then move those that left into their new regions
+    for task, (count, rows, leaving, grazed, changed, missing, seen) in zip(tasks, results):
+      if not self.shared is None:
+        self.shared.Seen(*seen)
+      part = self.regions[task['region']]
+      part.current = 1 - part.current
+      part.count = count
+      part.rows = rows
+      if len(grazed):
+        h.Graze(grazed[:,0], grazed[:,1])
+    self.Store(Join([ leaving for count, rows, leaving, grazed, changed, missing, seen in results ]))
+    for r in [ r for r, part in self.regions.items() if part.count == 0 ]:
+      self.Drop(r)
+    missing = np.concatenate([ missing for count, rows, leaving, grazed, changed, missing, seen in results ])
+    if len(missing):
+      h.EnsureSlots(missing[:,0] << worldgrid.CHUNK_SHIFT, missing[:,1] << worldgrid.CHUNK_SHIFT)
+    return np.concatenate([ changed for count, rows, leaving, grazed, changed, missing, seen in results ])
+
+def Reach(xs, ys):
+  'Return (xs, ys) of cells in every chunk that animals at (xs[i], ys[i]) might step into'
+  local = np.stack([xs, ys]) & worldgrid.CHUNK_MASK
+  edge = np.flatnonzero(((local == 0) | (local == worldgrid.CHUNK_MASK)).any(axis=0))
+  return ( np.concatenate([xs] + [ xs[edge] + mx for mx, my in herd.MOVES[1:].tolist() ])
+         , np.concatenate([ys] + [ ys[edge] + my for mx, my in herd.MOVES[1:].tolist() ]) )
+
+def Cells(keys):
+  'Return an array of the (x, y) that gave each of CellKeys() keys'
+  return np.stack([ (keys >> 31) - herd._BUCKET_BIAS, (keys & 0x7FFFFFFF) - herd._BUCKET_BIAS ], axis=1)
+
+class RegionHerd(herd.Herd):
+  'The animals of one region and its halo, in a worker, as a Herd that marks which are its own'
+
+  FIELDS = herd.Herd.FIELDS + ( ('home', np.bool_), )
+
+  def __init__(self, task):
+    super().__init__(RegionWorld(task), task['kinds'], seed=[task['seed'] & 0xFFFFFFFFFFFFFFFF, task['time'], task['region'] & 0xFFFFFFFF])
+    self.time = task['time']
+    self.slotKeys = Attach(task['slotKeys'])
+    self.slotIndex = Attach(task['slotIndex'])
+    self.codes = Attach(task['codes'])
+    self.grazed = []  # arrays of CellKeys() of the cells grazed so far
+    ref, capacity, count = task['own']
+    parts = [ Pick(Columns(Attach(ref), capacity), slice(0, count)) ]
+    # And those of the neighbors within a bucket of the region's edges
+    reach = 1 << herd.BUCKET_SHIFT
+    left = task['region'] * REGION_CHUNKS * worldgrid.CHUNK_SIZE
+    right = left + REGION_CHUNKS * worldgrid.CHUNK_SIZE
+    for ref, capacity, n in task['neighbors']:
+      columns = Columns(Attach(ref), capacity)
+      x = columns['x'][:n]
+      parts.append(Pick(columns, np.flatnonzero((x >= left - reach) & (x < right + reach))))
+    for name, column in Join(parts).items():
+      setattr(self, name, column)
+    self.home = np.arange(len(self.x)) < count
+    self.Sort()
+
+  def Append(self, columns, keep=slice(None)):
+    # Those born here are this region's
+    columns.setdefault('home', np.ones(len(columns['x']), dtype=bool))
+    super().Append(columns, keep)
+
+  def Tables(self):
+    return None
+
+  def UpdateCodes(self):
+    pass
+
+  def CellCodes(self, xs, ys):
+    'Return the codes of the cells (xs[i], ys[i]) as they were at the start of the tick, less the food grazed since'
+    codes = np.zeros(len(xs), dtype=np.uint8)
+    inside = np.ones(len(xs), dtype=bool)
+    if not self.world.sz is None:
+      inside = (xs >= 0) & (ys >= 0) & (xs < self.world.sz[0]) & (ys < self.world.sz[1])
+    keys = herd.CellKeys(xs >> worldgrid.CHUNK_SHIFT, ys >> worldgrid.CHUNK_SHIFT)
+    i = np.minimum(np.searchsorted(self.slotKeys, keys), max(0, len(self.slotKeys) - 1))
+    inside &= self.slotKeys[i] == keys if len(self.slotKeys) else False
+    codes[inside] = self.codes[self.slotIndex[i[inside]], ys[inside] & worldgrid.CHUNK_MASK, xs[inside] & worldgrid.CHUNK_MASK]
+    if self.grazed:
+      codes[np.isin(herd.CellKeys(xs, ys), np.concatenate(self.grazed))] &= ~np.uint8(herd.FOOD)
+    return codes
+
+  def Graze(self, xs, ys):
+    self.grazed.append(herd.CellKeys(xs, ys))
+
+class RegionWorld:
+  'What a RegionHerd needs to know of the world'
+
+  class Player:
+    def __init__(self, pos):
+      self.pos = pos
+
+  def __init__(self, task):
+    self.sz = task['sz']
+    self.player = self.Player(task['player'])
+
+def StepRegion(task):
+  '''Step the animals of one region, as RegionPool.Update() describes, writing those still in the
+     region into the block task['out'].  Returns (how many it wrote, the (first, last) rows of chunks
+     they are in or None, a map from field name to array of those that left the region, an array of
+     (x, y) cells grazed, an array of (x, y) cells whose animals have changed, an array of (x, y)
+     chunks animals are now near that have no codes, and (the ID of this process, how many retired
+     blocks it has let go of)).'''
+  forgotten = Forget(task['retired'])
+  h = RegionHerd(task)
+  level = np.full(len(h.x), herd.WAIT)
+  cx = (h.x[h.home] >> worldgrid.CHUNK_SHIFT) - task['region'] * REGION_CHUNKS
+  cy = (h.y[h.home] >> worldgrid.CHUNK_SHIFT) - task['firstRow']
+  level[h.home] = task['levels'][cy, cx]
+  changed = h.Step(level)
+  staying = np.flatnonzero(h.home & (RegionOf(h.x) == task['region']))
+  ref, capacity = task['out']
+  for name, column in Columns(Attach(ref), capacity).items():
+    column[:len(staying)] = getattr(h, name)[staying]
+  rows = None
+  if len(staying):
+    cy = h.y[staying] >> worldgrid.CHUNK_SHIFT
+    rows = (int(cy.min()), int(cy.max()))
+  grazed = np.concatenate(h.grazed) if h.grazed else np.empty(0, dtype=np.int64)
+  # Only animals that moved can be near chunks that weren't given codes before
+  xs, ys = Reach(changed[:,0], changed[:,1])
+  keys = np.unique(herd.CellKeys(xs >> worldgrid.CHUNK_SHIFT, ys >> worldgrid.CHUNK_SHIFT))
+  if len(h.slotKeys):
+    keys = keys[h.slotKeys[np.minimum(np.searchsorted(h.slotKeys, keys), len(h.slotKeys) - 1)] != keys]
+  return (len(staying), rows, Pick(h, h.home & (RegionOf(h.x) != task['region'])), Cells(grazed), changed, Cells(keys), (os.getpid(), forgotten))
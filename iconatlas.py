@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Icons of one size packed into a few large surfaces, to be blitted a sub-rectangle at a time'
+
+'''
+An IconAtlas composes each icon once, copies it into a slot of one of its pages, and from then
+on draws it by blitting that slot.  Pages are fixed-size surfaces in the display's pixel format
+(once there is a display), so blits from them need no conversion, and adding more icons only
+ever adds pages rather than moving what is already there.
+'''
+
+import pygame
+
+class IconAtlas:
+  'All the icons of one size, keyed by whatever they are icons of, or by what determines how it looks'
+
+  PAGE_SLOTS = 16     # icons along each edge of a page...
+  PAGE_PIXELS = 1024  # ...unless that would make it larger than this
+
+  def __init__(self, size, compose, keyOf=None):
+    '''size is the (width, height) of every icon.
+       compose(item, size) is called to create the image of each item's icon the first time it is needed.
+       keyOf(item) is what icons are stored by, so that items with the same key share one (by default, the item itself).'''
+    self.size = (size[0], size[1])
+    self.compose = compose
+    self.keyOf = (lambda item: item) if keyOf is None else keyOf
+    self.columns = max(1, min(self.PAGE_SLOTS, self.PAGE_PIXELS // max(1, self.size[0])))
+    self.rows = max(1, min(self.PAGE_SLOTS, self.PAGE_PIXELS // max(1, self.size[1])))
+    self.pages = []   # list of Surface
+    self.slots = {}   # map from keyOf(item) to (page, Rect within it)
+
+  def __len__(self):
+    return len(self.slots)
+
+  def __contains__(self, item):
+    return self.keyOf(item) in self.slots
+
+  def nbytes(self):
+    return sum( page.get_bytesize() * page.get_width() * page.get_height() for page in self.pages )
+
+  def NewPage(self):
+    page = pygame.Surface((self.columns * self.size[0], self.rows * self.size[1]), pygame.SRCALPHA)
+    if pygame.display.get_surface():
+      page = page.convert_alpha()
+    page.fill((0,0,0,0))
+    self.pages.append(page)
+
+  def Slot(self, item):
+    'Return (page, rect) of the icon for item, composing it if nothing with its key has been seen before'
+    key = self.keyOf(item)
+    slot = self.slots.get(key)
+    if slot is None:
+      n = len(self.slots)
+      i, n = divmod(n, self.columns * self.rows)
+      if i == len(self.pages):
+        self.NewPage()
+      rect = pygame.Rect((n % self.columns) * self.size[0], (n // self.columns) * self.size[1], self.size[0], self.size[1])
+      # The slot is fully transparent, so taking the max of each channel copies the image exactly.
+      self.pages[i].blit(self.compose(item, self.size), rect, special_flags=pygame.BLEND_RGBA_MAX)
+      slot = (self.pages[i], rect)
+      self.slots[key] = slot
+    return slot
+
+  def AddAll(self, items):
+    for item in items:
+      self.Slot(item)
+
+  def Blit(self, dest, item, pos):
+    'Draw the icon for item onto dest at pos'
+    page, rect = self.Slot(item)
+    dest.blit(page, pos, rect)
+
+  def Image(self, item):
+    'Return the icon for item as a subsurface of its page'
+    page, rect = self.Slot(item)
+    return page.subsurface(rect)
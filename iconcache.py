@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Finding icon images on disk, and caching them in memory and between runs'
+
+import os, json, zipfile, collections
+
+import numpy as np
+import pygame
+
+_DEBUG = False
+def BUGPRINT(fmtstr, *posargs, **kwargs):
+  if _DEBUG: print(fmtstr.format(*posargs, **kwargs))
+
+def IconName(filename):
+  'Return the name an icon file is found under: "wood-axe.png" and "WoodAxe.svg.png" are both "woodaxe"'
+  name = filename[:-len('.png')].lower()
+  if name.endswith('.svg'):
+    name = name[:-len('.svg')]
+  return name.replace('-', '').replace('_', '')
+
+def IndexIcons(root, preferred=('marty',)):
+  '''Return a map from icon name to the path of every .png file under the directory root.
+     Where names clash, files directly in root win, then those under the preferred subdirectories
+     (in order), then the rest in order of path.'''
+  found = []
+  for dirpath, dirnames, filenames in os.walk(root):
+    dirnames.sort()
+    rel = os.path.relpath(dirpath, root).split(os.sep)
+    if rel == ['.']:
+      rank = 0
+    elif rel[0] in preferred:
+      rank = 1 + preferred.index(rel[0])
+    else:
+      rank = 1 + len(preferred)
+    for filename in sorted(filenames):
+      if filename.lower().endswith('.png'):
+        found.append( (rank, dirpath, filename) )
+  index = {}
+  for rank, dirpath, filename in sorted(found):
+    index.setdefault(IconName(filename), os.path.join(dirpath, filename))
+  return index
+
+def SurfaceBytes(surf):
+  'Return roughly how much memory the pixels of a pygame Surface take'
+  return surf.get_bytesize() * surf.get_width() * surf.get_height()
+
+class IconCache:
+  'A map from keys to Surfaces that forgets the least recently used ones once they exceed budget bytes'
+
+  def __init__(self, budget):
+    self.budget = budget
+    self.entries = collections.OrderedDict()  # map from key to (Surface, bytes), least recently used first
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def Get(self, key):
+    'Return the Surface for key, or None if it is not cached'
+    entry = self.entries.get(key)
+    if entry is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.entries.move_to_end(key)
+    return entry[0]
+
+  def Put(self, key, surf):
+    'Cache surf for key, then forget the least recently used entries (other than this one) until within budget'
+    old = self.entries.pop(key, None)
+    if not old is None:
+      self.nbytes -= old[1]
+    size = SurfaceBytes(surf)
+    self.entries[key] = (surf, size)
+    self.nbytes += size
+    while self.nbytes > self.budget and len(self.entries) > 1:
+      oldKey, (oldSurf, oldSize) = self.entries.popitem(last=False)
+      self.nbytes -= oldSize
+      self.evictions += 1
+    return surf
+
+  def Clear(self):
+    self.entries.clear()
+    self.nbytes = 0
+
+  def Stats(self):
+    return '{} entries, {} KiB of {} KiB, {} hits, {} misses, {} evictions'.format(
+      len(self.entries), self.nbytes // 1024, self.budget // 1024, self.hits, self.misses, self.evictions)
+
+class IconStore:
+  '''Finished icon images saved to a file between runs, so they needn't be composed again.
+     Keys are strings, which should say everything the image depends upon (e.g. its source file's
+     modification time, its color and its size).  The whole store is discarded if its stamp differs
+     from the one it was saved with.'''
+
+  VERSION = 1
+
+  def __init__(self, path, stamp):
+    self.path = path
+    self.stamp = [self.VERSION, stamp]
+    self.images = {}   # map from key to (width, height, RGBA bytes)
+    self.used = set()  # keys looked up or stored this run
+    self.changed = False
+    self.Load()
+
+  def __len__(self):
+    return len(self.images)
+
+  def Load(self):
+    'Read every image in the file at once'
+    try:
+      with np.load(self.path) as f:
+        index = json.loads(str(f['index']))
+        if index['stamp'] != self.stamp:
+          BUGPRINT('icon store {} is out of date', self.path)
+          return
+        pixels = f['pixels']
+      images = {}
+      for key, offset, width, height in index['images']:
+        data = pixels[offset:offset + width*height*4].tobytes()
+        if len(data) != width*height*4:
+          raise ValueError('image {} runs past the end of the pixels'.format(key))
+        images[key] = (width, height, data)
+    except (OSError, EOFError, ValueError, KeyError, TypeError, zipfile.BadZipFile) as e:
+      # A missing or damaged store is no worse than an empty one
+      if os.path.exists(self.path):
+        print('Ignoring icon store {}: {}'.format(self.path, e))
+      return
+    self.images = images
+    BUGPRINT('loaded {} icons from {}', len(self.images), self.path)
+
+  def Get(self, key):
+    'Return a new Surface for key, or None if it is not stored'
+    image = self.images.get(key)
+    if image is None:
+      return None
+    self.used.add(key)
+    width, height, data = image
+    return pygame.image.frombytes(data, (width, height), 'RGBA')
+
+  def Put(self, key, surf):
+    self.images[key] = (surf.get_width(), surf.get_height(), pygame.image.tobytes(surf, 'RGBA'))
+    self.used.add(key)
+    self.changed = True
+    return surf
+
+  def Save(self):
+    'Write the images used this run back to the file, if any were new (so that stale ones are dropped)'
+    if not self.changed:
+      return
+    keys = sorted(self.used)
+    images = []
+    offset = 0
+    for key in keys:
+      width, height, data = self.images[key]
+      images.append( (key, offset, width, height) )
+      offset += len(data)
+    pixels = np.frombuffer(b''.join( self.images[key][2] for key in keys ), dtype=np.uint8)
+    index = json.dumps({'stamp': self.stamp, 'images': images})
+    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+    tmppath = self.path + '.tmp'
+    with open(tmppath, 'wb') as f:
+      np.savez(f, index=np.array(index), pixels=pixels)
+    os.replace(tmppath, self.path)
+    self.changed = False
+    BUGPRINT('saved {} icons to {}', len(images), self.path)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Plants spreading over the map, as a cellular automaton over the arrays of a few chunks at a time'
+
+'''
+Each rule says what plant takes root in an empty cell of walkable ground, at a rate (per
+millisecond) for each of the eight neighboring cells that holds the plant it spreads from, plus
+a rate at which it appears of its own accord.  Chunks take turns, a few per tick, and each is
+grown by however long it has been since its last turn, so a cell's chance of being taken over
+is 1 - exp(-rate * elapsed) however often turns come round.  Where more than one plant could
+take root, each gets its share of the cells taken in proportion to its chance.
+
+Only the chunks in memory grow, and the cells next to them count only if their chunks are in
+memory too.  A chunk's first turn just starts its clock.
+'''
+
+import collections
+
+import numpy as np
+
+import worldgrid
+
+class Rule:
+  'How one kind of plant spreads'
+
+  def __init__(self, plant, source, rate, seedRate=0.0, blocks=False):
+    '''plant is the Thing that grows, one to a cell, next to cells holding source, at rate per neighbor.
+       It also appears in any empty cell at seedRate.
+       blocks is whether it can't be walked through, so mustn't grow where anyone is.'''
+    self.plant = plant
+    self.source = source
+    self.rate = rate
+    self.seedRate = seedRate
+    self.blocks = blocks
+
+def NeighborCounts(mask):
+  'Return how many of the eight neighbors of each inner cell of the boolean array mask are set (so 2 smaller each way)'
+  m = mask.astype(np.uint8)
+  return ( m[:-2,:-2] + m[:-2,1:-1] + m[:-2,2:]
+         + m[1:-1,:-2]              + m[1:-1,2:]
+         + m[2:,:-2]  + m[2:,1:-1]  + m[2:,2:] )
+
+class PlantGrowth:
+  'Grows plants in the chunks of a world, a few chunks per tick'
+
+  CHUNKS_PER_TICK = 4
+  INTERVAL = 1000  # ms, the least time between a chunk's turns
+  MAX_CHANGED_RECTS = 16  # cells grown in a turn beyond which their bounding rect is reported instead
+
+  def __init__(self, world, rules, seed=0):
+    '''world must have: chunks (map from chunk coordinates to worldgrid.Chunk), registry, time,
+       dirtyChunks, CellsChanged(rect), and OccupiedCells(rect).  rules is a list of Rule.'''
+    self.world = world
+    self.rules = rules
+    self.rng = np.random.default_rng([seed & 0xFFFFFFFFFFFFFFFF, 0x91a47])
+    self.queue = collections.deque()  # coordinates of chunks still to have their turn this round
+    self.grown = {}   # map from chunk coordinates to the time of their last turn
+    self.walkable = None  # lookup table, indexed by registry ID, of which ground can be walked over
+    self.planted = 0  # cells planted so far
+
+  def Walkable(self):
+    things = self.world.registry.things
+    if self.walkable is None or len(self.walkable) != len(things):
+      self.walkable = np.array([ not t is None and t.IsTraversable() for t in things ])
+    return self.walkable
+
+  def Update(self):
+    'Give the next few chunks their turn'
+    for i in range(self.CHUNKS_PER_TICK):
+      if not self.queue:
+        self.queue.extend(sorted(self.world.chunks))
+        if not self.queue:
+          return
+      cpos = self.queue.popleft()
+      chunk = self.world.chunks.get(cpos)
+      if chunk is None:
+        continue  # paged out since the round began
+      last = self.grown.setdefault(cpos, self.world.time)
+      if self.world.time - last >= self.INTERVAL:
+        self.grown[cpos] = self.world.time
+        self.Grow(chunk, self.world.time - last)
+
+  def Padded(self, chunk, layer):
+    'Return the named layer of chunk with a border of one cell from its neighbors (zero where not in memory)'
+    size = worldgrid.CHUNK_SIZE
+    padded = np.zeros((size + 2, size + 2), dtype=getattr(chunk, layer).dtype)
+    for dy in (-1, 0, 1):
+      for dx in (-1, 0, 1):
+        neighbor = self.world.chunks.get((chunk.pos[0] + dx, chunk.pos[1] + dy))
+        if neighbor is None:
+          continue
+        src = getattr(neighbor, layer)
+        # Which rows and columns of the neighbor land in the padded array
+        rows = slice(0, size) if dy == 0 else (slice(size - 1, size) if dy < 0 else slice(0, 1))
+        cols = slice(0, size) if dx == 0 else (slice(size - 1, size) if dx < 0 else slice(0, 1))
+        top = 1 if dy == 0 else (0 if dy < 0 else size + 1)
+        left = 1 if dx == 0 else (0 if dx < 0 else size + 1)
+        padded[top:top + rows.stop - rows.start, left:left + cols.stop - cols.start] = src[rows, cols]
+    return padded
+
+  def Grow(self, chunk, elapsed):
+    'Grow plants in chunk for elapsed ms'
+    registry = self.world.registry
+    ids = self.Padded(chunk, 'thingIds')
+    ids[self.Padded(chunk, 'thingCounts') == 0] = worldgrid.NOTHING
+    empty = (chunk.thingCounts == 0) & self.Walkable()[chunk.ground]
+    if not empty.any():
+      return
+    # The chance of each rule taking each cell, and of any of them doing so
+    chances = []
+    for rule in self.rules:
+      rate = rule.rate * NeighborCounts(ids == registry.Id(rule.source)) + rule.seedRate
+      chances.append(1.0 - np.exp(-rate * elapsed))
+    total = 1.0 - np.prod([ 1.0 - c for c in chances ], axis=0)
+    roll = self.rng.random(empty.shape)
+    taken = empty & (roll < total)
+    if not taken.any():
+      return
+    # Among the cells taken, share them out between rules in proportion to their chances
+    share = self.rng.random(empty.shape) * np.sum(chances, axis=0)
+    below = np.zeros(empty.shape)
+    blocked = None
+    planted = np.zeros(empty.shape, dtype=bool)
+    for rule, chance in zip(self.rules, chances):
+      mine = taken & (share >= below) & (share < below + chance)
+      below += chance
+      if rule.blocks and mine.any():
+        if blocked is None:
+          blocked = np.zeros(empty.shape, dtype=bool)
+          for x, y in self.world.OccupiedCells(chunk.Rect()):
+            blocked[y - chunk.origin[1], x - chunk.origin[0]] = True
+        mine &= ~blocked
+      if mine.any():
+        chunk.thingIds[mine] = registry.Id(rule.plant)
+        chunk.thingCounts[mine] = 1
+        self.planted += int(np.count_nonzero(mine))
+        planted |= mine
+    if planted.any():
+      self.world.dirtyChunks.add(chunk.pos)
+      # Only the cells that have grown need redrawing
+      rows, cols = np.nonzero(planted)
+      if len(rows) <= self.MAX_CHANGED_RECTS:
+        for row, col in zip(rows.tolist(), cols.tolist()):
+          self.world.CellsChanged((chunk.origin[0] + col, chunk.origin[1] + row, 1, 1))
+      else:
+        top, left = int(rows.min()), int(cols.min())
+        self.world.CellsChanged((chunk.origin[0] + left, chunk.origin[1] + top, int(cols.max()) - left + 1, int(rows.max()) - top + 1))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Advancing a simulation in fixed ticks, independently of how often the screen is drawn'
+
+'''
+Each frame, the real time that has passed (times the speed factor, for overclocking) is added to
+what the simulation owes, and it is then stepped a whole tick at a time until it has caught up or
+the frame's time budget is spent.  Every step is the same length, so the outcome doesn't depend on
+the frame rate, and overclocking runs more ticks rather than longer ones.  Whatever can't be
+caught up on is carried over to the next frame, up to a limit beyond which it is dropped (and
+reported), so that a slow machine runs the world slowly rather than falling ever further behind.
+'''
+
+import time
+
+class FixedStepScheduler:
+  'Calls step(tick) enough times per frame to keep up with real time, as far as the budget allows'
+
+  REPORT_INTERVAL = 5000  # ms of real time between reports of falling behind
+
+  def __init__(self, step, tick, speed=1, budget=None, maxLag=None, clock=time.perf_counter):
+    '''step(dt) advances the simulation by dt, which is always tick.
+       speed is how many times faster than real time to run.
+       budget is how much real time, in ms, to spend stepping per frame (None for no limit).
+       maxLag is how far, in simulated ms, to let the simulation fall behind before dropping time
+       (by default, a quarter of a second of real time's worth).
+       clock() returns the time in seconds.'''
+    assert tick > 0 and speed > 0
+    self.step = step
+    self.tick = tick
+    self.speed = speed
+    self.budget = budget
+    self.maxLag = max(tick, 250 * speed) if maxLag is None else maxLag
+    self.clock = clock
+    self.owed = 0         # simulated time due but not yet stepped, in ms
+    self.ticks = 0        # ticks stepped in total
+    self.frameTicks = 0   # ticks stepped in the last frame
+    self.dropped = 0      # simulated time given up on, in ms
+    self.reported = 0     # dropped as of the last report
+    self.sinceReport = 0  # real time since the last report, in ms
+
+  def Advance(self, elapsed):
+    'Account for elapsed ms of real time, and step as many ticks as are due and there is time for'
+    self.owed += elapsed * self.speed
+    start = self.clock()
+    n = 0
+    while self.owed >= self.tick:
+      # Always make some progress, however far over budget the last tick went
+      if n and not self.budget is None and (self.clock() - start) * 1000 >= self.budget:
+        break
+      self.step(self.tick)
+      self.owed -= self.tick
+      n += 1
+    self.ticks += n
+    self.frameTicks = n
+    if self.owed > self.maxLag:
+      self.dropped += self.owed - self.maxLag
+      self.owed = self.maxLag
+    self.sinceReport += elapsed
+    if self.dropped > self.reported and self.sinceReport >= self.REPORT_INTERVAL:
+      print('Simulation is falling behind: dropped {} ms of game time'.format(self.dropped - self.reported))
+      self.reported = self.dropped
+      self.sinceReport = 0
+    return n
+
+  def Behind(self):
+    'Return whether there is at least a whole tick still owed'
+    return self.owed >= self.tick
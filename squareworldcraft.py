@@ -11,7 +11,6 @@ TODO:
   * Add more ores, lots more types of everything
   * Add critters/creatures
   * More procedural map generation
-  * (Re)consider using numpy to enable larger/faster maps
   * enable FULLSCREEN toggle
   * Better organized scaling, icon sizes, and fonts
     - Better managed themeing?
@@ -115,13 +114,24 @@ An Iconography
 
 '''
 
-import sys, enum, math, random, itertools, glob, csv, argparse
+import sys, os, enum, math, random, itertools, heapq, csv, argparse, zlib
+import concurrent.futures
 
-#import numpy as np
+import numpy as np
 import pygame
 
 import windowing
 from windowing import *
+import worldgrid
+import worldfile
+import worldnoise
+import iconatlas
+import iconcache
+import herd
+import herdpool
+import plants
+import fluids
+import scheduler
 
 _DEBUG = False
 def IFDEBUG(value):
@@ -138,6 +148,16 @@ def ceildiv(n, d):  # numerator or dividend, denominator or divisor
   'Integer division, but rounding up.'
   return (n + (d-1)) // d
 
+def CellRectsWithin(cells, r):
+  'Return a list of one-cell rects for the cells, in an array of (x, y) rows, that lie within rect r'
+  inside = (cells[:,0] >= r.left) & (cells[:,0] < r.right) & (cells[:,1] >= r.top) & (cells[:,1] < r.bottom)
+  return [ pygame.Rect(p, (1,1)) for p in cells[inside].tolist() ]
+
+def RandomRound(x, rng=random):
+  'Round x up or down at random, in proportion to its fractional part, so that on average the result is x.'
+  n = int(x)
+  return n + (rng.random() < x - n)
+
 def ManhattanDistance(p, q):
   "Return the distance between p and q if you can only move horizontally or vertically."
   return abs(q[0]-p[0])+abs(q[1]-p[1])
@@ -159,6 +179,10 @@ class Thing:
   def SymbolName(self):
     return ''                       # short chemical symbol string ("Cu" or "H₂O"), if desired
 
+  def Spec(self):
+    'Return a JSON-able description of this Thing, from which ThingFromSpec() can recreate it'
+    return {'class': self.__class__.__name__}
+
   color_rgb = (255,0,255)
   color_hsv = (300,100,100)
   hardness = 1
@@ -171,54 +195,108 @@ class Thing:
 
   def GetColor(self): return HSV2RGB(self.color_hsv)
 
-  icon_cache = {}
+  ICON_CACHE_BUDGET = 32*1024*1024  # bytes, for the cache of scaled icons
+  icon_sources = {}  # map from path of each icon file to its image as loaded, by IndexIcons()
+  icon_cache = iconcache.IconCache(ICON_CACHE_BUDGET)    # map from IconKey() and size to image as composed
+
+  @classmethod
+  def SetIconCacheBudget(cls, budget):
+    cls.icon_cache.budget = budget
 
   @classmethod
   def FlushIconCache(cls):
-    cls.icon_cache = {}
+    cls.icon_cache.Clear()
+
+  icon_index = None   # map from icon name to path of its file, from iconcache.IndexIcons()
+  icon_mtimes = {}    # map from path of each icon file to its modification time
+  icon_paths = {}     # map from (class, BaseIconName()) to path of the icon file, or None if there is none
+  icon_store = None   # iconcache.IconStore of composed icons saved from previous runs, if any
+
+  @classmethod
+  def IndexIcons(cls, root='icons'):
+    '''Find and load all the icon files, so that looking for icons never needs to touch the filesystem.
+       There are few enough of them to keep them all, rather than load them again when evicted.'''
+    cls.icon_index = iconcache.IndexIcons(root)
+    cls.icon_mtimes = { path: os.stat(path).st_mtime_ns for path in cls.icon_index.values() }
+    cls.icon_sources = { path: pygame.image.load(path) for path in cls.icon_index.values() }
+    cls.icon_paths = {}
+
+  def IconNames(self):
+    'Yield the names an icon might be found under, most specific first: those of each class this is an instance of'
+    yield self.BaseIconName()
+    for cls in type(self).__mro__[1:]:
+      if issubclass(cls, Thing):
+        yield cls.__name__
+
+  def IconPath(self):
+    'Return the path of the icon file for this thing, or None if it has none'
+    key = (type(self), self.BaseIconName())
+    if not key in Thing.icon_paths:
+      if Thing.icon_index is None:
+        Thing.IndexIcons()
+      path = None
+      for name in self.IconNames():
+        path = Thing.icon_index.get(iconcache.IconName(name + '.png'))
+        if not path is None:
+          break
+      Thing.icon_paths[key] = path
+    return Thing.icon_paths[key]
 
   def LoadIcon(self):
-    # TODO:
-    #  walk up the inheritance tree for names
-    #  use fnmatch?
-    name = self.BaseIconName()
-    if name in Thing.icon_cache:
-      return Thing.icon_cache[name]
-    for filename in glob.glob('icons/'+name.lower()+'.png'):
-      icon = pygame.image.load(filename)
-      Thing.icon_cache[name] = icon
-      return icon
-    return None
+    path = self.IconPath()
+    if path is None:
+      return None
+    return Thing.icon_sources[path]
+
+  def IconKey(self):
+    'Return what determines how this thing looks, so that things that look alike can share icons'
+    return (self.BaseIconName(), tuple(self.GetColor()), self.SymbolName())
 
   def GetIcon(self, size=(64,64)):
-    key = (self, (size[0],size[1]))
+    key = (self.IconKey(), (size[0],size[1]))
     if size[0] < 1 or size[1] < 1:
       key = (None, (0,0))  # all zero-size surfaces are alike
-    if not key in Thing.icon_cache:
-      img = pygame.Surface( size, pygame.SRCALPHA )
-      srcIcon = self.LoadIcon()
-      DROPSHADOW = 2
-      if srcIcon is None or size[0]<DROPSHADOW or size[1]<DROPSHADOW:
-        img.fill( self.GetColor() )
-        #pygame.draw.circle(img, (255,0,255), (16,16), 8)
-      else:
-        scaledSrcIcon = pygame.transform.scale(srcIcon, (size[0]-DROPSHADOW, size[1]-DROPSHADOW))
-        img.blit(scaledSrcIcon, (DROPSHADOW,DROPSHADOW))
-        scaledSrcIcon.fill( self.GetColor(), special_flags=pygame.BLEND_MAX )
-        img.blit(scaledSrcIcon, (0,0))
-        if self.SymbolName():
-          txt_img = pygame.font.SysFont('freemono', size[1]//2, bold=True).render(self.SymbolName(), True, (0,0,0))
-          sym_img = pygame.Surface( (txt_img.get_width()+4, txt_img.get_height()+4), pygame.SRCALPHA )
-          sym_img.blit(txt_img, ( 0, 2))
-          sym_img.blit(txt_img, ( 4, 2))
-          sym_img.blit(txt_img, ( 2, 0))
-          sym_img.blit(txt_img, ( 2, 4))
-          txt_img.fill( (255,255,255), special_flags=pygame.BLEND_MAX )
-          sym_img.blit(txt_img, ( 2, 2))
-          sym_img.fill( (255,255,255,127), None, pygame.BLEND_RGBA_MULT)
-          img.blit(sym_img, (img.get_width()//2-sym_img.get_width()//2, img.get_height()//2-sym_img.get_height()//2))
-      Thing.icon_cache[key] = img
-    return Thing.icon_cache[key]
+    icon = Thing.icon_cache.Get(key)
+    if icon is None:
+      icon = Thing.icon_cache.Put(key, self.StoredIcon(key[1]))
+    return icon
+
+  def StoredIcon(self, size):
+    'Like ComposeIcon(), but reusing the image from a previous run if it is in the icon store'
+    path = self.IconPath()
+    if Thing.icon_store is None or path is None:
+      return self.ComposeIcon(size)  # plain colored squares are quicker to draw than to load
+    key = '{}:{}:{}:{}:{}x{}'.format(path, Thing.icon_mtimes.get(path), tuple(self.GetColor()), self.SymbolName(), size[0], size[1])
+    icon = Thing.icon_store.Get(key)
+    if icon is None:
+      icon = Thing.icon_store.Put(key, self.ComposeIcon(size))
+    return icon
+
+  def ComposeIcon(self, size):
+    'Return a new image of this thing: its icon tinted with its color, or just its color if it has no icon'
+    img = pygame.Surface( size, pygame.SRCALPHA )
+    srcIcon = self.LoadIcon()
+    DROPSHADOW = 2
+    if srcIcon is None or size[0]<DROPSHADOW or size[1]<DROPSHADOW:
+      img.fill( self.GetColor() )
+      #pygame.draw.circle(img, (255,0,255), (16,16), 8)
+    else:
+      scaledSrcIcon = pygame.transform.scale(srcIcon, (size[0]-DROPSHADOW, size[1]-DROPSHADOW))
+      img.blit(scaledSrcIcon, (DROPSHADOW,DROPSHADOW))
+      scaledSrcIcon.fill( self.GetColor(), special_flags=pygame.BLEND_MAX )
+      img.blit(scaledSrcIcon, (0,0))
+      if self.SymbolName():
+        txt_img = manager.TextImage(manager.SysFont('freemono', size[1]//2, bold=True), self.SymbolName(), (0,0,0)).copy()
+        sym_img = pygame.Surface( (txt_img.get_width()+4, txt_img.get_height()+4), pygame.SRCALPHA )
+        sym_img.blit(txt_img, ( 0, 2))
+        sym_img.blit(txt_img, ( 4, 2))
+        sym_img.blit(txt_img, ( 2, 0))
+        sym_img.blit(txt_img, ( 2, 4))
+        txt_img.fill( (255,255,255), special_flags=pygame.BLEND_MAX )
+        sym_img.blit(txt_img, ( 2, 2))
+        sym_img.fill( (255,255,255,127), None, pygame.BLEND_RGBA_MULT)
+        img.blit(sym_img, (img.get_width()//2-sym_img.get_width()//2, img.get_height()//2-sym_img.get_height()//2))
+    return img
 
   def IsTraversable(self): return False
   def WouldHarvestUsing(self, tool): return (0,None)
@@ -259,7 +337,9 @@ class FlyweightThing(Thing):
 
 class Terrain(FlyweightThing):
   'Terrain is what is left when a cell is bare empty'
+  depth = 0  # how many cells below ground level its floor lies, for water to stand in
 class TerrainWater(Terrain):
+  depth = 1
   def GetColor(self): return (0,0,127)
 class TerrainSaltWater(TerrainWater):
   pass
@@ -274,6 +354,10 @@ class TerrainSand(TerrainLand):
   def GetColor(self): return (230,201,114)
 class TerrainGrass(TerrainLand):
   def GetColor(self): return (0,127,0)
+class TerrainPit(TerrainLand):
+  'Where something has been mined out of the ground, and water can collect'
+  depth = 1
+  def GetColor(self): return (95,71,47)
 
 # Most resources need a pre- and post- harvesting version.
 #  Pre-harvested are marked "situ", for "in situ" or "in the situation".
@@ -286,11 +370,22 @@ class Situatable(FlyweightThing):
     super().__init__(*posargs, **kwargs)
     self._inSitu = inSitu
   def InSitu(self): return self._inSitu
+  def Spec(self):
+    spec = super().Spec()
+    if self._inSitu:
+      spec['inSitu'] = True
+    return spec
   def BaseIconName(self):
     name = super().BaseIconName()
     if self._inSitu:
       name += 'Situ'
     return name
+  def IconNames(self):
+    # Things in situ look different, so only fall back to other things in situ
+    names = super().IconNames()
+    yield next(names)
+    for name in names:
+      yield name + 'Situ' if self._inSitu else name
   def IsTraversable(self): return not self._inSitu
   def EnergyToHarvest(self):
     if self._inSitu:
@@ -312,7 +407,8 @@ class Harvestable(Situatable):
 class PickUpAble(Harvestable):
   def IsPickUpAble(self): return True
 
-class Placeable(Thing):
+class Placeable(FlyweightThing):
+  'Placed things are stored in the world by registry ID, so they must be flyweights'
   def IsPlaceable(self): return True
 
 class Rock(PickUpAble, Placeable): pass
@@ -410,6 +506,10 @@ class OfMaterial(Thing):
     super().__init__(*posargs, **kwargs)
     self._material = material
   def Material(self): return self._material
+  def Spec(self):
+    spec = super().Spec()
+    spec['material'] = self._material.Spec()
+    return spec
   def GetColor(self): return self._material.GetColor()
   def DisplayName(self):
     return '{} {}'.format(self._material.DisplayName(), super().DisplayName())
@@ -507,6 +607,21 @@ def LoadMaterialsProperties():
         BUGPRINT('{}.{} = {}', klassname, attr, value)
         setattr(klass, attr, value)
 
+def ThingFromSpec(spec):
+  'Recreate a Thing from the description returned by its Spec() method'
+  klass = globals().get(spec['class'])
+  if not (isinstance(klass, type) and issubclass(klass, Thing)):
+    raise ValueError('not a kind of Thing: {}'.format(spec['class']))
+  if 'material' in spec:
+    return klass(ThingFromSpec(spec['material']))
+  if spec.get('inSitu'):
+    return klass(inSitu=True)
+  return klass()
+
+assert ThingFromSpec(Stone(inSitu=True).Spec()) is Stone(inSitu=True)
+assert ThingFromSpec(Pickaxe(Iron()).Spec()).Material() is Iron()
+assert ThingFromSpec(Table().Spec()) is Table()
+
 CARDINAL_DIRECTIONS = ( (0,-1), (1,0), (0,1), (-1,0) )
 
 class AnimateThing(Observable, Thing):
@@ -541,10 +656,22 @@ class AnimateThing(Observable, Thing):
     self.age = 0
     self.Changed()
 
-  def Changed(self, changed=True):
+  def Changed(self, changed=True, rects=None):
+    'Note a change, by default to how the cell self is in looks'
     self.changed = changed
     if changed:
-      self.NotifyChange()
+      if rects is None:
+        rects = [pygame.Rect(self.pos, (1,1))]
+      self.NotifyChange(rects=rects)
+
+  def GetState(self):
+    'Return a JSON-able dict of everything needed to restore this creature with SetState()'
+    return {'class': self.__class__.__name__, 'pos': list(self.pos), 'energy': self.energy, 'age': self.age}
+
+  def SetState(self, state):
+    self.pos = list(state['pos'])
+    self.energy = state['energy']
+    self.age = state['age']
 
   def IsAlive(self):
     return self.energy >= self.ENERGY_MINIMUM_VIABLE
@@ -557,9 +684,9 @@ class AnimateThing(Observable, Thing):
 
   def CanOccupy(self, newpos):
     'Return True if self can be at the given position.'
-    if newpos[0] < 0 or newpos[1] < 0 or newpos[0] >= self.world.sz[0] or newpos[1] >= self.world.sz[1]:
+    if not self.world.CollidePoint(newpos):
       return False
-    terrain = self.world.ground[newpos[1]][newpos[0]]
+    terrain = self.world.GroundAt(newpos)
     numthing, thing = self.world.ThingsAt(newpos)
     if terrain.IsTraversable() and (numthing==0 or thing is None or thing.IsTraversable()):
       return True
@@ -567,9 +694,10 @@ class AnimateThing(Observable, Thing):
 
   def MoveTo(self, newpos):
     'Unconditionally move self to newpos - assumes CanOccupy() was already consulted.'
+    oldRect = pygame.Rect(self.pos, (1,1))
     self.pos[0] = newpos[0]
     self.pos[1] = newpos[1]
-    self.Changed()
+    self.Changed(rects=[oldRect, pygame.Rect(self.pos, (1,1))])
 
   def Update(self, dt):
     self.age += dt
@@ -578,24 +706,41 @@ AnimateThing.InitClassConstants()
 
 class Animal(AnimateThing):
 
-  def __init__(self, *posargs, **kwargs):
+  SIGHT_RADIUS = 20  # how far away it notices other creatures, in cells
+
+  def __init__(self, *posargs, rng=random, **kwargs):
     super().__init__(*posargs, **kwargs)
     self.walkingTimeout = 0  # Time to wait until next walking can be performed
-    self.walkingDirection = (random.randrange(3)-1,random.randrange(3)-1)
-    self.speed = random.uniform(self.SPEED_MIN, self.SPEED_MAX)
-
-  def FindNearestTargetPoints(self, targetFilter, radius=20):
+    self.walkingDirection = (rng.randrange(3)-1,rng.randrange(3)-1)
+    self.speed = rng.uniform(self.SPEED_MIN, self.SPEED_MAX)
+
+  def GetState(self):
+    state = super().GetState()
+    state.update( walkingTimeout = self.walkingTimeout
+                , walkingDirection = list(self.walkingDirection)
+                , speed = self.speed
+                , energy_reproduction = self.energy_reproduction )
+    return state
+
+  def SetState(self, state):
+    super().SetState(state)
+    self.walkingTimeout = state['walkingTimeout']
+    self.walkingDirection = tuple(state['walkingDirection'])
+    self.speed = state['speed']
+    self.energy_reproduction = state['energy_reproduction']
+
+  def FindNearestTargetPoints(self, targetFilter, radius=None):
     'Return a tuple of the nearest (and therefore equidistant) points of interest'
+    if radius is None:
+      radius = self.SIGHT_RADIUS
     targets = []
     # Include Player?
     if ManhattanDistance(self.pos, self.world.player.pos) <= radius and targetFilter(self.world.player):
       targets.append(tuple(self.world.player.pos))
     # Find all animals in range
-    for p in self.world.animals.keys():
-      if ManhattanDistance(self.pos, p) <= radius:
-        for a in self.world.animals[p]:
-          if not a is self and targetFilter(a):
-            targets.append(p)
+    for a in self.world.animalGrid.Near(self.pos, radius):
+      if ManhattanDistance(self.pos, a.pos) <= radius and not a is self and targetFilter(a):
+        targets.append(tuple(a.pos))
     if targets:
       # Find nearest of the nearby targets
       targets.sort(key=lambda p: ManhattanDistance(self.pos, p))
@@ -634,11 +779,49 @@ class Animal(AnimateThing):
     if self.energy < self.ENERGY_MINIMUM_VIABLE:
       return
     self.UpdateWalking(dt)  # may consume food as side-effect
+    self.Live(dt)
+
+  def Settle(self):
+    'Spend the energy used since self was last brought up to date, without doing anything else'
+    dt = self.world.time - self.updated
+    self.updated = self.world.time
+    self.walkingTimeout = max(0, self.walkingTimeout - dt)
+    if self.energy >= self.ENERGY_MINIMUM_VIABLE:
+      self.energy -= dt * self.ENERGY_EXPENDITURE_BASELINE
+      self.age += dt
+
+  def TimeToLive(self):
+    'Return how long until self dies of hunger, unless it eats first'
+    return (self.energy - self.ENERGY_MINIMUM_VIABLE) // self.ENERGY_EXPENDITURE_BASELINE + 1
+
+  def Estimate(self, dt, rng=random):
+    '''Advance by dt without simulating each step, for animals far from the player: stay put,
+       but have a chance of finding food for each step that would have been taken'''
+    if self.energy < self.ENERGY_MINIMUM_VIABLE:
+      return
+    for i in range(RandomRound(dt * self.speed, rng)):
+      self.Forage(rng)
+    self.Live(dt)
+
+  def Forage(self, rng=random):
+    'Look in a random cell of the chunk self is in, and eat what is there if possible'
+    chunk = worldgrid.ChunkRect(worldgrid.ChunkOf(self.pos))
+    p = (chunk[0] + rng.randrange(chunk[2]), chunk[1] + rng.randrange(chunk[3]))
+    if self.world.CollidePoint(p):
+      self.Eat(p, expose=False)
+
+  def Eat(self, p, expose=True):
+    'Eat something in the cell at p, if there is anything self eats.  Return whether it did.'
+    return False
+
+  def Live(self, dt):
+    'Spend energy for dt, then die, or give birth if there is energy to spare'
     self.energy -= dt * self.ENERGY_EXPENDITURE_BASELINE
     super().Update(dt)
     if self.energy < self.ENERGY_MINIMUM_VIABLE:
       print('{} died @ {}, aged {}s, with {} energy'.format(
                 self.__class__.__name__, self.pos, self.age / SECOND, self.energy))
+      self.Changed()  # looks dead
     elif self.energy >= self.energy_reproduction:
       self.energy -= self.energy_reproduction // 2
       child = self.__class__(self.world, self.pos, energy=self.energy_reproduction // 2)
@@ -649,18 +832,30 @@ class Animal(AnimateThing):
 class Herbivore(Animal):
   color_hsv = (90,100,50)
 
+  FOOD = (Grass, Vine)
+  FOOD_ENERGY = 20 * SECOND
+
+  @classmethod
+  def EnergySafetyMargin(cls):
+    return cls.ENERGY_EXPENDITURE_BASELINE * 30 * SECOND
+
   def __init__(self, *posargs, **kwargs):
     super().__init__(*posargs, **kwargs)
-    self.energy_safety_margin = self.ENERGY_EXPENDITURE_BASELINE * 30 * SECOND
+    self.energy_safety_margin = self.EnergySafetyMargin()
     self.energy += self.energy_safety_margin
     self.energy_reproduction = self.energy * 2
 
+  def Eat(self, p, expose=True):
+    numthing, thing = self.world.ThingsAt(p)
+    if numthing and isinstance(thing, self.FOOD):
+      self.world.SetThingsAt(p, (0,None), expose)
+      self.energy += self.FOOD_ENERGY
+      return True
+    return False
+
   def PickWalk(self, points):
     # Eat what's here, then do regular walk.
-    numthing, thing = self.world.ThingsAt(self.pos)
-    if numthing and isinstance(thing, (Grass,Vine)):
-      self.world.SetThingsAt(self.pos, (0,None))
-      self.energy += 20 * SECOND
+    self.Eat(self.pos)
     # Move away from player and Carnivores, if possible
     nearestPredators = self.FindNearestTargetPoints(lambda t: isinstance(t, (Carnivore,Player)))
     if nearestPredators:
@@ -678,9 +873,13 @@ class Herbivore(Animal):
 class Carnivore(Animal):
   color_hsv = (30,75,75)
 
+  @classmethod
+  def EnergySafetyMargin(cls):
+    return cls.ENERGY_EXPENDITURE_BASELINE * 120 * SECOND
+
   def __init__(self, *posargs, **kwargs):
     super().__init__(*posargs, **kwargs)
-    self.energy_safety_margin = self.ENERGY_EXPENDITURE_BASELINE * 120 * SECOND
+    self.energy_safety_margin = self.EnergySafetyMargin()
     self.energy += self.energy_safety_margin
     self.energy_reproduction = self.energy * 2
     # For now:
@@ -688,20 +887,25 @@ class Carnivore(Animal):
     #   * But are faster than Herbivores
     self.speed *= 1.5
 
-  def PickWalk(self, points):
-    # Eat some of what's here, then do regular walk.
-    for a in tuple(self.world.animals.get(tuple(self.pos),[])):
+  def Eat(self, p, expose=True):
+    for a in tuple(self.world.animals.get(tuple(p),[])):
       if isinstance(a, Herbivore) or (isinstance(a,Carnivore) and not a.IsAlive()):
+        a.Settle()
         if a.IsAlive():
           wasAlive = 'live'
         else:
           wasAlive = 'dead'
-        acquired_energy = a.energy // 10
+        acquired_energy = a.energy // self.DIGESTION_INEFFICIENCY
         a.energy = 0
         self.energy += acquired_energy
-        self.world.RemoveAnimal(self.pos, a)
-        print('{} {} eaten @ {} for {} energy'.format(wasAlive, a.__class__.__name__, self.pos, acquired_energy))
-        break
+        self.world.RemoveAnimal(p, a)
+        print('{} {} eaten @ {} for {} energy'.format(wasAlive, a.__class__.__name__, tuple(p), acquired_energy))
+        return True
+    return False
+
+  def PickWalk(self, points):
+    # Eat some of what's here, then do regular walk.
+    self.Eat(self.pos)
     # Move toward player and Herbivores, if possible
     nearestPrey = self.FindNearestTargetPoints(lambda t: isinstance(t, (Herbivore,Player) or not t.IsAlive()))
     if nearestPrey:
@@ -757,6 +961,18 @@ class Player(AnimateThing):
 
   def PowerProduction(self): return 100  # in watts (a.k.a. joules/sec)
 
+  def GetState(self):
+    state = super().GetState()
+    state['inventory'] = [ [numthing, None if thing is None else thing.Spec()] for numthing, thing in self.inventory ]
+    state['inventory_selection'] = self.inventory_selection
+    return state
+
+  def SetState(self, state):
+    super().SetState(state)
+    self.inventory = [ [numthing, None if spec is None else ThingFromSpec(spec)] for numthing, spec in state['inventory'] ]
+    self.inventory_selection = state['inventory_selection']
+    self.Changed()
+
   def SelectInventory(self, idx):
     self.inventory_selection = idx
     self.Changed()
@@ -845,7 +1061,7 @@ class Player(AnimateThing):
     if numthing and not thing is None and size>=0:
       MARGIN = 2
       img = pygame.Surface( (size,size), pygame.SRCALPHA)
-      nameLabel = manager.GetFont('LABEL').render(thing.DisplayName(), True, (0,0,0))
+      nameLabel = manager.TextImage('LABEL', thing.DisplayName(), (0,0,0))
       img.blit(nameLabel, (MARGIN,size-MARGIN-nameLabel.get_height()))
       z = size - nameLabel.get_height() - MARGIN*2
       thingImg = thing.GetIcon( (z,z) )
@@ -853,7 +1069,7 @@ class Player(AnimateThing):
       if count is None:
         count = numthing
       if count != 1:
-        countLabel = manager.GetFont('LABEL').render( str(count), True, (0,0,0) )
+        countLabel = manager.TextImage('LABEL', str(count), (0,0,0))
         img.blit(countLabel, (MARGIN,MARGIN))
       return img
     return None
@@ -881,10 +1097,14 @@ class Player(AnimateThing):
   def UsePrimaryAt(self, hitpos):
     numthing, thing = self.WouldHarvestAt(hitpos)
     if numthing and not thing is None:
+      numtarget, target = self.world.ThingsAt(hitpos)
       self.world.SetThingsAt(hitpos, (0,None))
+      if isinstance(target, Situatable) and target.InSitu() and not isinstance(target, Plant):
+        # Mined out of the ground
+        self.world.Dig(hitpos)
       self.world.progress.pop(hitpos, None)
       self.Changed()
-      self.world.Changed()
+      self.world.Changed(rects=[pygame.Rect(hitpos, (1,1))])
       self.AddInventory( (numthing, thing) )
       return True
     return False
@@ -972,7 +1192,7 @@ class Player(AnimateThing):
               held = Hands()
             j = dt * held.PowerEfficiency() // 100
             self.world.progress[self.wieldPos] = progress + j
-            self.world.Changed()
+            self.world.Changed(rects=[pygame.Rect(self.wieldPos, (1,1))])
       elif self.wieldType is Player.WIELD_MATERIAL and numheld and not held is None:
         numtarget, target = self.world.ThingsAt(self.wieldPos)
         if numtarget == 0 and numheld and ChessboardDistance(self.wieldPos, self.pos) == 1:
@@ -980,7 +1200,6 @@ class Player(AnimateThing):
             (numremoved, removed) = self.RemoveInventory( (1,held), self.inventory_selection )
             if numremoved:
               self.world.SetThingsAt(self.wieldPos, (numremoved, removed))
-              self.world.Changed()
 
   def Update(self, dt):
     self.UpdateWalking(dt)
@@ -989,153 +1208,474 @@ class Player(AnimateThing):
 class World(Observable):
   # Containing the terrain, player, inventory, etc.
 
-  def __init__(self, *posargs, **kwargs):
+  '''
+  The map is stored as worldgrid.Chunks, which are generated the first time anything touches them.
+  Generation of a chunk depends only on the world's seed and the chunk's position,
+  so the world comes out the same regardless of the order in which chunks are visited,
+  or of how many worker processes they are generated by.
+
+  Terrain, clay and rock are either stamped as random rectangles ('rects'),
+  or thresholded from fields of coherent noise ('noise').
+  '''
+
+  TERRAIN_GENERATORS = ('rects', 'noise')
+
+  FEATURE_REACH = ceildiv(128, worldgrid.CHUNK_SIZE)  # how many chunks away a rectangular feature may extend
+  # Fewest chunks worth starting worker processes for: each chunk takes about a millisecond,
+  # and starting a pool several tens of milliseconds
+  PARALLEL_MIN_CHUNKS = 64
+
+  # Ores found in rock, repeated in proportion to their abundance
+  ORES = list(ore for ore, count in
+    { Bismuthinite : 3
+    , Cassiterite : 2
+    , Galena : 3
+    , Garnierite : 3
+    , Hematite : 3
+    , Limonite : 3
+    , Magnetite : 3
+    , Malachite : 3
+    , NativeAluminum : 5
+    , NativeGold : 1
+    , NativePlatinum : 1
+    , NativeSilver : 2
+    , Sphalerite : 3
+    , Tetrahedrite : 4
+    }.items() for rep in range(count))
+
+  CREATURE_ENGINES = ('objects', 'arrays')
+
+  # Animals are simulated in less detail the further their chunk is from the player's
+  ACTIVE_RADIUS = 2      # chunks within which they are simulated every tick
+  FAR_FACTOR = 4         # out to this many times further, every FAR_INTERVAL ticks
+  FAR_INTERVAL = 8
+  DISTANT_INTERVAL = 64  # beyond that, their food and energy are estimated every DISTANT_INTERVAL ticks
+
+  def __init__(self, *posargs, sz=(1000,1000), seed=None, terrain='rects', creatures='objects', activeRadius=None, simWorkers=0, **kwargs):
     super().__init__(*posargs, **kwargs)
-    self.sz = (1000,1000)
-    self.area = self.sz[0]*self.sz[1]
-    grass_flyweight = TerrainGrass()  # avoiding the ctor call significantly speeds this up
-    #row_prototype = [ grass_flyweight for r in range(self.sz[1]) ]
-    #self.ground = [ row_prototype[:] for c in range(self.sz[0]) ]
-    self.ground = [ [ grass_flyweight for r in range(self.sz[1]) ] for c in range(self.sz[0]) ]
-    #self.ground = np.random.randint(0,4,self.sz)
-    self.lighting = [ [True]*self.sz[0] for r in range(self.sz[1]) ]
-    self.things = [ [ (0,None) for r in range(self.sz[1]) ] for c in range(self.sz[0]) ]
+    self.sz = sz        # (width, height) in cells, or None for a world without edges
+    if seed is None:
+      seed = random.randrange(2**32)
+    self.seed = seed
+    assert terrain in self.TERRAIN_GENERATORS
+    self.terrain = terrain
+    self.registry = worldgrid.ThingRegistry()  # cells hold IDs of flyweights rather than references
+    for thing in self.GeneratedThings():
+      self.registry.Id(thing)  # so that IDs don't depend on which chunk happens to be generated first
+    self.chunks = {}    # map from chunk coordinates to worldgrid.Chunk
+    self.file = None    # worldfile.WorldFile this world was loaded from, if any
+    self.dirtyChunks = set()   # coordinates of chunks whose cells have changed since they were last saved
+    self.dirtyAnimals = set()  # coordinates of chunks whose animals have changed since they were last saved
     self.progress = {}  # map from (x,y) to milliseconds remaining to finish choping/pickaxing/harvesting Thing
     self.animals = {}   # map from (x,y) to list of animals
+    self.animalGrid = worldgrid.BucketGrid()  # the same animals, for finding those near a point
+    self.activeRadius = self.ACTIVE_RADIUS if activeRadius is None else activeRadius
+    self.time = 0       # milliseconds of game time simulated so far
+    self.ticks = 0      # calls to Update() so far
+    self.tick = 0       # milliseconds of game time the last call to Update() advanced by
+    self.wakeups = []   # heap of (game time, sequence number, animal) of when animals are next due to act
+    self.wakeupCount = itertools.count()  # so that animals due at the same time act in the order they were scheduled
+    assert creatures in self.CREATURE_ENGINES
+    self.herd = None    # with creatures='arrays', a herd.Herd that has all the animals instead
+    if creatures == 'arrays':
+      self.herd = herd.Herd(self, (Herbivore, Carnivore), seed=self.seed)
+      self.Subscribe(CHANGE, self.herd.OnChange)
+      if simWorkers:
+        self.herd.pool = herdpool.RegionPool(simWorkers, self.seed)
     self.player = Player(self)
+    self.plants = plants.PlantGrowth(self, [ plants.Rule(Grass(), Grass(), 1 / (10*60*SECOND), seedRate=1 / (8*60*60*SECOND))
+                                           , plants.Rule(Vine(), Vine(), 1 / (30*60*SECOND))
+                                           , plants.Rule(Wood(inSitu=True), Wood(inSitu=True), 1 / (2*60*60*SECOND), blocks=True) ],
+                                     seed=self.seed)
+    self.waterFlow = fluids.WaterFlow(self, TerrainWater(), TerrainPit())
     self.icons = {}
-    print('{:,} cells'.format(self.sz[0]*self.sz[1]))
     self.player.Subscribe(CHANGE, self.OnChange)
     self.Changed()
 
-  def Generate(self, progressCallback):
-    self.GenerateTerrain(progressCallback)
-    progressCallback(75)
-    self.GenerateThings()
-    progressCallback(80)
-    self.GenerateClay()
-    self.GenerateRock()
-    self.GenerateAnimals()
-    progressCallback(90)
-
-  def GenerateTerrain(self, progressCallback):
-    # Assuming ground[] is already just Grass
-    p = 5
-    plots = self.area // 10000
+  def GeneratedThings(self):
+    'Return a list of everything generation may put in a cell, in a fixed order'
+    return ( [TerrainGrass(), TerrainSand(), TerrainWater(), Stone(), Wood(), Vine(), Grass()]
+           + [Wood(inSitu=True), Clay(inSitu=True), Stone(inSitu=True)]
+           + [ ore(inSitu=True) for ore in dict.fromkeys(self.ORES) ] )
+
+  @classmethod
+  def Load(cls, path, creatures='objects', activeRadius=None, simWorkers=0):
+    'Return the world saved at path.  Its chunks are paged in from disk as they are used.'
+    f = worldfile.WorldFile(path)
+    state = f.metadata
+    world = cls(sz=None if state['sz'] is None else tuple(state['sz']), seed=state['seed'], terrain=state.get('terrain', 'rects'),
+                creatures=creatures, activeRadius=activeRadius, simWorkers=simWorkers)
+    world.file = f
+    world.SetState(state)
+    for cpos, data in f.chunkData.items():
+      world.SetChunkState(data)
+    world.dirtyAnimals.clear()
+    print('loaded {} chunks from {}'.format(len(f.index), path))
+    return world
+
+  def Close(self):
+    'Stop any worker processes simulating the world'
+    if not self.herd is None and not self.herd.pool is None:
+      self.herd.pool.Close()
+
+  def Save(self, path):
+    'Write the world to path, including any chunks loaded from a file that have not been touched since'
+    cposList = set(self.chunks)
+    if not self.file is None:
+      cposList.update(self.file.ChunkPositions())
+    chunkData = { cpos: self.GetChunkState(animalStates) for cpos, animalStates in self.AnimalStatesByChunk().items() }
+    worldfile.Save(path, self.GetState(), (self.Chunk(cpos) for cpos in sorted(cposList)), chunkData)
+    self.dirtyChunks.clear()
+    self.dirtyAnimals.clear()
+    print('saved {} chunks to {}'.format(len(cposList), path))
+
+  def Autosave(self, saver):
+    '''Hand copies of whatever has changed since the last autosave to saver (a worldfile.AutoSaver),
+       which writes them out in the background, along with whatever it failed to write before.
+       Returns False if saver is still busy with the last lot.'''
+    if saver.Busy():
+      return False
+    self.KeepUnsaved(saver)
+    chunks = [ self.chunks[cpos].Copy() for cpos in sorted(self.dirtyChunks) ]
+    byChunk = self.AnimalStatesByChunk(self.dirtyAnimals)
+    chunkData = { cpos: self.GetChunkState(byChunk.get(cpos, ())) for cpos in self.dirtyAnimals }
+    saver.Submit(self.GetState(), chunks, chunkData)
+    self.dirtyChunks.clear()
+    self.dirtyAnimals.clear()
+    return True
+
+  def KeepUnsaved(self, saver):
+    'Mark the chunks saver failed to write as changed again, so that they are written next time'
+    unsavedChunks, unsavedData = saver.TakeUnsaved()
+    self.dirtyChunks.update(unsavedChunks)
+    self.dirtyAnimals.update(unsavedData)
+    return bool(unsavedChunks or unsavedData)
+
+  def AnimalStatesByChunk(self, cposList=None):
+    'Return a map from chunk coordinates (of those in cposList, or all) to a list of the states of the animals in that chunk'
+    if not self.herd is None:
+      return self.herd.StatesByChunk(cposList)
+    byChunk = {}
+    for p, animals in self.animals.items():
+      cpos = worldgrid.ChunkOf(p)
+      if cposList is None or cpos in cposList:
+        for a in animals:
+          a.Settle()
+          byChunk.setdefault(cpos, []).append(a.GetState())
+    return byChunk
+
+  def GetChunkState(self, animalStates):
+    'Return a JSON-able dict of what belongs to a chunk besides its cells'
+    if not animalStates:
+      return None
+    return { 'animals' : animalStates }
+
+  def SetChunkState(self, state):
+    'Restore what GetChunkState() returned'
+    if not self.herd is None:
+      self.herd.AddStates(state['animals'])
+      return
+    for animalState in state['animals']:
+      klass = globals().get(animalState['class'])
+      if not (isinstance(klass, type) and issubclass(klass, Animal)):
+        raise ValueError('not a kind of Animal: {}'.format(animalState['class']))
+      a = klass(self, animalState['pos'])
+      a.SetState(animalState)
+      self.AddAnimal(a)
+
+  def GetState(self):
+    'Return a JSON-able dict of everything about the world except its chunks and what is in them'
+    return { 'seed'     : self.seed
+           , 'terrain'  : self.terrain
+           , 'sz'       : None if self.sz is None else list(self.sz)
+           , 'registry' : [ thing.Spec() for thing in self.registry.things[1:] ]
+           , 'progress' : [ [p[0], p[1], value] for p, value in self.progress.items() ]
+           , 'player'   : self.player.GetState()
+           }
+
+  def SetState(self, state):
+    'Restore what GetState() returned.  Must be done before any chunks are created.'
+    assert not self.chunks
+    self.registry = worldgrid.ThingRegistry([None] + [ ThingFromSpec(spec) for spec in state['registry'] ])
+    self.progress = { (x,y): value for x, y, value in state['progress'] }
+    self.player.SetState(state['player'])
+
+  def Generate(self, progressCallback, radius=1, workers=1):
+    '''Generate the chunks within radius chunks of the player, spread over a pool of worker processes
+       if there are enough of them to be worth it.  The rest are generated as they are visited.'''
+    center = worldgrid.ChunkOf(self.player.pos)
+    todo = [ (cx,cy) for cy in range(center[1]-radius, center[1]+radius+1)
+                     for cx in range(center[0]-radius, center[0]+radius+1)
+                     if self.ChunkInWorld((cx,cy)) and not (cx,cy) in self.chunks ]
+    if workers <= 1 or len(todo) < self.PARALLEL_MIN_CHUNKS:
+      for i in range(len(todo)):
+        self.Chunk(todo[i])
+        progressCallback(5 + 85*(i+1)//len(todo))
+      return
+    # Hand out rows of chunks, several per worker so that they are kept evenly busy,
+    # and merge the results in order so that the outcome doesn't depend on which worker finishes first.
+    regionSize = max(1, len(todo) // (workers * 4))
+    regions = [ todo[i:i+regionSize] for i in range(0, len(todo), regionSize) ]
+    done = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+      for specs, results in pool.map(GenerateRegion, itertools.repeat(self.seed), itertools.repeat(self.sz), itertools.repeat(self.terrain), regions):
+        self.AddGeneratedChunks(specs, results)
+        done += len(results)
+        progressCallback(5 + 85*done//len(todo))
+    BUGPRINT('generated {} chunks in {} regions on {} workers', len(todo), len(regions), workers)
+
+  def AddGeneratedChunks(self, specs, results):
+    '''Adopt chunks returned by GenerateRegion().
+       Their cells hold IDs from the worker's registry, whose things are described by specs.'''
+    lut = np.array([worldgrid.NOTHING] + [ self.registry.Id(ThingFromSpec(spec)) for spec in specs ], dtype=worldgrid.ID_DTYPE)
+    for cpos, arrays, animalStates in results:
+      if cpos in self.chunks:
+        continue
+      arrays['ground'] = lut[arrays['ground']]
+      arrays['thingIds'] = lut[arrays['thingIds']]
+      self.chunks[cpos] = worldgrid.Chunk(cpos, arrays=arrays)
+      self.dirtyChunks.add(cpos)
+      self.SetChunkState({'animals': animalStates})
+
+  def ChunkInWorld(self, cpos):
+    r = self.ClipRect(worldgrid.ChunkRect(cpos))
+    return r.width > 0 and r.height > 0
+
+  def ChunkRandom(self, cpos, layer):
+    'Return a random number generator unique to this world, the given chunk, and the named layer of generation'
+    return random.Random('{}:{}:{},{}'.format(self.seed, layer, cpos[0], cpos[1]))
+
+  def ChunkGenerator(self, cpos, layer):
+    'Like ChunkRandom(), but a numpy Generator, for drawing many random numbers at once'
+    return np.random.default_rng([ self.seed & 0xFFFFFFFFFFFFFFFF, zlib.crc32(layer.encode('utf-8'))
+                                 , cpos[0] & 0xFFFFFFFF, cpos[1] & 0xFFFFFFFF ])
+
+  def Chunk(self, cpos):
+    'Return the chunk at chunk coordinates cpos, generating it if necessary'
+    chunk = self.chunks.get(cpos)
+    if chunk is None:
+      if not self.file is None:
+        chunk = self.file.Chunk(cpos)
+      if chunk is None:
+        chunk = self.GenerateChunk(cpos)
+      else:
+        self.chunks[cpos] = chunk
+    return chunk
+
+  def ChunkAt(self, p):
+    'Return the chunk containing cell p, generating it if necessary'
+    return self.Chunk((p[0] >> worldgrid.CHUNK_SHIFT, p[1] >> worldgrid.CHUNK_SHIFT))
+
+  def GenerateChunk(self, cpos):
+    chunk = worldgrid.Chunk(cpos, self.registry.Id(TerrainGrass()))
+    self.chunks[cpos] = chunk
+    self.dirtyChunks.add(cpos)
+    if self.terrain == 'noise':
+      self.GenerateNoiseTerrain(chunk)
+      self.GenerateThings(chunk)
+      self.GenerateNoiseRock(chunk)
+    else:
+      self.GenerateTerrain(chunk)
+      self.GenerateThings(chunk)
+      self.GenerateClay(chunk)
+      self.GenerateRock(chunk)
+    self.waterFlow.Flood(chunk)
+    self.GenerateAnimals(chunk)
+    return chunk
+
+  def NearbyFeatures(self, chunk, layer, density, minSize, maxSize):
+    '''Return an iterator over (rect, rng) for the features of a layer that might overlap chunk.
+       Each feature belongs to the chunk containing its top-left corner, and is drawn from that chunk's
+       random number generator, so every chunk overlapping a feature agrees on its shape.'''
+    for cy in range(chunk.pos[1]-self.FEATURE_REACH, chunk.pos[1]+1):
+      for cx in range(chunk.pos[0]-self.FEATURE_REACH, chunk.pos[0]+1):
+        rng = self.ChunkRandom((cx,cy), layer)
+        for i in range(RandomRound(density * worldgrid.CHUNK_AREA, rng)):
+          width = rng.randrange(minSize, maxSize)
+          height = rng.randrange(minSize, maxSize)
+          left = cx * worldgrid.CHUNK_SIZE + rng.randrange(worldgrid.CHUNK_SIZE)
+          top  = cy * worldgrid.CHUNK_SIZE + rng.randrange(worldgrid.CHUNK_SIZE)
+          yield (pygame.Rect(left, top, width, height), rng)
+
+  def GenerateTerrain(self, chunk):
+    # Assuming chunk.ground is already just Grass
     for value in (TerrainSand(), TerrainWater()):
-      for i in range(plots):
-        width = random.randrange(12,64)
-        height = random.randrange(12,64)
-        top = random.randrange(self.sz[1] - height)
-        left = random.randrange(self.sz[0] - width)
-        r = pygame.Rect(left, top, width, height)
-        self.GroundFill(r, value)
-        p += 70/(2*plots)
-        progressCallback(int(p))
-
-  def GenerateThings(self):
-    count = self.area // 400
-    for i in range(count):
-      self.things[random.randrange(self.sz[1])][random.randrange(self.sz[0])] = (1,Stone())
-    for i in range(count):
-      self.things[random.randrange(self.sz[1])][random.randrange(self.sz[0])] = (1,Wood())
-    for i in range(count):
-      self.things[random.randrange(self.sz[1])][random.randrange(self.sz[0])] = (1,Vine())
-    for i in range(count*100):
-      self.things[random.randrange(self.sz[1])][random.randrange(self.sz[0])] = (1,Grass())
-    for i in range(count):
-      self.things[random.randrange(self.sz[1])][random.randrange(self.sz[0])] = \
-        (random.randrange(4)+random.randrange(3)+1, Wood(inSitu=True))
-
-  def GenerateClay(self):
-    for i in range(self.area // 50000):
-      width = random.randrange(12,64)
-      height = random.randrange(12,64)
-      top = random.randrange(self.sz[1] - height)
-      left = random.randrange(self.sz[0] - width)
-      r = pygame.Rect(left, top, width, height)
-      self.ThingFill(r, (1, Clay(inSitu=True)))
-      self.LightFill(r.inflate(-4,-4), False)
-
-  def GenerateRock(self):
-    for i in range(self.area // 5000):
-      width = random.randrange(12,128)
-      height = random.randrange(12,128)
-      top = random.randrange(self.sz[1] - height)
-      left = random.randrange(self.sz[0] - width)
-      r = pygame.Rect(left, top, width, height)
-      self.ThingFill(r, (2, Stone(inSitu=True)))
-      self.LightFill(r.inflate(-4,-4), False)
-      ores = list(ore for ore, count in 
-        { Bismuthinite : 3
-        , Cassiterite : 2
-        , Galena : 3
-        , Garnierite : 3
-        , Hematite : 3
-        , Limonite : 3
-        , Magnetite : 3
-        , Malachite : 3
-        , NativeAluminum : 5
-        , NativeGold : 1
-        , NativePlatinum : 1
-        , NativeSilver : 2
-        , Sphalerite : 3
-        , Tetrahedrite : 4
-        }.items() for rep in range(count))
-      for j in range(width*height//120):
-        self.GenerateVein(r, (1, random.choice(ores)(inSitu=True)) )
-
-  def GenerateVein(self, rect, value, maxSize=12):
-    stone = Stone(inSitu=True)
-    points = [(random.randrange(rect.left, rect.right), random.randrange(rect.top, rect.bottom))]
-    p = points[0]
-    for i in range(random.randrange(maxSize)):
-      p2 = (p[0]+random.randrange(-1,2), p[1]+random.randrange(-1,2))
-      if self.CollidePoint(p2) and self.things[p2[1]][p2[0]][1] == stone and not p2 in points:
-        points.append(p2)
-        p = p2
-    for p in points:
-      self.things[p[1]][p[0]] = value
-
-  def GenerateAnimals(self):
-    for i in range(800):
-      p = ( random.randrange(self.sz[0]), random.randrange(self.sz[1]) )
-      numthing, thing = self.things[p[1]][p[0]]
-      if numthing and not thing is None:
-        if not thing.IsTraversable():
-          continue
-      if random.randrange(4):
-        a = Herbivore(self,p)
+      i = self.registry.Id(value)
+      for r, rng in self.NearbyFeatures(chunk, value.__class__.__name__, 1/10000, 12, 64):
+        chunk.GroundFill(chunk.LocalRect(r), i)
+
+  def GenerateThings(self, chunk):
+    rng = self.ChunkGenerator(chunk.pos, 'things')
+    count = worldgrid.CHUNK_AREA / 400
+    # Scattered single things, then trees of 1 to 6 Wood, each dropped into a random cell,
+    # where later ones replace earlier ones.
+    kinds = ((count, Stone()), (count, Wood()), (count, Vine()), (count*100, Grass()))
+    ids = np.repeat([ self.registry.Id(thing) for n, thing in kinds ], [ RandomRound(n, rng) for n, thing in kinds ])
+    counts = np.ones(len(ids), dtype=worldgrid.COUNT_DTYPE)
+    trees = RandomRound(count, rng)
+    ids = np.concatenate((ids, np.full(trees, self.registry.Id(Wood(inSitu=True)))))
+    counts = np.concatenate((counts, rng.integers(4, size=trees) + rng.integers(3, size=trees) + 1))
+    chunk.ThingScatter(rng.integers(worldgrid.CHUNK_AREA, size=len(ids)), counts, ids)
+
+  def GenerateClay(self, chunk):
+    clay = self.registry.Id(Clay(inSitu=True))
+    for r, rng in self.NearbyFeatures(chunk, 'clay', 1/50000, 12, 64):
+      chunk.ThingFill(chunk.LocalRect(r), 1, clay)
+      chunk.LightFill(chunk.LocalRect(r.inflate(-4,-4)), False)
+
+  def GenerateRock(self, chunk):
+    stone = self.registry.Id(Stone(inSitu=True))
+    ores = np.array([ self.registry.Id(ore(inSitu=True)) for ore in self.ORES ], dtype=worldgrid.ID_DTYPE)
+    bounds = pygame.Rect(chunk.Rect())
+    for r, rng in self.NearbyFeatures(chunk, 'rock', 1/5000, 12, 128):
+      veinSeed = rng.getrandbits(64)  # drawn regardless, as the features that follow share rng
+      if not bounds.colliderect(r):
+        continue
+      chunk.ThingFill(chunk.LocalRect(r), 2, stone)
+      chunk.LightFill(chunk.LocalRect(r.inflate(-4,-4)), False)
+      veinRng = np.random.default_rng(veinSeed)
+      n = r.width*r.height//120
+      veinOres = ores[veinRng.integers(len(ores), size=n)]
+      xs, ys, veins = self.GenerateVeins(r, n, veinRng)
+      cols = xs - chunk.origin[0]
+      rows = ys - chunk.origin[1]
+      inChunk = (cols >= 0) & (cols < worldgrid.CHUNK_SIZE) & (rows >= 0) & (rows < worldgrid.CHUNK_SIZE)
+      chunk.thingCounts[rows[inChunk], cols[inChunk]] = 1
+      chunk.thingIds[rows[inChunk], cols[inChunk]] = veinOres[veins[inChunk]]
+
+  def GenerateVeins(self, rect, n, rng, maxSize=12):
+    '''Return arrays (xs, ys, veins) of the cells of n random walks of up to maxSize cells within rect,
+       all walked at once.  Each cell belongs to the first vein that reaches it.'''
+    steps = rng.integers(-1, 2, size=(2, n, maxSize))
+    lengths = rng.integers(1, maxSize+1, size=n)
+    xs = np.empty((n, maxSize), dtype=np.int64)
+    ys = np.empty((n, maxSize), dtype=np.int64)
+    xs[:,0] = rng.integers(rect.left, rect.right, size=n)
+    ys[:,0] = rng.integers(rect.top, rect.bottom, size=n)
+    for i in range(1, maxSize):
+      # Steps that would leave rect are not taken
+      xs[:,i] = np.clip(xs[:,i-1] + steps[0,:,i], rect.left, rect.right-1)
+      ys[:,i] = np.clip(ys[:,i-1] + steps[1,:,i], rect.top, rect.bottom-1)
+    walked = np.arange(maxSize) < lengths[:,np.newaxis]
+    xs, ys = xs[walked], ys[walked]
+    veins = np.nonzero(walked)[0]
+    cells, first = np.unique((ys - rect.top) * rect.width + (xs - rect.left), return_index=True)
+    return (xs[first], ys[first], veins[first])
+
+  def NoiseField(self, chunk, name, scale, octaves=4):
+    return worldnoise.FractalNoise(worldnoise.FieldSeed(self.seed, name), chunk.Rect(), scale, octaves)
+
+  def GenerateNoiseTerrain(self, chunk):
+    # Water in the lowlands, with sandy shores.  Thresholds give about the coverage of the rects.
+    elevation = self.NoiseField(chunk, 'elevation', 96)
+    chunk.ground[elevation < 0.39] = self.registry.Id(TerrainSand())
+    chunk.ground[elevation < 0.34] = self.registry.Id(TerrainWater())
+
+  def GenerateNoiseRock(self, chunk):
+    clay = self.NoiseField(chunk, 'clay', 48, 3)
+    chunk.thingIds[clay > 0.75] = self.registry.Id(Clay(inSitu=True))
+    chunk.thingCounts[clay > 0.75] = 1
+    chunk.LightMask(clay > 0.79, False)
+    rock = self.NoiseField(chunk, 'rock', 128)
+    isRock = rock > 0.45
+    chunk.thingIds[isRock] = self.registry.Id(Stone(inSitu=True))
+    chunk.thingCounts[isRock] = 2
+    chunk.LightMask(rock > 0.53, False)
+    # Small blobs of ore, each kind clumping together over a somewhat larger scale
+    isOre = isRock & (self.NoiseField(chunk, 'ore', 6, 2) > 0.76)
+    ores = np.array([ self.registry.Id(ore(inSitu=True)) for ore in self.ORES ], dtype=worldgrid.ID_DTYPE)
+    left, top, width, height = chunk.Rect()
+    kinds = worldnoise.Hash(worldnoise.FieldSeed(self.seed, 'ores'), (left + np.arange(width)) // 8, ((top + np.arange(height)) // 8)[:,np.newaxis])
+    chunk.thingIds[isOre] = ores[(kinds[isOre] * len(ores)).astype(np.intp)]
+    chunk.thingCounts[isOre] = 1
+
+  def GenerateAnimals(self, chunk):
+    rng = self.ChunkRandom(chunk.pos, 'animals')
+    for i in range(RandomRound(800 * worldgrid.CHUNK_AREA / 1000000, rng)):
+      row = rng.randrange(worldgrid.CHUNK_SIZE)
+      col = rng.randrange(worldgrid.CHUNK_SIZE)
+      p = (chunk.origin[0]+col, chunk.origin[1]+row)
+      if not self.CollidePoint(p):
+        continue
+      if chunk.thingCounts[row,col] and not self.registry.things[chunk.thingIds[row,col]].IsTraversable():
+        continue
+      if rng.randrange(4):
+        a = Herbivore(self, p, rng=rng)
       else:
-        a = Carnivore(self,p)
+        a = Carnivore(self, p, rng=rng)
       self.AddAnimal(a)
-    print('{} animals created'.format(len(self.animals)))
+    BUGPRINT('{} animals @ {} positions', sum(map(len, self.animals.values())), len(self.animals))
 
   def AddAnimal(self, a):
+    if not self.herd is None:
+      self.herd.AddStates([a.GetState()])
+      self.dirtyAnimals.add(worldgrid.ChunkOf(a.pos))
+      return
+    a.updated = self.time  # game time up to which it has been simulated
     self.animals.setdefault(tuple(a.pos), []).append(a)
+    self.animalGrid.Add(a, a.pos)
+    self.dirtyAnimals.add(worldgrid.ChunkOf(a.pos))
     a.Subscribe(CHANGE, self.OnChange)
+    self.ScheduleAnimal(a)
+
+  def ScheduleAnimal(self, a, remoteness=0):
+    'Arrange for a to be brought up to date when it next has something to do (or dies), which is no sooner than its remoteness allows'
+    if not a.IsAlive():
+      a.wakeAt = None
+      return
+    wakeAt = a.updated + min(max(a.walkingTimeout, 0), a.TimeToLive())
+    if remoteness:
+      wakeAt = max(wakeAt, a.updated + self.tick * (self.FAR_INTERVAL, self.DISTANT_INTERVAL)[remoteness - 1])
+    a.wakeAt = wakeAt
+    heapq.heappush(self.wakeups, (wakeAt, next(self.wakeupCount), a))
 
   def RemoveAnimal(self, p, a):
     p = tuple(p)
     self.animals[p].remove(a)
     if not self.animals[p]:
       del self.animals[p]
-
-  def Changed(self, changed=True):
+    self.animalGrid.Remove(a, p)
+    self.dirtyAnimals.add(worldgrid.ChunkOf(p))
+    a.wakeAt = None  # so that it is skipped when its wakeup comes round
+
+  def Changed(self, changed=True, rects=None, cells=None):
+    '''Note a change, to how the cells in the list of rects look if known.  Changes too scattered
+       to be worth a rect each can be given as cells, an array of (x, y) rows, for views to pick
+       out the ones they show with CellRectsWithin().'''
     self.changed = changed
     if self.changed:
-      self.NotifyChange()
+      if not cells is None:
+        self.NotifyChange(cells=cells)
+      elif rects is None:
+        self.NotifyChange()
+      else:
+        self.NotifyChange(rects=rects)
 
   def OnChange(self, evt):
-    self.Changed()
+    # Pass changes to the player and animals along as they are, so that subscribers can see where they were.
+    self.changed = True
+    self.NotifyEvent(evt)
+
+  def CellsChanged(self, r):
+    'Let views know that the contents of the cells in rect r have changed'
+    self.changed = True
+    self.NotifyChange(rects=[pygame.Rect(r)], cellsChanged=True)
 
   def CollidePoint(self, p):
     'Is cell at coordinate p in the world?  (Or does it fall off the edge?)'
+    if self.sz is None:
+      return True
     return not( p[0] < 0 or p[1] < 0 or p[0] >= self.sz[0] or p[1] >= self.sz[1] )
 
+  def ClipRect(self, aRect):
+    'Return the part of aRect that lies within the world'
+    if self.sz is None:
+      return pygame.Rect(aRect)
+    return pygame.Rect((0,0),self.sz).clip(aRect)
+
   def IterRect(self, aRect):
     'Return an iterator over coordinates on the map'
-    r = pygame.Rect((0,0),self.sz).clip(aRect)
+    r = self.ClipRect(aRect)
     for row in range(r.top, r.bottom):
       for col in range(r.left, r.right):
         yield (col,row)
@@ -1144,35 +1684,62 @@ class World(Observable):
     'Return an iterator over coordinates on the map'
     return self.IterRect((p[0]-radius,p[1]-radius,radius+radius+1,radius+radius+1))
 
+  def IterChunks(self, r):
+    'Return an iterator over the chunks overlapping the part of rect r that lies within the world'
+    for cpos in worldgrid.ChunksOverlapping(self.ClipRect(r)):
+      yield self.Chunk(cpos)
+
   def GroundFill(self, r, value):
-    for row in range(r.height):
-      for col in range(r.width):
-        self.ground[r.top+row][r.left+col] = value
-    self.Changed()
+    i = self.registry.Id(value)
+    for chunk in self.IterChunks(r):
+      chunk.GroundFill(chunk.LocalRect(r), i)
+      self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged(r)
 
   def LightFill(self, r, value):
-    for row in range(r.height):
-      for col in range(r.width):
-        self.lighting[r.top+row][r.left+col] = value
-    self.Changed()
+    for chunk in self.IterChunks(r):
+      chunk.LightFill(chunk.LocalRect(r), value)
+      self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged(r)
+
+  def LightDisc(self, center, radius, value):
+    'Light (or darken) the cells within radius of center'
+    r = (center[0]-radius, center[1]-radius, radius+radius+1, radius+radius+1)
+    for chunk in self.IterChunks(r):
+      chunk.LightDisc((center[0]-chunk.origin[0], center[1]-chunk.origin[1]), radius, value)
+      self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged(r)
+
+  def LitSpans(self, row, left, right):
+    'Return a list of (start, stop) columns of the runs of lit cells in the given row, between left and right'
+    spans = []
+    for chunk in self.IterChunks((left, row, right-left, 1)):
+      start = max(left, chunk.origin[0]) - chunk.origin[0]
+      stop = min(right, chunk.origin[0] + worldgrid.CHUNK_SIZE) - chunk.origin[0]
+      for a, b in chunk.LitSpans(row - chunk.origin[1], start, stop):
+        a += chunk.origin[0]
+        b += chunk.origin[0]
+        if spans and spans[-1][1] == a:
+          a = spans.pop()[0]  # runs continuing across the edge of a chunk
+        spans.append((a, b))
+    return spans
 
   def ThingFill(self, r, value):
-    for row in range(r.height):
-      for col in range(r.width):
-        self.things[r.top+row][r.left+col] = value
-    self.Changed()
+    i = self.registry.Id(value[1])
+    for chunk in self.IterChunks(r):
+      chunk.ThingFill(chunk.LocalRect(r), value[0], i)
+      self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged(r)
 
   def FindEmptySpotNear(self, p, max_radius=99):
     for radius in range(max_radius):
       for row in range(p[1]-radius,p[1]+1+radius):
-        if row < 0 or row >= self.sz[1]:
-          continue
         for col in range(p[0]-radius,p[0]+1+radius):
-          if col < 0 or col >= self.sz[0]:
+          if not self.CollidePoint((col,row)):
             continue
-          if not self.ground[row][col].IsTraversable():
+          if not self.GroundAt((col,row)).IsTraversable():
             continue
-          (numthing, thing) = self.things[row][col]
+          (numthing, thing) = self.ThingsAt((col,row))
           if numthing and not thing.IsTraversable():
             continue
           return (col,row)
@@ -1184,34 +1751,181 @@ class World(Observable):
       self.player.MoveTo(p)
 
   def Update(self, dt):
+    self.time += dt
+    self.ticks += 1
+    self.tick = dt
     self.player.Update(dt)
-    # Animals can move or die during this loop.
-    for p in tuple(self.animals.keys()):
-      for a in tuple(self.animals[p]):
-        if p in self.animals and a in self.animals[p]:
-          self.animals[p].remove(a)
-          a.Update(dt)
-          self.animals.setdefault(tuple(a.pos),[]).append(a)
-      if p in self.animals and not self.animals[p]:
-        del self.animals[p]
+    if not self.herd is None:
+      self.UpdateHerd(dt)
+    else:
+      self.UpdateAnimals()
     self.GrowPlants(dt)
+    self.waterFlow.Update()
+
+  def Remoteness(self, cx, cy):
+    '''Return 0 for chunks at (cx, cy) within the active radius of the player's, 1 for those
+       further away, and 2 for those further still.  Takes and returns numpy arrays, or plain numbers.'''
+    pcx, pcy = worldgrid.ChunkOf(self.player.pos)
+    distance = np.maximum(np.abs(cx - pcx), np.abs(cy - pcy))
+    return (distance > self.activeRadius) + (distance > (self.activeRadius + 1) * self.FAR_FACTOR)
+
+  def DetailLevels(self, cx, cy):
+    '''Return how the animals in the chunks at (cx[i], cy[i]) are to be brought up to date this tick:
+       herd.SIMULATE, herd.ESTIMATE or herd.WAIT.  Takes and returns numpy arrays, or plain numbers.'''
+    remoteness = self.Remoteness(cx, cy)
+    # Spread the chunks that are only looked at now and then over the ticks in between
+    phase = cx * 7 + cy * 3
+    far = np.where(phase % self.FAR_INTERVAL == self.ticks % self.FAR_INTERVAL, herd.SIMULATE, herd.WAIT)
+    distant = np.where(phase % self.DISTANT_INTERVAL == self.ticks % self.DISTANT_INTERVAL, herd.ESTIMATE, herd.WAIT)
+    return np.choose(remoteness, (herd.SIMULATE, far, distant))
+
+  def UpdateAnimals(self):
+    'Bring the animals whose wakeups have come round up to date, and schedule their next'
+    # Animals can move, die or be eaten during this loop, and newborns may be due at once.
+    while self.wakeups and self.wakeups[0][0] <= self.time:
+      wakeAt, n, a = heapq.heappop(self.wakeups)
+      if a.wakeAt != wakeAt:
+        continue  # eaten, or rescheduled
+      p = tuple(a.pos)
+      remoteness = int(self.Remoteness(*worldgrid.ChunkOf(p)))
+      dt = self.time - a.updated
+      a.updated = self.time
+      if remoteness < 2:
+        a.Update(dt)
+      else:
+        a.Estimate(dt)
+      self.ScheduleAnimal(a, remoteness)
+      if tuple(a.pos) != p:
+        self.animals[p].remove(a)
+        if not self.animals[p]:
+          del self.animals[p]
+        self.animals.setdefault(tuple(a.pos),[]).append(a)
+        self.animalGrid.Move(a, p, a.pos)
+        self.dirtyAnimals.add(worldgrid.ChunkOf(p))
+        self.dirtyAnimals.add(worldgrid.ChunkOf(a.pos))
+
+  MAX_CHANGED_RECTS = 256  # beyond which views are sent the array of changed cells instead
+
+  def UpdateHerd(self, dt):
+    cells = self.herd.Update(dt, self.DetailLevels)
+    if len(cells) == 0:
+      return
+    chunks = np.unique(cells >> worldgrid.CHUNK_SHIFT, axis=0)
+    self.dirtyAnimals.update( (cx, cy) for cx, cy in chunks.tolist() )
+    cells = np.unique(cells, axis=0)
+    if len(cells) > self.MAX_CHANGED_RECTS:
+      self.Changed(cells=cells)
+    else:
+      self.Changed(rects=[ pygame.Rect(p, (1,1)) for p in cells.tolist() ])
+
+  def AnimalCensus(self):
+    'Return (live herbivores, live carnivores, dead animals)'
+    if not self.herd is None:
+      return self.herd.Census()
+    nHerb = nCarni = nDead = 0
+    for p in self.animals:
+      for a in self.animals[p]:
+        if not a.IsAlive():
+          nDead += 1
+        elif isinstance(a, Herbivore): nHerb += 1
+        elif isinstance(a, Carnivore): nCarni += 1
+        else: assert False
+    return (nHerb, nCarni, nDead)
 
   def GrowPlants(self, dt):
-    if random.randrange(SECOND//2) < dt: # about once per second//2
-      p = (random.randrange(self.sz[1]), random.randrange(self.sz[0]))
-      numthing, thing = self.things[p[1]][p[0]]
-      if numthing == 0 and thing is None:
-        self.things[p[1]][p[0]] = (1,Grass())
-        print('new grass at {}'.format(p))
-
+    # Plants only grow where the world has been visited
+    self.plants.Update()
+
+  def OccupiedCells(self, r):
+    'Return a list of the (x, y) cells in rect r where the player or an animal is'
+    r = pygame.Rect(r)
+    cells = [ tuple(self.player.pos) ] if r.collidepoint(self.player.pos) else []
+    if not self.herd is None:
+      xs, ys, species, alive = self.herd.InRect(r)
+      cells.extend(zip(xs.tolist(), ys.tolist()))
+    else:
+      cells.extend( tuple(a.pos) for a in self.animalGrid.Near(r.center, max(r.width, r.height)) if r.collidepoint(a.pos) )
+    return cells
+
+  def GroundAt(self, p):
+    chunk = self.ChunkAt(p)
+    return self.registry.things[chunk.ground[p[1] & worldgrid.CHUNK_MASK, p[0] & worldgrid.CHUNK_MASK]]
+  def IsLit(self, p):
+    chunk = self.ChunkAt(p)
+    return chunk.IsLit(p[1] & worldgrid.CHUNK_MASK, p[0] & worldgrid.CHUNK_MASK)
   def ThingsAt(self, p):
-    return self.things[p[1]][p[0]]
-  def SetThingsAt(self, p, something):
-    self.things[p[1]][p[0]] = something
-    self.ExposeToLight(p)
+    chunk = self.ChunkAt(p)
+    row, col = p[1] & worldgrid.CHUNK_MASK, p[0] & worldgrid.CHUNK_MASK
+    return (int(chunk.thingCounts[row,col]), self.registry.things[chunk.thingIds[row,col]])
+  def SetThingsAt(self, p, something, expose=True):
+    chunk = self.ChunkAt(p)
+    row, col = p[1] & worldgrid.CHUNK_MASK, p[0] & worldgrid.CHUNK_MASK
+    chunk.thingCounts[row,col] = something[0]
+    chunk.thingIds[row,col] = self.registry.Id(something[1])
+    self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged((p[0], p[1], 1, 1))
+    self.waterFlow.WakeAt(p)  # it may have opened or closed a way for water
+    if expose:
+      self.ExposeToLight(p)
+
+  def Dig(self, p):
+    'Leave a pit at p, if it is level ground, for water to flow into'
+    ground = self.GroundAt(p)
+    if ground.depth or not ground.IsTraversable():
+      return
+    chunk = self.ChunkAt(p)
+    chunk.ground[p[1] & worldgrid.CHUNK_MASK, p[0] & worldgrid.CHUNK_MASK] = self.registry.Id(TerrainPit())
+    self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged((p[0], p[1], 1, 1))
+    self.waterFlow.WakeAt(p)
+  def ClearThingsAt(self, xs, ys):
+    'Empty the cells (xs[i], ys[i]) of things, as SetThingsAt(p, (0,None), expose=False) would each, but all at once'
+    cx = xs >> worldgrid.CHUNK_SHIFT
+    cy = ys >> worldgrid.CHUNK_SHIFT
+    for cpos in np.unique(np.stack([cx, cy], axis=1), axis=0).tolist():
+      inChunk = (cx == cpos[0]) & (cy == cpos[1])
+      x = xs[inChunk]
+      y = ys[inChunk]
+      chunk = self.Chunk(tuple(cpos))
+      chunk.thingCounts[y & worldgrid.CHUNK_MASK, x & worldgrid.CHUNK_MASK] = 0
+      chunk.thingIds[y & worldgrid.CHUNK_MASK, x & worldgrid.CHUNK_MASK] = worldgrid.NOTHING
+      self.dirtyChunks.add(chunk.pos)
+      if len(x) <= self.MAX_CHANGED_RECTS // 16:
+        for p in zip(x.tolist(), y.tolist()):
+          self.CellsChanged((p[0], p[1], 1, 1))
+      else:
+        self.CellsChanged((int(x.min()), int(y.min()), int(x.max() - x.min()) + 1, int(y.max() - y.min()) + 1))
   def ExposeToLight(self, p, r=2):
-    for q in self.IterRectAround(p,r):
-      self.lighting[q[1]][q[0]] = True
+    r = (p[0]-r, p[1]-r, r+r+1, r+r+1)
+    for chunk in self.IterChunks(r):
+      chunk.LightFill(chunk.LocalRect(r), True)
+      self.dirtyChunks.add(chunk.pos)
+    self.CellsChanged(r)
+
+_generator = None  # World used to generate chunks in a worker process
+
+def GenerateRegion(seed, sz, terrain, cposList):
+  '''Generate the chunks at cposList in a worker process.
+     Returns the specs of the things in the worker's registry, and a list of
+     (cpos, arrays, animal states) for the chunks, as World.AddGeneratedChunks() expects.'''
+  global _generator
+  if _generator is None or (_generator.seed, _generator.sz, _generator.terrain) != (seed, sz, terrain):
+    _generator = World(sz=sz, seed=seed, terrain=terrain)
+  results = []
+  for cpos in cposList:
+    chunk = _generator.GenerateChunk(cpos)
+    arrays = { name: getattr(chunk, name) for name, dtype in chunk.LAYERS }
+    animalStates = [ a.GetState() for p in _generator.animals for a in _generator.animals[p] ]
+    results.append( (cpos, arrays, animalStates) )
+    # Each chunk is generated from scratch, so nothing needs to be kept around,
+    # including what generating it left for the world to save or simulate later.
+    _generator.chunks.clear()
+    _generator.animals.clear()
+    _generator.animalGrid.Clear()
+    _generator.wakeups.clear()
+    _generator.dirtyChunks.clear()
+    _generator.dirtyAnimals.clear()
+  return ([ thing.Spec() for thing in _generator.registry.things[1:] ], results)
 
 def sinInterp(value, inLo, inHi, outLo, outHi):
   # TODO: replace with a table of additive color values
@@ -1221,11 +1935,37 @@ class WorldWnd(Window):
 
   # Render the world to the screen,
   # map input back to the world.
+  '''
+  The map is drawn a block of cells at a time into surfaces that are kept from frame to frame,
+  so that a frame is mostly just blitting blocks.  Cells are redrawn into their blocks when the
+  world reports them changed.  The blocks are composed into a window-sized map surface, which
+  is scrolled when the player moves, so that only the newly exposed strip and any changed
+  cells need composing again.
+
+  Progress bars, and sprites for the player and animals, are drawn over the top of the map as it
+  is copied to the screen.  When a creature moves, just the cells it left and entered are copied
+  from the map again and have their sprites redrawn.
+
+  Icons come from an atlas per zoom level, all built up front, so zooming never waits on them.
+  '''
+
+  BLOCK_PIXELS = 512  # largest edge of a block's surface, in pixels
+  MAX_DIRTY_RECTS = 64  # beyond which it's simpler to repaint the whole window
+  ZOOM_LEVELS = 6
 
   def __init__(self, parent, rect, world, **kwargs):
+    self.fullRepaint = False
     super().__init__(parent, rect, **kwargs)
     self.world = world
     self.player = world.player
+    self.atlases = []  # an IconAtlas for each zoom level
+    things = set(self.world.registry.things[1:]) | set(FlyweightThing.instances.values())
+    for power in range(self.ZOOM_LEVELS):
+      ts = 4 * 2**power
+      # Keyed by how things look, so that things made anew (such as tools dropped on the map) share icons
+      atlas = iconatlas.IconAtlas((ts, ts), lambda thing, size: thing.StoredIcon(size), keyOf=lambda thing: thing.IconKey())
+      atlas.AddAll(things)
+      self.atlases.append(atlas)
     self.ZoomAbs(3)
     self.player.Subscribe(CHANGE, self.OnChange)
     self.world.Subscribe(CHANGE, self.OnChange)
@@ -1233,67 +1973,299 @@ class WorldWnd(Window):
   def ZoomAbs(self, power):
     self.zoomPower = power
     self.tilesize = 4 * 2**power
+    self.atlas = self.atlases[power]
+    # Blocks are a power of two cells across, so they nest within chunks
+    self.blockCells = max(1, min(worldgrid.CHUNK_SIZE, self.BLOCK_PIXELS // self.tilesize))
+    self.blocks = {}          # map from block coordinates to Surface
+    self.damagedCells = []    # rects of cells that have changed since blocks were last brought up to date
+    self.map = None           # the map as last rendered, without overlays
+    self.sprites = {}         # map from (color, radius) to an image of a creature
+    self.frameHerd = None     # the animals in view, as found for the frame being rendered: see FrameHerd()
+    self.mapOrigin = None     # world coordinates of the cell at the top-left of self.map
     self.Dirty()
 
   def ZoomRel(self, delta):
     z = self.zoomPower + int(delta)
-    if z >= 0 and z < 6:
+    if z >= 0 and z < self.ZOOM_LEVELS:
       self.ZoomAbs(z)
 
+  def Dirty(self, rect=None):
+    'Like Window.Dirty(), but expecting lots of small rects, until there are enough to repaint everything instead'
+    if self.fullRepaint:
+      return
+    if rect is None or len(self.dirtyRects) >= self.MAX_DIRTY_RECTS:
+      self.fullRepaint = True
+      self.dirtyRects = [pygame.Rect(self.rect)]
+    elif not rect in self.dirtyRects:
+      self.dirtyRects.append(rect)
+
+  def OnChange(self, evt):
+    rects = evt.dict.get('rects')
+    if self.map is None:
+      # Nothing rendered yet (and no blocks kept), so the whole view is to be painted anyway
+      self.Dirty()
+      return Observable.OnChange(self, evt)
+    view = pygame.Rect(self.mapOrigin or (0,0), self.ViewSize())
+    if 'cells' in evt.dict:
+      rects = CellRectsWithin(evt.dict['cells'], view)
+    if rects is None or self.ViewOrigin() != self.mapOrigin:
+      # Don't know what changed, or the whole view has moved
+      self.Dirty()
+      rects = rects or ()
+    if evt.dict.get('cellsChanged'):
+      for r in rects:
+        if view.colliderect(r):
+          self.damagedCells.append(r)
+        else:
+          self.ForgetBlocks(r)  # cheaper than keeping them up to date
+    elif len(rects) > 1:
+      # A creature moving: repaint the cells it left and entered together, if they're close
+      union = rects[0].unionall(rects[1:])
+      if union.width * union.height <= 2 * sum( r.width * r.height for r in rects ):
+        rects = [union]
+    for r in rects:
+      if view.colliderect(r):
+        self.Dirty(self.CellsToScreen(r))
+    return Observable.OnChange(self, evt)  # skipping Window.OnChange, which dirties the whole window
+
+  def ViewOrigin(self):
+    'Return the world coordinates of the cell to show at the top-left of the window'
+    return ( self.world.player.pos[0] - ceildiv(self.rect.width,  self.tilesize*2)
+           , self.world.player.pos[1] - ceildiv(self.rect.height, self.tilesize*2) )
+
+  def ViewSize(self):
+    'Return how many (cols, rows) of cells are shown, including any partly shown at the edges'
+    return (ceildiv(self.rect.width, self.tilesize*2) * 2, ceildiv(self.rect.height, self.tilesize*2) * 2)
+
   def OnRender(self, surf):
     #print("WorldWnd.Render()")
-    # How many world rows & cols fit on the screen?  (Round up to display partial rows & cols at edge)
-    half_scr_rows = ceildiv(self.rect.height, self.tilesize*2)
-    half_scr_cols = ceildiv(self.rect.width,  self.tilesize*2)
     # What range of world rows & cols to render?  Remember them for hit-testing.
-    self.world_row_start = self.world.player.pos[1] - half_scr_rows
-    self.world_row_stop  = self.world.player.pos[1] + half_scr_rows
-    self.world_col_start = self.world.player.pos[0] - half_scr_cols
-    self.world_col_stop  = self.world.player.pos[0] + half_scr_cols
-    #print('half_scr_rows={}, half_scr_cols={}, toprow={}, leftcol={}'
-    #      .format(half_scr_rows, half_scr_cols, self.world_row_start, self.world_col_start))
-    #for (col,row) in self.world.IterRect((self.world_col_start,self.world_row_start,half_scr_cols*2,half_scr_rows*2)):
-    for row in range(self.world_row_start, self.world_row_stop):
-      #print('r{0}'.format(row), end='')
-      for col in range(self.world_col_start, self.world_col_stop):
-        left = self.rect.left + (col - self.world_col_start) * self.tilesize
-        top  = self.rect.top  + (row - self.world_row_start) * self.tilesize
-        r = pygame.rect.Rect(left, top, self.tilesize, self.tilesize)
-        # TODO: reconfigure rendering to not have to call CollidePoint on every point
-        if not self.world.CollidePoint( (col,row) ):
-          #pygame.draw.rect(surf, (0,127-row%8*8,255-col%8*8), r)
-          #pygame.draw.rect(surf, (0, 255-(int(math.sin(math.radians(45*(row%8)))*8)+8), 255-col%8*8), r)
-          pygame.draw.rect(surf, (0, sinInterp(row%8,0,8,255-8,255), sinInterp(col%8,0,8,255-8,255)), r)
-        elif not self.world.lighting[row][col]:
-          pygame.draw.rect(surf, (0,0,0), r)
-        else:
-          terrain = self.world.ground[row][col]
-          pygame.draw.rect(surf, terrain.GetColor(), r)
-          numthing, thing = self.world.ThingsAt((col,row))
-          if numthing and not thing is None:
-            icon = thing.GetIcon( (self.tilesize,self.tilesize) )
-            surf.blit(icon, r)
-            #pygame.draw.circle(surf, thing.GetColor(), r.center, 12)
-            if (col,row) in self.world.progress:
-              progressbar = pygame.rect.Rect(r.left+2, r.top+2, r.width-4, r.height/8)
-              pygame.draw.rect(surf, (0,0,0), progressbar)
-              progressbar.width = (progressbar.width-2) * self.world.progress[(col,row)] // thing.EnergyToHarvest()
-              progressbar.height -= 2
-              pygame.draw.rect(surf, (0,255,0), progressbar)
-          if row==self.world.player.pos[1] and col==self.world.player.pos[0]:
-            c = (255,255,0)
-            radius = self.tilesize * 2 // 6
-            if not self.world.player.throb is None:
-              radius += int( (self.tilesize // 6) * math.sin(math.radians(self.world.player.throb)) )
-            pygame.draw.circle(surf, c, r.center, radius)
-            pygame.draw.circle(surf, (0,0,0), r.center, radius, 1)
-          if (col,row) in self.world.animals:
-            for a in self.world.animals[(col,row)]:
-              #c = (255,63,0)
-              c = a.GetColor()
-              radius = self.tilesize * 3 // 12
-              pygame.draw.circle(surf, c, r.center, radius)
-              pygame.draw.circle(surf, (0,0,0), r.center, radius, 1)
+    self.world_col_start, self.world_row_start = self.ViewOrigin()
+    self.world_col_stop  = self.world_col_start + self.ViewSize()[0]
+    self.world_row_stop  = self.world_row_start + self.ViewSize()[1]
+    if self.map is None or self.mapOrigin != (self.world_col_start, self.world_row_start):
+      self.fullRepaint = True
+    damaged = self.UpdateBlocks()
+    self.UpdateMap()
+    for r in damaged:
+      self.RenderMap(self.CellsToMap(r))
+    # Only the parts of the window that changed need the map copying back over them and the overlays redrawing
+    if self.fullRepaint:
+      repaint = [pygame.Rect(self.rect)]
+    else:
+      repaint = [ r.clip(self.rect) for r in self.dirtyRects ]
+    self.frameHerd = None
+    for r in repaint:
+      surf.set_clip(r)
+      surf.blit(self.map, r, r.move(-self.rect.left, -self.rect.top))
+      self.RenderOverlays(surf, self.ScreenToCells(r))
+    surf.set_clip(None)
+    self.fullRepaint = False
+    return repaint
+
+  def CellToScreen(self, p):
+    'Return the position, relative to the window, of the top-left of cell p'
+    return ( self.rect.left + (p[0] - self.world_col_start) * self.tilesize
+           , self.rect.top  + (p[1] - self.world_row_start) * self.tilesize )
+
+  def CellsToScreen(self, r):
+    'Return the rect, relative to the window, showing the cells of rect r'
+    return pygame.Rect(self.CellToScreen(r[:2]), (r[2] * self.tilesize, r[3] * self.tilesize))
+
+  def ScreenToCells(self, r):
+    'Return the rect of cells shown in rect r, relative to the window'
+    left = self.world_col_start + (r.left - self.rect.left) // self.tilesize
+    top  = self.world_row_start + (r.top  - self.rect.top)  // self.tilesize
+    right  = self.world_col_start + ceildiv(r.right  - self.rect.left, self.tilesize)
+    bottom = self.world_row_start + ceildiv(r.bottom - self.rect.top,  self.tilesize)
+    return pygame.Rect(left, top, right - left, bottom - top)
+
+  def CellsToMap(self, r):
+    'Return the rect of self.map showing the cells of rect r'
+    return pygame.Rect( (r[0] - self.world_col_start) * self.tilesize, (r[1] - self.world_row_start) * self.tilesize
+                      , r[2] * self.tilesize, r[3] * self.tilesize ).clip(self.map.get_rect())
+
+  def UpdateMap(self):
+    'Bring self.map into line with the current view, scrolling what can be kept'
+    ts = self.tilesize
+    origin = (self.world_col_start, self.world_row_start)
+    if self.map is None or self.map.get_size() != self.rect.size:
+      self.map = pygame.Surface(self.rect.size)
+      self.mapOrigin = None
+    if self.mapOrigin is None:
+      dx = dy = None
+    else:
+      dx = (origin[0] - self.mapOrigin[0]) * ts
+      dy = (origin[1] - self.mapOrigin[1]) * ts
+    self.mapOrigin = origin
+    width, height = self.map.get_size()
+    if dx is None or abs(dx) >= width or abs(dy) >= height:
+      self.RenderMap(self.map.get_rect())
+      self.ForgetDistantBlocks()
+      return
+    if dx or dy:
+      self.map.scroll(-dx, -dy)
+      # Compose the strips that scrolled into view
+      if dx > 0:
+        self.RenderMap(pygame.Rect(width - dx, 0, dx, height))
+      elif dx < 0:
+        self.RenderMap(pygame.Rect(0, 0, -dx, height))
+      if dy > 0:
+        self.RenderMap(pygame.Rect(0, height - dy, width, dy))
+      elif dy < 0:
+        self.RenderMap(pygame.Rect(0, 0, width, -dy))
+      self.ForgetDistantBlocks()
+
+  def RenderMap(self, r):
+    'Compose rect r of self.map from the blocks, rendering any that are missing'
+    if r.width < 1 or r.height < 1:
+      return
+    n = self.blockCells
+    ts = self.tilesize
+    self.map.set_clip(r)
+    for by in range((self.world_row_start + r.top // ts) // n, (self.world_row_start + (r.bottom - 1) // ts) // n + 1):
+      for bx in range((self.world_col_start + r.left // ts) // n, (self.world_col_start + (r.right - 1) // ts) // n + 1):
+        block = self.blocks.get((bx,by))
+        if block is None:
+          block = self.blocks[(bx,by)] = self.RenderBlock((bx,by))
+        self.map.blit(block, ((bx*n - self.world_col_start) * ts, (by*n - self.world_row_start) * ts))
+    self.map.set_clip(None)
+
+  def ForgetBlocks(self, r):
+    'Forget any blocks overlapping the rect r of cells'
+    n = self.blockCells
+    for by in range(r.top // n, (r.bottom - 1) // n + 1):
+      for bx in range(r.left // n, (r.right - 1) // n + 1):
+        self.blocks.pop((bx,by), None)
+
+  def ForgetDistantBlocks(self):
+    'Forget blocks that have scrolled well out of view'
+    n = self.blockCells
+    rows = range(self.world_row_start // n - 1, (self.world_row_stop - 1) // n + 2)
+    cols = range(self.world_col_start // n - 1, (self.world_col_stop - 1) // n + 2)
+    if len(self.blocks) > 2 * len(rows) * len(cols):
+      for bpos in tuple(self.blocks):
+        if not (bpos[0] in cols and bpos[1] in rows):
+          del self.blocks[bpos]
+
+  def UpdateBlocks(self):
+    'Redraw the damaged cells of the blocks that are being kept.  Returns the rects of damaged cells.'
+    n = self.blockCells
+    for r in self.damagedCells:
+      for by in range(r.top // n, (r.bottom - 1) // n + 1):
+        for bx in range(r.left // n, (r.right - 1) // n + 1):
+          block = self.blocks.get((bx,by))
+          if not block is None:
+            self.RenderCells(block, (bx*n, by*n), r.clip((bx*n, by*n, n, n)))
+    damaged, self.damagedCells = self.damagedCells, []
+    return damaged
+
+  def RenderBlock(self, bpos):
+    'Return a new surface showing the cells of the block at block coordinates bpos'
+    n = self.blockCells
+    block = pygame.Surface((n * self.tilesize, n * self.tilesize))
+    self.RenderCells(block, (bpos[0]*n, bpos[1]*n), pygame.Rect(bpos[0]*n, bpos[1]*n, n, n))
+    return block
+
+  def RenderCells(self, block, origin, r):
+    'Draw the cells of rect r into block, a surface whose top-left shows cell origin'
+    ts = self.tilesize
+    inWorld = self.world.ClipRect(r)
+    if inWorld != r:
+      for row in range(r.top, r.bottom):
+        for col in range(r.left, r.right):
+          if not self.world.CollidePoint((col,row)):
+            cell = ((col - origin[0]) * ts, (row - origin[1]) * ts, ts, ts)
+            #pygame.draw.rect(block, (0,127-row%8*8,255-col%8*8), cell)
+            #pygame.draw.rect(block, (0, 255-(int(math.sin(math.radians(45*(row%8)))*8)+8), 255-col%8*8), cell)
+            pygame.draw.rect(block, (0, sinInterp(row%8,0,8,255-8,255), sinInterp(col%8,0,8,255-8,255)), cell)
+    if inWorld.width < 1 or inWorld.height < 1:
+      return
+    # Black out the cells within the world, then draw just the runs of lit cells over them.
+    block.fill((0,0,0), ((inWorld.left - origin[0]) * ts, (inWorld.top - origin[1]) * ts, inWorld.width * ts, inWorld.height * ts))
+    for row in range(inWorld.top, inWorld.bottom):
+      for start, stop in self.world.LitSpans(row, inWorld.left, inWorld.right):
+        for col in range(start, stop):
+          self.RenderCell(block, pygame.Rect((col - origin[0]) * ts, (row - origin[1]) * ts, ts, ts), col, row)
+
+  def RenderCell(self, surf, r, col, row):
+    'Draw the lit cell at (col,row) of the world into rect r of surf'
+    terrain = self.world.GroundAt((col,row))
+    pygame.draw.rect(surf, terrain.GetColor(), r)
+    numthing, thing = self.world.ThingsAt((col,row))
+    if numthing and not thing is None:
+      self.atlas.Blit(surf, thing, r)
+      #pygame.draw.circle(surf, thing.GetColor(), r.center, 12)
+
+  def RenderOverlays(self, surf, view):
+    'Draw what moves or changes from moment to moment over the rect view of cells'
+    self.RenderProgress(surf, view)
+    self.RenderSprites(surf, view)
+
+  def RenderProgress(self, surf, view):
+    for p, value in self.world.progress.items():
+      if view.collidepoint(p) and self.world.IsLit(p):
+        numthing, thing = self.world.ThingsAt(p)
+        if numthing and not thing is None:
+          r = pygame.Rect(self.CellToScreen(p), (self.tilesize, self.tilesize))
+          progressbar = pygame.rect.Rect(r.left+2, r.top+2, r.width-4, r.height/8)
+          pygame.draw.rect(surf, (0,0,0), progressbar)
+          progressbar.width = (progressbar.width-2) * value // thing.EnergyToHarvest()
+          progressbar.height -= 2
+          pygame.draw.rect(surf, (0,255,0), progressbar)
+
+  def Sprite(self, color, radius):
+    'Return a tile-sized image of a creature: a circle of the given color and radius'
+    key = (color, radius)
+    sprite = self.sprites.get(key)
+    if sprite is None:
+      sprite = pygame.Surface((self.tilesize, self.tilesize), pygame.SRCALPHA)
+      center = (self.tilesize // 2, self.tilesize // 2)
+      pygame.draw.circle(sprite, color, center, radius)
+      pygame.draw.circle(sprite, (0,0,0), center, radius, 1)
+      if pygame.display.get_surface():
+        sprite = sprite.convert_alpha()
+      self.sprites[key] = sprite
+    return sprite
+
+  def RenderSprites(self, surf, view):
+    'Draw the player and animals within the rect view of cells'
+    p = self.world.player.pos
+    if view.collidepoint(p) and self.world.IsLit(p):
+      c = (255,255,0)
+      radius = self.tilesize * 2 // 6
+      if not self.world.player.throb is None:
+        radius += int( (self.tilesize // 6) * math.sin(math.radians(self.world.player.throb)) )
+      surf.blit(self.Sprite(c, radius), self.CellToScreen(p))
+    if not self.world.herd is None:
+      xs, ys, cells, colors = self.FrameHerd()
+      inside = (xs >= view.left) & (xs < view.right) & (ys >= view.top) & (ys < view.bottom)
+      found = ( (cells[i], [colors[i]]) for i in np.flatnonzero(inside).tolist() )
+    elif view.width * view.height < len(self.world.animals):
+      cells = ( (col,row) for row in range(view.top, view.bottom) for col in range(view.left, view.right) )
+      found = ( (p, [ a.GetColor() for a in self.world.animals[p] ]) for p in cells if p in self.world.animals )
+    else:
+      found = ( (p, [ a.GetColor() for a in animals ]) for p, animals in self.world.animals.items() if view.collidepoint(p) )
+    radius = self.tilesize * 3 // 12
+    for p, cellColors in found:
+      if self.world.IsLit(p):
+        topleft = self.CellToScreen(p)
+        for c in cellColors:
+          #c = (255,63,0)
+          surf.blit(self.Sprite(c, radius), topleft)
+
+  def FrameHerd(self):
+    '''Return (xs, ys, cells, colors) of the animals of the herd in view: arrays of their coordinates,
+       and lists of their cells and colors.  The herd is only searched once per frame, however many
+       rects are repainted.'''
+    if self.frameHerd is None:
+      view = pygame.Rect((self.world_col_start, self.world_row_start), self.ViewSize())
+      xs, ys, species, alive = self.world.herd.InRect(view)
+      colors = [ HSV2RGB(cls.color_hsv) for cls in self.world.herd.kinds ]
+      colors = [ [ (c[0]//4, c[1]//4, c[2]//4) for c in colors ], colors ]  # as AnimateThing.GetColor() does
+      self.frameHerd = ( xs, ys, list(zip(xs.tolist(), ys.tolist()))
+                       , [ colors[a][s] for s, a in zip(species.tolist(), alive.tolist()) ] )
+    return self.frameHerd
 
   def MouseToWorldPos(self, pos):
     world_col = pos[0] // self.tilesize + self.world_col_start
@@ -1346,16 +2318,7 @@ class WorldWnd(Window):
       return True
     elif evt.unicode == '?':
       print('player.pos = {}'.format(self.world.player.pos))
-      nHerb = 0
-      nCarni = 0
-      nDead = 0
-      for p in self.world.animals:
-        for a in self.world.animals[p]:
-          if not a.IsAlive():
-            nDead += 1
-          elif isinstance(a, Herbivore): nHerb += 1
-          elif isinstance(a, Carnivore): nCarni += 1
-          else: assert False
+      nHerb, nCarni, nDead = self.world.AnimalCensus()
       print('{} animals = {} herbivores + {} carnivores + {} dead'.format(nHerb+nCarni+nDead, nHerb, nCarni, nDead))
     return False
 
@@ -1410,7 +2373,6 @@ class HotbarWnd(Window):
       self.buttonSize = 8 * 2**power
       #self.hotbar_font = pygame.font.SysFont("sans serif", 2 * 2**power)
       #self.hotbar_font = pygame.font.SysFont("freemono", 2**power, bold=True)
-      Thing.FlushIconCache()
 
   def ZoomRel(self, delta):
     z = self.zoomPower + int(delta)
@@ -1529,6 +2491,10 @@ class CatalystsPanel(Window):
     self.world.player.Subscribe(CHANGE, self.OnChange)
 
   def OnChange(self, evt):
+    reach = pygame.Rect(self.world.player.pos[0]-1, self.world.player.pos[1]-1, 3, 3)
+    rects = CellRectsWithin(evt.dict['cells'], reach) if 'cells' in evt.dict else evt.dict.get('rects')
+    if not rects is None and reach.collidelist(rects) == -1:
+      return True  # nothing changed within reach
     self.Rescan()
     super().OnChange(evt)
 
@@ -1880,6 +2846,18 @@ def DebugKeystrokeEvent(evt):
       fields.append( '"{}"'.format(evt.unicode) )
   BUGPRINT('{}', ' '.join(fields))
 
+def ParseWorldSize(text):
+  "Parse a world size given as 'WIDTHxHEIGHT' (in cells) or 'unbounded'"
+  if text == 'unbounded':
+    return None
+  try:
+    sz = tuple(int(n) for n in text.lower().split('x'))
+  except ValueError:
+    sz = ()
+  if len(sz) != 2 or sz[0] < 1 or sz[1] < 1:
+    raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT or 'unbounded', not '{}'".format(text))
+  return sz
+
 def ChooseVideoMode(margin=(96,96)):
   modes = pygame.display.list_modes()
   if modes is -1:
@@ -1893,8 +2871,14 @@ def ChooseVideoMode(margin=(96,96)):
         return m
   return (0,0)
 
+def DefaultIconStorePath():
+  cacheDir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(cacheDir, 'squareworldcraft', 'icons.npz')
+
 class Application:
 
+  SIMULATION_SHARE = 3/4  # of each frame's time that the simulation may use
+
   def __init__(self, argv):
     self.ParseArgs(argv)
     self.InitApp()
@@ -1904,10 +2888,24 @@ class Application:
     ap.add_argument('--debug', action='store_true', help='Turn on debugging output')
     ap.add_argument('--dm', action='store_true', help='Play as Dungeon Master')
     ap.add_argument('--overclock', type=int, default=1, help='Run the simulation at N times speed')
+    ap.add_argument('--tick', metavar='MS', type=int, default=SECOND//60, help='Advance the simulation in steps of MS milliseconds of game time')
+    ap.add_argument('--seed', type=int, help='Seed for generating a new world (random by default)')
+    ap.add_argument('--terrain', choices=World.TERRAIN_GENERATORS, default='rects', help='How a new world lays out its terrain, clay and rock')
+    ap.add_argument('--pregenerate', metavar='RADIUS', type=int, default=1, help='Generate a new world out to RADIUS chunks around the player at startup')
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes for generating a new world (the world comes out the same regardless)')
+    ap.add_argument('--creatures', choices=World.CREATURE_ENGINES, default='objects', help='Simulate animals as objects, or all together as arrays (for huge numbers of them)')
+    ap.add_argument('--active-radius', metavar='CHUNKS', type=int, default=World.ACTIVE_RADIUS, help='Simulate animals in full within CHUNKS chunks of the player, and in less detail further away')
+    ap.add_argument('--sim-workers', metavar='N', type=int, default=0, help='With --creatures arrays, simulate regions of the world one at a time (N=1) or on N worker processes; the outcome is the same for any N.  Stepping regions separately costs more than it saves on machines with few cores, so the default is 0, stepping the whole herd at once')
+    ap.add_argument('--size', type=ParseWorldSize, default=(1000,1000), help="World size as WIDTHxHEIGHT cells, or 'unbounded'")
+    ap.add_argument('--world', metavar='FILE', help='Load the world from FILE if it exists, and save it there (also upon Ctrl+S)')
+    ap.add_argument('--autosave', metavar='SECONDS', type=int, default=60, help='Save changes to the --world file every SECONDS in the background (0 to disable)')
+    ap.add_argument('--icon-store', metavar='FILE', default=DefaultIconStorePath(), help="Keep composed icons in FILE between runs ('' to not)")
+    ap.add_argument('--icon-cache', metavar='MB', type=int, default=Thing.ICON_CACHE_BUDGET//(1024*1024), help='Memory to spend on the scaled icon cache')
     self.opts = ap.parse_args(argv[1:])
     if self.opts.debug:
       global _DEBUG
       _DEBUG = True
+      iconcache._DEBUG = True
 
   def InitApp(self):
     print("Initializing...")
@@ -1935,12 +2933,31 @@ class Application:
     pygame.display.set_icon(icon)
     #pygame.key.set_repeat(100, 100)
 
+    Thing.SetIconCacheBudget(self.opts.icon_cache * 1024*1024)
+    Thing.IndexIcons()
+    if self.opts.icon_store:
+      # Icon colors come from the materials properties, so when they change start afresh
+      Thing.icon_store = iconcache.IconStore(self.opts.icon_store, os.stat('materials_properties.csv').st_mtime_ns)
     LoadMaterialsProperties()
     UpdateProgress(5)
-    self.world = World()
-    self.world.Generate(UpdateProgress)
-    self.world.MovePlayerToEmptySpot()
+    isNewWorld = not (self.opts.world and os.path.exists(self.opts.world))
+    if isNewWorld:
+      self.world = World(sz=self.opts.size, seed=self.opts.seed, terrain=self.opts.terrain, creatures=self.opts.creatures,
+                         activeRadius=self.opts.active_radius, simWorkers=self.opts.sim_workers)
+      if self.world.sz is None:
+        print('unbounded world, seed {}'.format(self.world.seed))
+      else:
+        print('{:,} cells, seed {}'.format(self.world.sz[0]*self.world.sz[1], self.world.seed))
+      self.world.Generate(UpdateProgress, self.opts.pregenerate, self.opts.workers)
+      self.world.MovePlayerToEmptySpot()
+    else:
+      self.world = World.Load(self.opts.world, self.opts.creatures, self.opts.active_radius, self.opts.sim_workers)
+    self.autosaver = None
+    if self.opts.world:
+      self.autosaver = worldfile.AutoSaver(self.opts.world, self.world.file, self.opts.autosave)
     self.appWnd = AppWnd(manager, self.screen, self.world, text='appWnd')
+    if Thing.icon_store:
+      Thing.icon_store.Save()
 
     #monofont = pygame.font.SysFont('freemono',16,bold=True)
     #font_test_img = monofont.render('MWQj|_{}[]', False, (0,0,0))
@@ -1948,26 +2965,41 @@ class Application:
     #assert font_test_img.get_height() == 17
 
     if self.opts.dm:
-      self.world.player.AddInventory( (1, Woodaxe(Stone())) )
-      self.world.player.AddInventory( (1, Pickaxe(Iron())) )
-      self.world.player.AddInventory( (3, CampFire()) )
-      self.world.player.AddInventory( (1, Pickaxe(Diamond())) )
+      if isNewWorld:
+        self.world.player.AddInventory( (1, Woodaxe(Stone())) )
+        self.world.player.AddInventory( (1, Pickaxe(Iron())) )
+        self.world.player.AddInventory( (3, CampFire()) )
+        self.world.player.AddInventory( (1, Pickaxe(Diamond())) )
       self.world.player.walkingSpeed = SECOND//30
 
     print("Ready.")
     UpdateProgress(100)
     progressBar.Delete()
 
+  def SaveWorld(self):
+    if self.autosaver:
+      # There is an autosaver whenever there is a --world file, and whatever has
+      # changed since the last autosave is all that needs writing.
+      self.autosaver.Flush()
+      self.world.Autosave(self.autosaver)
+      self.autosaver.Flush()
+      if self.world.KeepUnsaved(self.autosaver):
+        print('Not all changes could be saved to {}; they will be tried again'.format(self.opts.world))
+    else:
+      print('Not saving: no --world file given')
+
   def MainLoop(self):
     clock = pygame.time.Clock()
     if self.opts.overclock > 1:
       target_fps = 12
     else:
       target_fps = 60
-    elapsed = target_fps
-    dt_std = SECOND // target_fps  # 1000/16 = 17+2/3
-    dt = dt_std
+    elapsed = SECOND // target_fps
+    # Leave the rest of each frame for drawing and handling events
+    sim = scheduler.FixedStepScheduler(self.world.Update, self.opts.tick, self.opts.overclock,
+                                       budget=SECOND * self.SIMULATION_SHARE // target_fps)
     clock.tick() # Start measuring frames from now, not from when pygame was initialized.
+    label_rect = None
     quit = False
     while not quit:
       # Process events
@@ -1977,6 +3009,8 @@ class Application:
         elif evt.type is pygame.KEYDOWN:
           if evt.key is pygame.K_q and evt.mod & pygame.KMOD_CTRL:
             quit = True
+          elif evt.key is pygame.K_s and evt.mod & pygame.KMOD_CTRL:
+            self.SaveWorld()
           elif not manager.OnEvent(evt):
             DebugKeystrokeEvent(evt)
         elif evt.type is pygame.VIDEORESIZE:
@@ -1989,26 +3023,41 @@ class Application:
         else:
           manager.OnEvent(evt)
       # Update state
-      self.world.Update(dt*self.opts.overclock)
+      sim.Advance(elapsed)
+      if self.autosaver and self.autosaver.Due(elapsed):
+        self.world.Autosave(self.autosaver)
       #if self.world.changed:
       #  print('world changed')
       #  self.appWnd.Dirty()
       # Update screen
       dirtyList = manager.RenderDirtyNow(self.screen)
       if dirtyList:
-        label_text = '{:4d}x{:<4d}, {:4d} ms, {:3d} fps'.format(self.screen.get_width(), self.screen.get_height(), dt, SECOND//elapsed)
-        fps_label = manager.GetFont('LABEL').render(label_text, False, (255,255,0))
-        self.screen.blit(fps_label, ( self.screen.get_width() - fps_label.get_width()
-                                    , self.screen.get_height() - fps_label.get_height()
-                                    ))
-        self.world.player.Changed(False)
-        self.world.Changed(False)
+        # Windows only repaint what changed, so clear the old label before drawing the new one over it.
+        if not label_rect is None:
+          self.appWnd.worldWnd.Dirty(label_rect)
+          dirtyList += manager.RenderDirtyNow(self.screen)
+        label_text = '{:4d}x{:<4d}, {:4d} ms, {:3d} fps, {:3d} ticks{}'.format(self.screen.get_width(), self.screen.get_height(),
+                                                                         elapsed, SECOND//max(1, elapsed), sim.frameTicks,
+                                                                         ' (behind)' if sim.Behind() else '')
+        fps_label = manager.TextImage('LABEL', label_text, (255,255,0), False)
+        label_rect = self.screen.blit(fps_label, ( self.screen.get_width() - fps_label.get_width()
+                                                 , self.screen.get_height() - fps_label.get_height()
+                                                 ))
+        dirtyList.append(label_rect)
         pygame.display.update(dirtyList)
+      self.world.player.Changed(False)
+      self.world.Changed(False)
       assert not (self.world.changed or self.world.player.changed)
       elapsed = clock.tick(target_fps)
-      # On next timeslice, compensate for actual elapsed time.
-      dt = elapsed  # dt_std + (dt_std - elapsed)
-      #print('elapsed = {} ms, dt = {} ms'.format(elapsed,dt))
+    if self.opts.world:
+      self.SaveWorld()
+    if self.autosaver:
+      self.autosaver.Close()
+    self.world.Close()
+    if Thing.icon_store:
+      Thing.icon_store.Save()
+    BUGPRINT('icon sources: {} entries, {} KiB', len(Thing.icon_sources), sum( iconcache.SurfaceBytes(icon) for icon in Thing.icon_sources.values() ) // 1024)
+    BUGPRINT('icons: {}', Thing.icon_cache.Stats())
     return 0
 
 
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Autosaving a world in the background'
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import squareworldcraft
+import worldfile
+import worldgrid
+
+def test_failed_autosave_is_written_by_the_next(tmp_path):
+  path = str(tmp_path / 'not yet' / 'world.swc')
+  world = squareworldcraft.World(seed=2)
+  world.Generate(lambda progress: None)
+  saver = worldfile.AutoSaver(path)
+  p = world.player.pos
+  first, second = (p[0] + 2, p[1]), (p[0] + 200, p[1])
+  world.SetThingsAt(first, (3, squareworldcraft.Stone()))
+  world.Autosave(saver)
+  saver.Flush()
+  assert not os.path.exists(path)
+  os.mkdir(os.path.dirname(path))
+  world.ChunkAt(second)
+  world.SetThingsAt(second, (4, squareworldcraft.Stone()))
+  world.Autosave(saver)
+  saver.Close()
+  loaded = squareworldcraft.World.Load(path)
+  assert loaded.ThingsAt(first) == (3, squareworldcraft.Stone())
+  assert loaded.ThingsAt(second) == (4, squareworldcraft.Stone())
+
+def test_keep_unsaved_marks_what_failed_as_changed_again(tmp_path):
+  path = str(tmp_path / 'not yet' / 'world.swc')
+  world = squareworldcraft.World(seed=2)
+  world.Generate(lambda progress: None)
+  saver = worldfile.AutoSaver(path)
+  p = world.player.pos
+  cpos = worldgrid.ChunkOf(p)
+  world.SetThingsAt(p, (5, squareworldcraft.Stone()))
+  unsaved = set(world.dirtyChunks)
+  assert cpos in unsaved
+  world.Autosave(saver)
+  assert not world.dirtyChunks
+  saver.Flush()
+  assert world.KeepUnsaved(saver)
+  assert world.dirtyChunks == unsaved
+  # What failed is handed back once
+  assert not world.KeepUnsaved(saver)
+  os.mkdir(os.path.dirname(path))
+  world.Autosave(saver)
+  saver.Flush()
+  assert not world.KeepUnsaved(saver)
+  assert not world.dirtyChunks
+  saver.Close()
+  assert worldfile.WorldFile(path).ChunkPositions() >= unsaved
+  assert squareworldcraft.World.Load(path).ThingsAt(p) == (5, squareworldcraft.Stone())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Stepping a herd region by region'
+
+import os, random, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import squareworldcraft
+
+def Populate(workers):
+  'Return a small world with a herd of randomly scattered animals'
+  world = squareworldcraft.World(sz=(512,512), seed=5, creatures='arrays', simWorkers=workers)
+  world.player.pos = [256,256]
+  world.Generate(lambda progress: None, 8, 1)
+  rng = random.Random(3)
+  states = []
+  for i in range(2000):
+    a = (squareworldcraft.Herbivore if i % 4 else squareworldcraft.Carnivore)(world, (0,0), rng=rng)
+    a.pos = [rng.randrange(512), rng.randrange(512)]
+    states.append(a.GetState())
+  world.herd.AddStates(states)
+  return world
+
+def Run(workers, ticks=20):
+  'Return the states of the animals of a small world after ticks, and its census before they were taken back'
+  world = Populate(workers)
+  try:
+    for i in range(ticks):
+      world.Update(16)
+    census = world.AnimalCensus()
+    inRect = world.herd.InRect((200, 200, 150, 100))
+    byChunk = world.herd.StatesByChunk()
+    return (census, inRect, byChunk)
+  finally:
+    world.Close()
+
+def test_same_outcome_for_any_number_of_workers():
+  one = Run(1)
+  two = Run(2)
+  assert one[0] == two[0]
+  assert all( np.array_equal(a, b) for a, b in zip(one[1], two[1]) )
+  assert one[2] == two[2]
+
+def test_workers_are_only_told_of_blocks_they_may_hold():
+  world = Populate(2)
+  try:
+    for i in range(20):
+      world.Update(16)
+    shared = world.herd.pool.shared
+    assert shared.forgotten > 0
+    assert min(shared.seen.values()) == shared.forgotten
+  finally:
+    world.Close()
+
+def test_herd_taken_back_matches_the_regions():
+  census, inRect, byChunk = Run(1)
+  assert sum(census) == sum( len(states) for states in byChunk.values() )
+  cells = sorted( tuple(s['pos']) for states in byChunk.values() for s in states
+                  if 200 <= s['pos'][0] < 350 and 200 <= s['pos'][1] < 300 )
+  assert cells == sorted(zip(inRect[0].tolist(), inRect[1].tolist()))
+
+def test_waiting_animals_are_settled_when_saved():
+  world = squareworldcraft.World(sz=(512,512), seed=5, creatures='arrays', simWorkers=1)
+  world.Generate(lambda progress: None, 8, 1)
+  waiting = lambda cx, cy: np.full(cx.shape, squareworldcraft.herd.WAIT)
+  def Live():
+    states = [ s for states in world.herd.StatesByChunk().values() for s in states ]
+    return [ (s['energy'], s['age']) for s in states if s['energy'] >= squareworldcraft.Herbivore.ENERGY_MINIMUM_VIABLE ]
+  try:
+    world.herd.Update(0, waiting)
+    before = Live()
+    world.herd.Update(5000, waiting)
+    after = Live()
+    assert before and len(after) == len(before)
+    assert sum( e for e, age in before ) - sum( e for e, age in after ) == 5000 * squareworldcraft.Herbivore.ENERGY_EXPENDITURE_BASELINE * len(before)
+    assert sum( age for e, age in after ) - sum( age for e, age in before ) == 5000 * len(before)
+  finally:
+    world.Close()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Packing icons into atlas pages'
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+import iconatlas
+
+def test_items_with_the_same_key_share_an_icon():
+  composed = []
+  def Compose(item, size):
+    composed.append(item)
+    icon = pygame.Surface(size, pygame.SRCALPHA)
+    icon.fill(item[1])
+    return icon
+  atlas = iconatlas.IconAtlas((8, 8), Compose, keyOf=lambda item: item[1])
+  red, alsoRed, blue = ('a', (255, 0, 0)), ('b', (255, 0, 0)), ('c', (0, 0, 255))
+  atlas.AddAll([red, alsoRed, blue])
+  assert composed == [red, blue]
+  assert atlas.Slot(alsoRed) == atlas.Slot(red)
+  assert len(atlas.slots) == 2
+  assert tuple(atlas.Image(alsoRed).get_at((4, 4)))[:3] == (255, 0, 0)
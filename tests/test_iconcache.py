@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Keeping composed icons between runs'
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame
+
+import iconcache
+
+def test_damaged_store_is_ignored(tmp_path):
+  path = str(tmp_path / 'icons.npz')
+  icon = pygame.Surface((4, 4), pygame.SRCALPHA)
+  icon.fill((255, 0, 0))
+  store = iconcache.IconStore(path, 1)
+  store.Put('red', icon)
+  store.Save()
+  assert tuple(iconcache.IconStore(path, 1).Get('red').get_at((2, 2))) == (255, 0, 0, 255)
+  with open(path, 'r+b') as f:
+    f.truncate(os.path.getsize(path) // 2)
+  assert len(iconcache.IconStore(path, 1)) == 0
+  with open(path, 'wb') as f:
+    f.write(b'PK\x03\x04garbage')
+  assert len(iconcache.IconStore(path, 1)) == 0
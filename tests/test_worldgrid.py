@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Lighting cells in the packed lighting bitmap'
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import squareworldcraft
+import worldgrid
+
+def Lit(block):
+  'Return a boolean array of which cells of block are lit, one cell at a time'
+  return np.array([ [ block.IsLit(row, col) for col in range(block.size[0]) ] for row in range(block.size[1]) ])
+
+def InDisc(size, center, radius):
+  'Return a boolean array of which cells of a block of the given size are within radius of center, one cell at a time'
+  return np.array([ [ (col-center[0])**2 + (row-center[1])**2 <= radius*radius for col in range(size[0]) ] for row in range(size[1]) ])
+
+def test_light_disc_matches_cell_by_cell():
+  size = (150, 40)
+  for center, radius in ( ((70, 20), 0), ((70, 20), 5), ((63, 10), 17), ((-3, 38), 9), ((149, 0), 30), ((300, 20), 10) ):
+    block = worldgrid.CellLayers(size)
+    block.LightFill((0, 0) + size, False)
+    block.LightDisc(center, radius, True)
+    assert np.array_equal(Lit(block), InDisc(size, center, radius))
+    block.LightFill((0, 0) + size, True)
+    block.LightDisc(center, radius, False)
+    assert np.array_equal(Lit(block), ~InDisc(size, center, radius))
+
+def test_world_light_disc_crosses_chunks():
+  world = squareworldcraft.World(sz=(256, 256), seed=1)
+  r = (40, 40, 60, 60)
+  world.LightFill(r, False)
+  center, radius = (64, 64), 20
+  world.LightDisc(center, radius, True)
+  for y in range(r[1], r[1] + r[3]):
+    for x in range(r[0], r[0] + r[2]):
+      assert world.IsLit((x, y)) == ((x-center[0])**2 + (y-center[1])**2 <= radius*radius)
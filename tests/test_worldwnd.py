@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Rendering the world view, headless'
+
+import os, sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pygame
+
+import squareworldcraft
+
+_app = None
+
+def App():
+  'Return the one Application (as class attributes it sets up can only be set up once)'
+  global _app
+  if _app is None:
+    _app = squareworldcraft.Application(['squareworldcraft', '--dm', '--seed', '2', '--workers', '1', '--icon-store', ''])
+  return _app
+
+def test_change_before_first_render():
+  app = App()
+  ww = squareworldcraft.WorldWnd(app.appWnd, pygame.Rect(app.appWnd.worldWnd.rect), app.world)
+  assert ww.map is None
+  p = app.world.player.pos
+  app.world.CellsChanged((p[0], p[1], 1, 1))
+  app.world.Changed(rects=[pygame.Rect(p, (1,1)), pygame.Rect((p[0]+1, p[1]), (1,1))])
+  assert ww.fullRepaint
+
+def test_scattered_changes_repaint_only_the_cells_in_view():
+  app = App()
+  ww = squareworldcraft.WorldWnd(app.appWnd, pygame.Rect(app.appWnd.worldWnd.rect), app.world)
+  ww.OnRender(pygame.Surface(ww.rect.size))
+  ww.dirtyRects = []
+  p = app.world.player.pos
+  cells = np.array([ (p[0] + 1, p[1]) ] + [ (p[0] + 1000 + i, p[1]) for i in range(300) ])
+  app.world.Changed(cells=cells)
+  assert not ww.fullRepaint
+  assert ww.dirtyRects == [ ww.CellsToScreen(pygame.Rect((p[0] + 1, p[1]), (1,1))) ]
+
+def test_sprites_of_several_animals_in_arrays_engine():
+  app = App()
+  world = squareworldcraft.World(seed=2, creatures='arrays')
+  world.Generate(lambda progress: None)
+  ww = squareworldcraft.WorldWnd(app.appWnd, pygame.Rect(app.appWnd.worldWnd.rect), world)
+  # One of each kind of animal either side of the player, in a lit view
+  p = world.player.pos
+  world.herd.Flush()
+  states = world.herd.States([0, 0])
+  for state, cls, dx in zip(states, world.herd.kinds, (-2, 2)):
+    state['class'] = cls.__name__
+    state['pos'] = [p[0] + dx, p[1] + 1]
+  world.herd.AddStates(states)
+  view = pygame.Rect(ww.ViewOrigin(), ww.ViewSize())
+  for chunk in world.chunks.values():
+    chunk.LightFill(chunk.LocalRect(view), True)
+  xs, ys, species, alive = world.herd.InRect(view)
+  cells = list(zip(xs.tolist(), ys.tolist()))
+  surf = pygame.Surface(ww.rect.size)
+  ww.OnRender(surf)
+  half = ww.tilesize // 2
+  drawn = []
+  for q, s, a in zip(cells, species.tolist(), alive.tolist()):
+    center = (ww.CellToScreen(q)[0] + half, ww.CellToScreen(q)[1] + half)
+    if cells.count(q) > 1 or q == tuple(p) or not surf.get_rect().collidepoint(center):
+      continue  # covered by another sprite, or not wholly in the window
+    c = squareworldcraft.HSV2RGB(world.herd.kinds[s].color_hsv)
+    if not a:
+      c = (c[0]//4, c[1]//4, c[2]//4)
+    assert tuple(surf.get_at(center))[:3] == tuple(c)
+    drawn.append(q)
+  assert (p[0] - 2, p[1] + 1) in drawn and (p[0] + 2, p[1] + 1) in drawn
+
+def test_icons_are_composed_without_touching_the_disk(monkeypatch):
+  App()
+  def Load(path):
+    raise AssertionError('loaded {} during play'.format(path))
+  monkeypatch.setattr(pygame.image, 'load', Load)
+  squareworldcraft.Thing.FlushIconCache()
+  for thing in (squareworldcraft.Pickaxe(squareworldcraft.Bronze()), squareworldcraft.Table(), squareworldcraft.Stone()):
+    assert thing.GetIcon((23, 23)).get_size() == (23, 23)
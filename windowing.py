@@ -7,7 +7,7 @@ TODO:
   * actually use dirty rect list in OnRedraw
 '''
 
-import pygame, enum, math, colorsys
+import pygame, enum, math, colorsys, collections
 
 _DEBUG = False
 
@@ -173,6 +173,15 @@ class Window(Observable):
     else:
       return self.parentWnd.GetFont(font_purpose)
 
+  def TextImage(self, font, text, color, antialias=True):
+    'Return an image of text rendered in font (or the font for the given purpose), which must not be modified'
+    if self.parentWnd is None:
+      if isinstance(font, str):
+        font = self.GetFont(font)
+      return font.render(text, antialias, color)
+    else:
+      return self.parentWnd.TextImage(font, text, color, antialias)
+
   def OnActivationChange(self, newState):
     self.isActive = newState
 
@@ -360,7 +369,7 @@ class Window(Observable):
 
   def RenderText(self, surf):
     if self.text:
-      textimg = self.GetFont('TEXT').render(self.text, True, self.GetColorTheme()['fg'])
+      textimg = self.TextImage('TEXT', self.text, self.GetColorTheme()['fg'])
       return surf.blit(textimg, (surf.get_width()/2 - textimg.get_width()/2, surf.get_height()/2 - textimg.get_height()/2))
 
   def OnRender(self, surf):
@@ -469,20 +478,45 @@ class WindowManager(Window):
 
   'A special Window that acts as a top-most container of Windows.'
 
+  MAX_TEXT_IMAGES = 256  # rendered text kept for reuse
+
   def __init__(self, **kwargs):
     assert not 'parentWnd' in kwargs
     super().__init__(None, **kwargs)
     self.colorTheme = ColorTheme()
-    self.fonts = {}
+    self.sysFonts = {}   # map from (face, size, bold) to Font
+    self.textImages = collections.OrderedDict()  # map from (font, text, color, antialias) to Surface, least recently used first
+    self.fonts = {}      # map from purpose to Font
     self.SetFonts()
 
   def SetFonts(self, fontName='freemono', labelSize=12, textSize=14):
-    self.fonts['LABEL'] = pygame.font.SysFont(fontName, labelSize, bold=True)
-    self.fonts['TEXT' ] = pygame.font.SysFont(fontName, textSize , bold=True)
+    self.fonts['LABEL'] = self.SysFont(fontName, labelSize, bold=True)
+    self.fonts['TEXT' ] = self.SysFont(fontName, textSize , bold=True)
 
   def GetFont(self, font_purpose):
     return self.fonts[font_purpose]
 
+  def SysFont(self, face, size, bold=False):
+    'Like pygame.font.SysFont(), but only looking up each font once'
+    key = (face, size, bold)
+    font = self.sysFonts.get(key)
+    if font is None:
+      font = self.sysFonts[key] = pygame.font.SysFont(face, size, bold=bold)
+    return font
+
+  def TextImage(self, font, text, color, antialias=True):
+    if isinstance(font, str):
+      font = self.GetFont(font)
+    key = (font, text, tuple(color), antialias)
+    img = self.textImages.get(key)
+    if img is None:
+      img = self.textImages[key] = font.render(text, antialias, color)
+      if len(self.textImages) > self.MAX_TEXT_IMAGES:
+        self.textImages.popitem(last=False)
+    else:
+      self.textImages.move_to_end(key)
+    return img
+
   def AddChildWnd(self, wnd):
     super().AddChildWnd(wnd)
     wnd.OnActivationChange(True)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Saving and loading worlds as chunked, memory-mappable binary files'
+
+'''
+File layout:
+  header    - HEADER_SIZE bytes: magic, format version, chunk size, and where to find the metadata
+  blocks    - one BLOCK_SIZE block per saved chunk, holding each of its layers' raw arrays in turn
+  metadata  - UTF-8 JSON: everything that isn't a chunk's arrays (seed, registry, player, ...),
+              plus the chunk index, which also carries each chunk's own JSON data (its animals, ...)
+
+Blocks are page aligned so that a loaded chunk's arrays can be views directly onto a
+copy-on-write memory map of the file: nothing is read from disk until a chunk is touched,
+and changes to the world never write through to the file.
+
+An AutoSaver updates a file in place: changed blocks are overwritten where they are,
+new blocks and a new copy of the metadata are appended, and only then is the header
+pointed at the new metadata.  Superseded copies of the metadata are left as dead space
+until there is enough of it to be worth compacting the file.
+'''
+
+import os, json, struct, threading, queue
+
+import numpy as np
+
+import worldgrid
+
+_DEBUG = False
+def BUGPRINT(fmtstr, *posargs, **kwargs):
+  if _DEBUG: print(fmtstr.format(*posargs, **kwargs))
+
+MAGIC = b'SWCWORLD'
+VERSION = 4
+HEADER_FORMAT = '<8sIIQQ'  # magic, version, chunk size, metadata offset, metadata length
+HEADER_SIZE = 4096
+ALIGNMENT = 4096
+
+def Align(n):
+  return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+CHUNK_SHAPES = { name: worldgrid.Chunk.Shape(name, (worldgrid.CHUNK_SIZE, worldgrid.CHUNK_SIZE)) for name, dtype in worldgrid.Chunk.LAYERS }
+
+BLOCK_SIZE = Align(sum( int(np.prod(CHUNK_SHAPES[name])) * np.dtype(dtype).itemsize for name, dtype in worldgrid.Chunk.LAYERS ))
+
+class WorldFileError(Exception):
+  pass
+
+def WriteBlock(f, chunk):
+  'Write the arrays of chunk to f as one block'
+  written = 0
+  for name, dtype in chunk.LAYERS:
+    data = np.ascontiguousarray(getattr(chunk, name), dtype=dtype).tobytes()
+    f.write(data)
+    written += len(data)
+  f.write(bytes(BLOCK_SIZE - written))
+
+def ReadHeader(f, path):
+  'Return (metadata offset, metadata length) from the header of the world file f'
+  f.seek(0)
+  header = f.read(struct.calcsize(HEADER_FORMAT))
+  if len(header) < struct.calcsize(HEADER_FORMAT):
+    raise WorldFileError('{}: truncated header'.format(path))
+  magic, version, chunkSize, metaOffset, metaLength = struct.unpack(HEADER_FORMAT, header)
+  if magic != MAGIC:
+    raise WorldFileError('{}: not a world file'.format(path))
+  if version != VERSION or chunkSize != worldgrid.CHUNK_SIZE:
+    raise WorldFileError('{}: unsupported version {} with chunk size {}'.format(path, version, chunkSize))
+  return (metaOffset, metaLength)
+
+def WriteMetadata(f, offset, metadata, index, chunkData):
+  '''Write metadata and the chunk index at offset, then point the header at them.
+     Returns the length of what was written.'''
+  chunks = [ [cpos[0], cpos[1], blockOffset, chunkData.get(cpos)] for cpos, blockOffset in sorted(index.items()) ]
+  data = json.dumps(dict(metadata, chunks=chunks)).encode('utf-8')
+  f.seek(offset)
+  f.write(data)
+  f.flush()
+  os.fsync(f.fileno())
+  f.seek(0)
+  f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, worldgrid.CHUNK_SIZE, offset, len(data)))
+  f.flush()
+  os.fsync(f.fileno())
+  return len(data)
+
+def Save(path, metadata, chunks, chunkData={}):
+  '''Write metadata (a JSON-able dict), chunks (an iterable of worldgrid.Chunk), and chunkData
+     (a map from chunk coordinates to JSON-able data) to a world file.  The file is written alongside
+     and then moved into place, so an existing file at path (possibly still memory-mapped by a
+     WorldFile) is never seen half-written.  Returns the chunk index: a map from chunk coordinates
+     to block offsets.'''
+  tmppath = path + '.tmp'
+  index = {}
+  with open(tmppath, 'wb') as f:
+    f.write(bytes(HEADER_SIZE))
+    offset = HEADER_SIZE
+    for chunk in chunks:
+      WriteBlock(f, chunk)
+      index[chunk.pos] = offset
+      offset += BLOCK_SIZE
+    WriteMetadata(f, offset, metadata, index, chunkData)
+  os.replace(tmppath, path)
+  return index
+
+class WorldFile:
+  'A saved world, memory-mapped so that chunks are only paged in from disk when touched'
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as f:
+      metaOffset, metaLength = ReadHeader(f, path)
+      f.seek(metaOffset)
+      self.metadata = json.loads(f.read(metaLength).decode('utf-8'))
+    chunks = self.metadata.pop('chunks')
+    self.index = { (cx,cy): offset for cx, cy, offset, data in chunks }  # map from chunk coordinates to block offset
+    self.chunkData = { (cx,cy): data for cx, cy, offset, data in chunks if not data is None }
+    self.mm = np.memmap(path, dtype=np.uint8, mode='c')
+
+  def ChunkPositions(self):
+    return self.index.keys()
+
+  def Chunk(self, cpos):
+    'Return the saved chunk at chunk coordinates cpos, as views onto the file, or None if it was never saved'
+    offset = self.index.get(cpos)
+    if offset is None:
+      return None
+    arrays = {}
+    for name, dtype in worldgrid.Chunk.LAYERS:
+      arrays[name] = np.ndarray(CHUNK_SHAPES[name], dtype=dtype, buffer=self.mm, offset=offset)
+      offset += arrays[name].nbytes
+    return worldgrid.Chunk(cpos, arrays=arrays)
+
+class AutoSaver:
+  '''Writes snapshots of the changed parts of a world to its file, on a background thread.
+     Only the main thread should call Submit(), Flush() and Close().'''
+
+  def __init__(self, path, worldFile=None, interval=60):
+    'worldFile is the WorldFile at path that the world was loaded from, if any'
+    self.path = path
+    self.interval = interval * 1000  # milliseconds between autosaves
+    self.elapsed = 0
+    if worldFile is None:
+      self.index = None              # the file has to be written in full before it can be updated
+      self.chunkData = {}
+    else:
+      self.index = dict(worldFile.index)
+      self.chunkData = dict(worldFile.chunkData)
+    self.deadBytes = 0
+    self.lock = threading.Lock()
+    self.unsaved = (set(), set())  # chunk positions of the cells and chunk data in snapshots that failed to be written
+    self.queue = queue.Queue(maxsize=1)
+    self.thread = threading.Thread(target=self.Run, name='AutoSaver', daemon=True)
+    self.thread.start()
+
+  def Due(self, elapsed):
+    'Account for elapsed milliseconds; return True if it is time to submit another snapshot'
+    self.elapsed += elapsed
+    return self.interval > 0 and self.elapsed >= self.interval and not self.Busy()
+
+  def Busy(self):
+    'Is a snapshot still waiting to be written?'
+    return self.queue.full()
+
+  def Submit(self, metadata, chunks, chunkData):
+    '''Queue a snapshot: metadata (JSON-able dict), chunks (copies of the worldgrid.Chunks whose cells changed),
+       and chunkData (map from chunk coordinates to the JSON-able data of each chunk that changed in any way).'''
+    self.elapsed = 0
+    self.queue.put_nowait( (metadata, chunks, chunkData) )
+
+  def TakeUnsaved(self):
+    '''Return (chunk positions of cells, chunk positions of chunk data) in the snapshots that have
+       failed to be written since this was last asked, for the next snapshot to include again'''
+    with self.lock:
+      unsaved, self.unsaved = self.unsaved, (set(), set())
+    return unsaved
+
+  def Flush(self):
+    'Wait until every submitted snapshot has been written (or has failed to be)'
+    self.queue.join()
+
+  def Close(self):
+    self.Flush()
+    self.queue.put(None)
+    self.thread.join()
+
+  def Run(self):
+    while True:
+      snapshot = self.queue.get()
+      try:
+        if snapshot is None:
+          return
+        index = None if self.index is None else dict(self.index)
+        chunkData = dict(self.chunkData)
+        self.Write(*snapshot)
+      except Exception as e:
+        print('Autosave to {} failed: {} (will try again with the next one)'.format(self.path, e))
+        # Forget whatever this one got as far as recording, and have its chunks submitted again
+        self.index = index
+        self.chunkData = chunkData
+        metadata, chunks, changedData = snapshot
+        with self.lock:
+          self.unsaved[0].update( chunk.pos for chunk in chunks )
+          self.unsaved[1].update(changedData)
+      finally:
+        self.queue.task_done()
+
+  def Write(self, metadata, chunks, chunkData):
+    self.chunkData.update(chunkData)
+    if self.index is None or not os.path.exists(self.path):
+      self.index = Save(self.path, metadata, chunks, self.chunkData)
+      self.deadBytes = 0
+      print('autosaved {} chunks to {}'.format(len(chunks), self.path))
+      return
+    with open(self.path, 'r+b') as f:
+      metaOffset, metaLength = ReadHeader(f, self.path)
+      end = Align(max(metaOffset + metaLength, f.seek(0, os.SEEK_END)))
+      # Changed chunks are overwritten in place, new ones go after the current metadata.
+      for chunk in chunks:
+        offset = self.index.get(chunk.pos)
+        if offset is None:
+          offset = end
+          end += BLOCK_SIZE
+          self.index[chunk.pos] = offset
+        f.seek(offset)
+        WriteBlock(f, chunk)
+      WriteMetadata(f, end, metadata, self.index, self.chunkData)
+    self.deadBytes += metaLength
+    BUGPRINT('autosaved {} chunks and {} chunk records to {}', len(chunks), len(chunkData), self.path)
+    if self.deadBytes > len(self.index) * BLOCK_SIZE // 4 + 1024*1024:
+      self.Compact(metadata)
+
+  def Compact(self, metadata):
+    'Rewrite the file without the dead space left by superseded metadata'
+    tmppath = self.path + '.tmp'
+    index = {}
+    with open(self.path, 'rb') as src, open(tmppath, 'wb') as f:
+      f.write(bytes(HEADER_SIZE))
+      offset = HEADER_SIZE
+      for cpos, srcOffset in sorted(self.index.items()):
+        src.seek(srcOffset)
+        f.write(src.read(BLOCK_SIZE))
+        index[cpos] = offset
+        offset += BLOCK_SIZE
+      WriteMetadata(f, offset, metadata, index, self.chunkData)
+    os.replace(tmppath, self.path)
+    self.index = index
+    self.deadBytes = 0
+    print('compacted {}'.format(self.path))
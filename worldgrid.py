@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Array-backed storage for the cells of a world map'
+
+'''
+Cells are stored as parallel 2-D numpy arrays, indexed [row][col] (i.e. [y][x]):
+  ground      - ID of the Terrain flyweight
+  thingIds    - ID of the (type of) thing in the cell, 0 for nothing
+  thingCounts - how many of that thing are in the cell
+  lighting    - whether the cell has been revealed, packed one bit per cell into LIGHT_DTYPE words
+                (so shaped [row][col // LIGHT_BITS], with column col in bit col % LIGHT_BITS)
+  water       - how much water is standing in the cell (see fluids.py for the units)
+IDs are handed out by a ThingRegistry, which maps them back to the Thing objects.
+
+The map is divided into square Chunks of CHUNK_SIZE cells, each holding its own arrays,
+so that only the parts of the map that have been visited need to exist.
+'''
+
+import numpy as np
+
+ID_DTYPE = np.uint16
+COUNT_DTYPE = np.uint16
+NOTHING = 0  # ID of None, i.e. an empty cell
+
+WATER_DTYPE = np.uint16
+
+LIGHT_DTYPE = np.uint64
+LIGHT_BITS = 64  # cells per word of the lighting bitmap
+_ALL_BITS = LIGHT_DTYPE(0xFFFFFFFFFFFFFFFF)
+
+CHUNK_SHIFT = 6
+CHUNK_SIZE = 1 << CHUNK_SHIFT  # cells along each edge of a chunk
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+
+def ChunkOf(p):
+  'Return the coordinates of the chunk containing cell p'
+  return (p[0] >> CHUNK_SHIFT, p[1] >> CHUNK_SHIFT)
+
+def ChunkRect(cpos):
+  'Return the rect (left, top, width, height), in cells, covered by the chunk at chunk coordinates cpos'
+  return (cpos[0] << CHUNK_SHIFT, cpos[1] << CHUNK_SHIFT, CHUNK_SIZE, CHUNK_SIZE)
+
+def ChunksOverlapping(r):
+  'Return an iterator over the coordinates of the chunks overlapping rect r (left, top, width, height)'
+  if r[2] < 1 or r[3] < 1:
+    return
+  for cy in range(r[1] >> CHUNK_SHIFT, ((r[1] + r[3] - 1) >> CHUNK_SHIFT) + 1):
+    for cx in range(r[0] >> CHUNK_SHIFT, ((r[0] + r[2] - 1) >> CHUNK_SHIFT) + 1):
+      yield (cx, cy)
+
+def LowBits(n):
+  'Return LIGHT_DTYPE words with the lowest n bits set, for (an array of) n from 0 to LIGHT_BITS'
+  n = np.asarray(n, dtype=LIGHT_DTYPE)
+  return np.where(n >= LIGHT_BITS, _ALL_BITS, (LIGHT_DTYPE(1) << np.minimum(n, LIGHT_BITS-1)) - LIGHT_DTYPE(1))
+
+def SpanMasks(lefts, rights, words):
+  '''Return lighting words with the bits for columns [lefts, rights) set, shaped (len(lefts), words).
+     lefts and rights are arrays, one span per row.'''
+  offsets = np.arange(words) * LIGHT_BITS
+  lo = np.clip(np.asarray(lefts)[:,np.newaxis] - offsets, 0, LIGHT_BITS)
+  hi = np.clip(np.asarray(rights)[:,np.newaxis] - offsets, 0, LIGHT_BITS)
+  return LowBits(hi) & ~LowBits(lo)
+
+class ThingRegistry:
+  'A two-way mapping between Thing objects and small integer IDs suitable for storing in arrays'
+
+  def __init__(self, things=None):
+    'Create a registry, optionally restoring IDs from a list of Things (as previously found in .things)'
+    if things is None:
+      things = [None]
+    assert things[0] is None
+    self.things = list(things)  # Map from ID to Thing
+    self.ids = { thing: i for i, thing in enumerate(self.things) }  # Map from Thing to ID
+
+  def __len__(self):
+    return len(self.things)
+
+  def Id(self, thing):
+    'Return the ID of thing, registering it if it has not been seen before.'
+    i = self.ids.get(thing)
+    if i is None:
+      i = len(self.things)
+      if i > np.iinfo(ID_DTYPE).max:
+        raise OverflowError('too many distinct things registered')
+      self.things.append(thing)
+      self.ids[thing] = i
+    return i
+
+  def Thing(self, i):
+    return self.things[i]
+
+class CellLayers:
+  'The terrain, things, lighting and water of a rectangular block of cells'
+
+  # (attribute name, dtype) of each array
+  LAYERS = ( ('ground',      ID_DTYPE)
+           , ('thingIds',    ID_DTYPE)
+           , ('thingCounts', COUNT_DTYPE)
+           , ('lighting',    LIGHT_DTYPE)
+           , ('water',       WATER_DTYPE)
+           )
+
+  @staticmethod
+  def Shape(name, size):
+    'Return the shape of the named layer for a block of cells of the given (width, height)'
+    if name == 'lighting':
+      return (size[1], (size[0] + LIGHT_BITS - 1) // LIGHT_BITS)
+    return (size[1], size[0])
+
+  def __init__(self, size, groundId=NOTHING, arrays=None):
+    'Create blank layers of the given (width, height), or adopt existing arrays (such as views of a file)'
+    shape = (size[1], size[0])
+    self.size = (size[0], size[1])
+    if arrays is None:
+      self.ground = np.full(shape, groundId, dtype=ID_DTYPE)
+      self.thingIds = np.zeros(shape, dtype=ID_DTYPE)
+      self.thingCounts = np.zeros(shape, dtype=COUNT_DTYPE)
+      self.lighting = np.full(self.Shape('lighting', size), _ALL_BITS, dtype=LIGHT_DTYPE)
+      self.water = np.zeros(shape, dtype=WATER_DTYPE)
+    else:
+      for name, dtype in self.LAYERS:
+        assert arrays[name].shape == self.Shape(name, size) and arrays[name].dtype == dtype
+        setattr(self, name, arrays[name])
+
+  def nbytes(self):
+    return sum( getattr(self, name).nbytes for name, dtype in self.LAYERS )
+
+  def Slices(self, r):
+    'Return (rows, cols) slices for the part of rect r (left, top, width, height) that lies within the block'
+    left   = max(0, r[0])
+    top    = max(0, r[1])
+    right  = min(self.size[0], r[0] + r[2])
+    bottom = min(self.size[1], r[1] + r[3])
+    return (slice(top, max(top, bottom)), slice(left, max(left, right)))
+
+  def GroundFill(self, r, groundId):
+    self.ground[self.Slices(r)] = groundId
+
+  def ThingFill(self, r, count, thingId):
+    s = self.Slices(r)
+    self.thingIds[s] = thingId
+    self.thingCounts[s] = count
+
+  def LightFill(self, r, value):
+    rows, cols = self.Slices(r)
+    self.ApplyLight(rows, SpanMasks([cols.start], [cols.stop], self.lighting.shape[1]), value)
+
+  def LightDisc(self, center, radius, value):
+    'Light (or darken) the cells within radius of center (col, row), which may lie outside the block'
+    top = max(0, center[1] - radius)
+    bottom = min(self.size[1], center[1] + radius + 1)
+    if top >= bottom:
+      return
+    dy = np.arange(top, bottom) - center[1]
+    halfWidths = np.sqrt(radius*radius - dy*dy).astype(np.int64)
+    lefts = np.clip(center[0] - halfWidths, 0, self.size[0])
+    rights = np.clip(center[0] + halfWidths + 1, 0, self.size[0])
+    self.ApplyLight(slice(top, bottom), SpanMasks(lefts, rights, self.lighting.shape[1]), value)
+
+  def LightMask(self, mask, value):
+    'Light (or darken) the cells where the boolean array mask, shaped like the block, is True'
+    packed = np.packbits(mask, axis=1, bitorder='little')
+    words = np.zeros(self.lighting.shape, dtype='<u8')
+    words.view(np.uint8)[:, :packed.shape[1]] = packed
+    self.ApplyLight(slice(None), words.astype(LIGHT_DTYPE), value)
+
+  def ApplyLight(self, rows, masks, value):
+    'Set (or clear, if not value) the bits of masks in the given rows of the lighting bitmap'
+    if value:
+      self.lighting[rows] |= masks
+    else:
+      self.lighting[rows] &= ~masks
+
+  def IsLit(self, row, col):
+    return bool((self.lighting[row, col // LIGHT_BITS] >> LIGHT_DTYPE(col % LIGHT_BITS)) & LIGHT_DTYPE(1))
+
+  def LitRow(self, row):
+    'Return a boolean array of which cells of the given row are lit'
+    bits = np.unpackbits(self.lighting[row].astype('<u8').view(np.uint8), bitorder='little')
+    return bits[:self.size[0]].view(np.bool_)
+
+  def LitSpans(self, row, left=0, right=None):
+    'Return a list of (start, stop) columns of the runs of lit cells in the given row, between left and right'
+    if right is None:
+      right = self.size[0]
+    lit = self.LitRow(row)[left:right].astype(np.int8)
+    edges = np.diff(lit, prepend=0, append=0)
+    return list(zip((np.flatnonzero(edges == 1) + left).tolist(), (np.flatnonzero(edges == -1) + left).tolist()))
+
+  def ThingScatter(self, cells, counts, thingIds):
+    '''Put counts[i] of thingIds[i] in each of cells[i] (a flat index, row * width + col).
+       Where a cell is given more than once, the last one wins.'''
+    cells = np.asarray(cells)
+    # np.unique finds first occurrences, so look from the end
+    cells, last = np.unique(cells[::-1], return_index=True)
+    last = len(thingIds) - 1 - last
+    self.thingIds.flat[cells] = np.asarray(thingIds)[last]
+    self.thingCounts.flat[cells] = np.asarray(counts)[last]
+
+class Chunk(CellLayers):
+  'A CellLayers of CHUNK_SIZE x CHUNK_SIZE cells at a fixed position in the world'
+
+  def __init__(self, cpos, groundId=NOTHING, arrays=None):
+    super().__init__((CHUNK_SIZE, CHUNK_SIZE), groundId, arrays)
+    self.pos = cpos    # in chunk coordinates
+    self.origin = (cpos[0] << CHUNK_SHIFT, cpos[1] << CHUNK_SHIFT)  # world coordinates of top-left cell
+
+  def Rect(self):
+    return ChunkRect(self.pos)
+
+  def LocalRect(self, r):
+    'Translate rect r from world coordinates to coordinates within this chunk'
+    return (r[0] - self.origin[0], r[1] - self.origin[1], r[2], r[3])
+
+  def Copy(self):
+    'Return a copy of this chunk with arrays of its own'
+    return Chunk(self.pos, arrays={ name: getattr(self, name).copy() for name, dtype in self.LAYERS })
+
+class BucketGrid:
+  '''A map from items (such as creatures) to the cells they are at, bucketed into squares of
+     2**shift cells, so that finding the items near a cell only looks at a few nearby buckets'''
+
+  def __init__(self, shift=4):
+    self.shift = shift
+    self.buckets = {}  # map from bucket coordinates to {item: None}, which is an ordered set
+
+  def __len__(self):
+    return sum(map(len, self.buckets.values()))
+
+  def Bucket(self, p):
+    return (p[0] >> self.shift, p[1] >> self.shift)
+
+  def Add(self, item, p):
+    self.buckets.setdefault(self.Bucket(p), {})[item] = None
+
+  def Remove(self, item, p):
+    b = self.Bucket(p)
+    bucket = self.buckets[b]
+    del bucket[item]
+    if not bucket:
+      del self.buckets[b]
+
+  def Move(self, item, old, new):
+    'Note that item has moved from cell old to cell new'
+    if self.Bucket(old) != self.Bucket(new):
+      self.Remove(item, old)
+      self.Add(item, new)
+
+  def Clear(self):
+    self.buckets.clear()
+
+  def Near(self, p, radius):
+    'Return an iterator over the items in the buckets overlapping the square within radius of cell p'
+    left, top = self.Bucket((p[0] - radius, p[1] - radius))
+    right, bottom = self.Bucket((p[0] + radius, p[1] + radius))
+    if (right - left + 1) * (bottom - top + 1) > len(self.buckets):
+      # Quicker to look at every bucket there is
+      for (bx, by), bucket in self.buckets.items():
+        if left <= bx <= right and top <= by <= bottom:
+          yield from bucket
+      return
+    for by in range(top, bottom + 1):
+      for bx in range(left, right + 1):
+        bucket = self.buckets.get((bx, by))
+        if bucket:
+          yield from bucket
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Copyright © 2018 Marty White under the GNU GPLv3+
+'Coherent noise for procedural terrain, evaluated a block of cells at a time'
+
+'''
+Noise is a pure function of (seed, x, y) in world coordinates: lattice values come from
+hashing their integer coordinates rather than from a stateful random number generator.
+So any rectangle of the world can be evaluated on its own, and adjacent rectangles
+(e.g. chunks generated by different worker processes) join up seamlessly.
+'''
+
+import zlib
+
+import numpy as np
+
+_M1 = np.uint64(0x9E3779B97F4A7C15)
+_M2 = np.uint64(0xC2B2AE3D27D4EB4F)
+_M3 = np.uint64(0xFF51AFD7ED558CCD)
+_M4 = np.uint64(0xC4CEB9FE1A85EC53)
+
+def FieldSeed(seed, name):
+  'Return a seed for the named field of the world with the given seed'
+  return (seed * 0x100000001 + zlib.crc32(name.encode('utf-8'))) & 0xFFFFFFFFFFFFFFFF
+
+def Hash(seed, ix, iy):
+  'Return uniform random floats in [0,1) for integer arrays ix and iy (broadcast together)'
+  with np.errstate(over='ignore'):
+    h = np.asarray(ix).astype(np.uint64) * _M1 ^ np.asarray(iy).astype(np.uint64) * _M2 ^ np.uint64(seed & 0xFFFFFFFFFFFFFFFF)
+    h ^= h >> np.uint64(33)
+    h *= _M3
+    h ^= h >> np.uint64(33)
+    h *= _M4
+    h ^= h >> np.uint64(33)
+  return (h >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+def ValueNoise(seed, rect, scale):
+  '''Return an array [rows, cols] of smoothly interpolated random values in [0,1)
+     over rect (left, top, width, height), with features about scale cells across.'''
+  left, top, width, height = rect
+  xs = (left + np.arange(width)) / scale
+  ys = (top + np.arange(height)) / scale
+  ix = np.floor(xs).astype(np.int64)
+  iy = np.floor(ys).astype(np.int64)
+  # Smoothstep weights along each axis
+  tx = xs - ix
+  ty = ys - iy
+  tx = tx * tx * (3 - 2*tx)
+  ty = ty * ty * (3 - 2*ty)
+  # Values at the lattice points covering rect, interpolated first along each lattice row, then between rows
+  lattice = Hash(seed, np.arange(ix[0], ix[-1]+2)[np.newaxis,:], np.arange(iy[0], iy[-1]+2)[:,np.newaxis]).astype(np.float32)
+  cx = ix - ix[0]
+  cy = iy - iy[0]
+  tx = tx.astype(np.float32)
+  ty = ty.astype(np.float32)[:,np.newaxis]
+  rows = lattice[:,cx] * (1 - tx) + lattice[:,cx+1] * tx
+  return rows[cy] * (1 - ty) + rows[cy+1] * ty
+
+def FractalNoise(seed, rect, scale, octaves=4, persistence=0.5):
+  '''Return an array [rows, cols] of layered ValueNoise over rect, normalized to [0,1),
+     each octave having half the feature size and persistence times the weight of the last'''
+  total = np.zeros((rect[3], rect[2]), dtype=np.float32)
+  weight = 1.0
+  weights = 0.0
+  for octave in range(octaves):
+    total += weight * ValueNoise(seed + octave, rect, scale)
+    weights += weight
+    weight *= persistence
+    scale /= 2
+  return total / weights